@@ -0,0 +1,193 @@
+import asyncio
+import errno
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import DEFAULT_METRICS, Metrics
+
+# Runs blocking filesystem calls for the asyncio side of FileManager. Calls go
+# to a shared thread pool, at most per_share at a time for each share, so one
+# slow share cannot take every thread. A call that runs past its timeout raises
+# TimeoutError to the caller; the thread itself stays blocked until the OS
+# gives up on the path, which is why the pool is larger than per_share.
+#
+# Calls that fail because the share is slow or gone are retried with
+# exponential backoff. Each share has a circuit breaker: after
+# breaker_threshold such failures in a row the share is treated as down and
+# calls fail fast with ShareUnavailable until breaker_cooldown has passed,
+# when a single call is let through to probe it.
+
+log = logging.getLogger(__name__)
+
+TRANSIENT_ERRNOS = {errno.ETIMEDOUT, errno.EHOSTDOWN, errno.EHOSTUNREACH, errno.ENETDOWN, errno.ENETUNREACH,
+                    errno.ENETRESET, errno.ECONNRESET, errno.ECONNABORTED, errno.ECONNREFUSED, errno.ESTALE}
+# ERROR_BAD_NETPATH, ERROR_UNEXP_NET_ERR, ERROR_NETNAME_DELETED, ERROR_BAD_NET_NAME,
+# ERROR_SEM_TIMEOUT and ERROR_NETWORK_UNREACHABLE.
+TRANSIENT_WINERRORS = {53, 59, 64, 67, 121, 1231}
+
+class ShareUnavailable(OSError):
+    # Raised without touching the share while its circuit breaker is open.
+    pass
+
+def is_transient(e:BaseException) -> bool:
+    # True for errors that say the share is slow or unreachable rather than
+    # something about the file itself.
+    if isinstance(e, (ShareUnavailable, TimeoutError, ConnectionError)):
+        return True
+    if not isinstance(e, OSError):
+        return False
+    return e.errno in TRANSIENT_ERRNOS or getattr(e, 'winerror', None) in TRANSIENT_WINERRORS
+
+def share_key(path:str) -> str:
+    # \\server\share for UNC paths, the drive on Windows, the first directory
+    # below / everywhere else.
+    path = os.path.abspath(path)
+    drive, rest = os.path.splitdrive(path)
+    if drive:
+        return drive.lower()
+    parts = [part for part in rest.split(os.sep) if part]
+    return os.sep + parts[0] if parts else os.sep
+
+class CircuitBreaker:
+    def __init__(self, threshold:int=5, cooldown:float=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at:float|None = None
+        self.probing = False
+
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.opened_at is not None and (self.probing or time.monotonic() - self.opened_at < self.cooldown)
+
+    def retry_after(self) -> float:
+        # Seconds until the next probe is let through.
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.probing or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> bool:
+        # Returns True when this failure opened the breaker.
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                opened = self.opened_at is None
+                self.opened_at = time.monotonic()
+                self.probing = False
+                return opened
+            return False
+
+class AsyncIO:
+    def __init__(self, per_share:int=8, max_workers:int=32, timeout:float|None=30.0, retries:int=2, backoff:float=0.5, max_backoff:float=10.0,
+                 breaker_threshold:int=5, breaker_cooldown:float=30.0, metrics:Metrics|None=None):
+        self.per_share = per_share
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.metrics = metrics if metrics else DEFAULT_METRICS
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='aio')
+        self.breakers:dict[str, CircuitBreaker] = {}
+        self.breakers_lock = threading.Lock()
+        # Semaphores belong to the event loop they are used on, and the sync
+        # wrappers start a new loop per call. Each thread keeps only those of
+        # the loop it is running: a semaphore refers to its loop, so keeping
+        # them per loop, even weakly, would keep every finished loop alive.
+        self.local = threading.local()
+
+    def _semaphore(self, path:str) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if getattr(self.local, 'loop', None) is not loop:
+            self.local.loop = loop
+            self.local.semaphores = {}
+        loop_semaphores = self.local.semaphores
+        key = share_key(path)
+        semaphore = loop_semaphores.get(key)
+        if semaphore is None:
+            semaphore = loop_semaphores[key] = asyncio.Semaphore(self.per_share)
+        return semaphore
+
+    def breaker(self, path:str) -> CircuitBreaker:
+        key = share_key(path)
+        with self.breakers_lock:
+            breaker = self.breakers.get(key)
+            if breaker is None:
+                breaker = self.breakers[key] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return breaker
+
+    def available(self, path:str) -> bool:
+        # False while the breaker of path's share is open.
+        return not self.breaker(path).is_open()
+
+    async def _call(self, path:str, func, args, timeout:float|None):
+        async with self._semaphore(path):
+            future = asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+            if timeout is None:
+                return await future
+            try:
+                return await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                raise TimeoutError(f'{getattr(func, "__name__", func)} timed out after {timeout}s on {path}') from None
+
+    async def run(self, path:str, func, *args, timeout:float|None=None):
+        # Runs func(*args) on the pool under the semaphore of path's share,
+        # retrying transient failures while the share's breaker allows it.
+        timeout = self.timeout if timeout is None else timeout
+        breaker = self.breaker(path)
+        attempt = 0
+        while True:
+            if not breaker.allow():
+                self.metrics.count('io_rejected')
+                raise ShareUnavailable(errno.EHOSTDOWN, f'{share_key(path)} is unavailable, retrying in {breaker.retry_after():.0f}s', path)
+            try:
+                result = await self._call(path, func, args, timeout)
+            except Exception as e:
+                if not is_transient(e):
+                    # The share answered, even if the answer was an error.
+                    breaker.record_success()
+                    raise
+                if breaker.record_failure():
+                    self.metrics.count('breaker_opened')
+                    log.warning('%s looks unavailable (%s), pausing for %gs', share_key(path), e, breaker.cooldown)
+                if attempt >= self.retries or breaker.is_open():
+                    raise
+                attempt += 1
+                self.metrics.count('io_retries')
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                continue
+            breaker.record_success()
+            return result
+
+    async def settle(self, path:str, func, *args, timeout:float|None=None):
+        # Like run(), but returns the exception instead of raising it.
+        try:
+            return await self.run(path, func, *args, timeout=timeout)
+        except Exception as e:
+            return e
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
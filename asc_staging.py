@@ -0,0 +1,81 @@
+import datetime
+import os
+import re
+
+from copier import list_folder
+
+asc_folder_regex = re.compile(r"\d+.\d+_ASC_\((\d+)\)")
+
+# Keeps track of the M.D_ASC_(n) folder in an NC folder. The folder is found
+# (or created) and listed once; after that its contents are tracked from the
+# copies made into it, and it is renamed only when the file count changes. A
+# stat of the folder before each gather notices files added or removed by
+# someone else, in which case it is listed again.
+
+def asc_folder_name(day:datetime.date, count:int) -> str:
+    return f'{day.month}.{day.day}_ASC_({count})'
+
+class AscStaging:
+    def __init__(self, root:str, day:datetime.date|None=None):
+        self.root = root
+        self.day = day
+        self.folder:str|None = None
+        # File name -> (size, mtime) of what is in the folder.
+        self.listing:dict[str, tuple[int, float]] = {}
+        self.folder_mtime:float|None = None
+
+    def _today(self) -> datetime.date:
+        return self.day if self.day else datetime.date.today()
+
+    def path(self) -> str:
+        return os.path.join(self.root, self.folder)
+
+    def find(self) -> str|None:
+        # The name of the ASC folder on disk, without creating one.
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if asc_folder_regex.match(entry.name) and entry.is_dir():
+                    return entry.name
+        return None
+
+    def _locate(self):
+        self.folder = self.find()
+        if self.folder is None:
+            self.folder = asc_folder_name(self._today(), 0)
+            os.mkdir(self.path())
+        self._relist()
+
+    def _relist(self):
+        self.listing = list_folder(self.path())
+        self.folder_mtime = os.stat(self.path()).st_mtime
+
+    def prepare(self) -> str:
+        # Returns the folder to copy into, with self.listing up to date.
+        if self.folder is None:
+            self._locate()
+            return self.path()
+        try:
+            if os.stat(self.path()).st_mtime != self.folder_mtime:
+                self._relist()
+        except FileNotFoundError:
+            # Renamed or removed by someone else.
+            self._locate()
+        return self.path()
+
+    def record_copies(self, copied:dict[str, tuple[int, float]], removed=()):
+        # copied maps the names that were just copied in to their (size, mtime);
+        # removed are the names that were just taken out.
+        self.listing.update(copied)
+        for name in removed:
+            self.listing.pop(name, None)
+        self.folder_mtime = os.stat(self.path()).st_mtime
+
+    def update_name(self) -> bool:
+        # Renames the folder to match its file count. Returns True when it was
+        # renamed.
+        folder = asc_folder_name(self._today(), len(self.listing))
+        if folder == self.folder:
+            return False
+        os.rename(self.path(), os.path.join(self.root, folder))
+        self.folder = folder
+        return True
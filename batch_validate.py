@@ -0,0 +1,195 @@
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from file_manager import check_prg, is_gather_folder, is_prg_name, read_prg
+from records import IssueType, is_gatherable, to_issue_types
+
+# Re-validates whole archives offline, e.g. months of Y/M/D folders after a
+# rule changed. Paths are streamed from folders (walked in sorted order, so a
+# rerun sees them in the same order) or from lists of paths, checked on a
+# process pool a chunk at a time, and written as JSON Lines or CSV as they
+# come in. Only a couple of chunks are in memory at any time, however large
+# the archive is.
+#
+# After every chunk the number of paths done, the size of the report and the
+# summary so far go to a checkpoint file next to the report; --resume skips
+# what was done and cuts off anything written after the last checkpoint.
+
+log = logging.getLogger(__name__)
+
+CSV_FIELDS = ['path', 'issues', 'case_type', 'gatherable', 'error']
+
+def walk_prgs(folder:str, include_gathered:bool=False):
+    # The programs under folder, in a stable order. ALL and ASC folders only
+    # hold copies, so they are left out unless include_gathered.
+    for dirpath, dirnames, filenames in os.walk(folder, onerror=lambda e: log.warning("Could not list %s: %s", e.filename, e)):
+        dirnames[:] = sorted(name for name in dirnames if include_gathered or not is_gather_folder(name))
+        for name in sorted(filenames):
+            if is_prg_name(name):
+                yield os.path.join(dirpath, name)
+
+def read_path_list(path:str):
+    # One path per line; '-' reads them from stdin.
+    file = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    try:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if file is not sys.stdin:
+            file.close()
+
+def iter_paths(sources, include_gathered:bool=False):
+    # A source is a folder to walk, or a file listing paths.
+    for source in sources:
+        if os.path.isdir(source):
+            yield from walk_prgs(source, include_gathered)
+        else:
+            yield from read_path_list(source)
+
+def check_paths(paths:list[str]) -> list[tuple]:
+    # Runs in the pool: (path, issue flags, case type, error) per path.
+    results = []
+    for path in paths:
+        try:
+            result = check_prg(os.path.basename(path), read_prg(path))
+            results.append((path, int(result.issues), result.case_type, None))
+        except Exception as e:
+            results.append((path, 0, None, f'{type(e).__name__}: {e}'))
+    return results
+
+def new_summary() -> dict:
+    return {'files':0, 'ok':0, 'gatherable':0, 'errors':0, 'issues':{issue.name:0 for issue in IssueType}}
+
+def add_to_summary(summary:dict, issues:int, error:str|None):
+    summary['files'] += 1
+    if error:
+        summary['errors'] += 1
+        return
+    issue_types = to_issue_types(issues)
+    if not issue_types:
+        summary['ok'] += 1
+    if is_gatherable(issues):
+        summary['gatherable'] += 1
+    for issue in issue_types:
+        summary['issues'][issue.name] += 1
+
+def format_rows(rows:list[tuple], output_format:str) -> bytes:
+    if output_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        for path, issues, case_type, error in rows:
+            writer.writerow([path, ';'.join(issue.name for issue in to_issue_types(issues)), case_type or '', '' if error else int(is_gatherable(issues)), error or ''])
+        return buffer.getvalue().encode('utf-8')
+    lines = []
+    for path, issues, case_type, error in rows:
+        row = {'path':path, 'issues':[issue.name for issue in to_issue_types(issues)], 'case_type':case_type}
+        if error:
+            row['error'] = error
+        else:
+            row['gatherable'] = is_gatherable(issues)
+        lines.append(json.dumps(row))
+    return ''.join(line + '\n' for line in lines).encode('utf-8')
+
+class Checkpoint:
+    def __init__(self, path:str, sources:list[str], output_format:str):
+        self.path = path
+        self.sources = sources
+        self.output_format = output_format
+        self.done = 0
+        self.offset = 0
+        self.summary = new_summary()
+
+    def load(self) -> bool:
+        # False when there is nothing to resume from. A checkpoint of another
+        # run is an error rather than a silently wrong report.
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return False
+        if data['sources'] != self.sources or data['format'] != self.output_format:
+            raise ValueError(f"{self.path} belongs to a run over {data['sources']} as {data['format']}")
+        self.done = data['done']
+        self.offset = data['offset']
+        summary = new_summary()
+        summary.update({key:value for key, value in data['summary'].items() if key != 'issues'})
+        summary['issues'].update(data['summary']['issues'])
+        self.summary = summary
+        return True
+
+    def save(self):
+        data = {'sources':self.sources, 'format':self.output_format, 'done':self.done, 'offset':self.offset, 'summary':self.summary}
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+def chunks(paths, size:int):
+    paths = iter(paths)
+    while chunk := list(itertools.islice(paths, size)):
+        yield chunk
+
+def run_batch(sources:list[str], output:str, output_format:str='jsonl', workers:int|None=None, chunk_size:int=2000, task_size:int=50,
+              resume:bool=False, include_gathered:bool=False, progress=None) -> dict:
+    # Validates everything under sources into output and returns the summary.
+    # progress(files done, seconds) is called after every chunk.
+    checkpoint = Checkpoint(output + '.checkpoint', [os.path.abspath(source) if os.path.isdir(source) else source for source in sources], output_format)
+    if resume and checkpoint.load():
+        log.info("Resuming after %d files", checkpoint.done)
+    else:
+        checkpoint.offset = 0
+    paths = itertools.islice(iter_paths(sources, include_gathered), checkpoint.done, None)
+
+    start = time.perf_counter()
+    with open(output, 'ab' if checkpoint.offset else 'wb') as report, ProcessPoolExecutor(max_workers=workers) as pool:
+        # Drops rows written after the last checkpoint.
+        report.truncate(checkpoint.offset)
+        report.seek(checkpoint.offset)
+        if not checkpoint.offset and output_format == 'csv':
+            report.write((','.join(CSV_FIELDS) + '\n').encode('utf-8'))
+
+        def submit(chunk):
+            return [pool.submit(check_paths, chunk[i:i + task_size]) for i in range(0, len(chunk), task_size)]
+
+        # The next chunk is checked while the current one is written.
+        chunk_iter = chunks(paths, chunk_size)
+        pending = [submit(chunk) for chunk in itertools.islice(chunk_iter, 1)]
+        while pending:
+            futures = pending.pop(0)
+            pending += [submit(chunk) for chunk in itertools.islice(chunk_iter, 1)]
+            rows = [row for future in futures for row in future.result()]
+            for path, issues, case_type, error in rows:
+                add_to_summary(checkpoint.summary, issues, error)
+            report.write(format_rows(rows, output_format))
+            report.flush()
+            os.fsync(report.fileno())
+            checkpoint.done += len(rows)
+            checkpoint.offset = report.tell()
+            checkpoint.save()
+            if progress:
+                progress(checkpoint.done, time.perf_counter() - start)
+    checkpoint.remove()
+    return checkpoint.summary
+
+def print_summary(summary:dict, file=sys.stdout):
+    print(f"{summary['files']} files, {summary['ok']} OK, {summary['gatherable']} gatherable, {summary['errors']} could not be checked", file=file)
+    for name, count in summary['issues'].items():
+        if count:
+            print(f"{name}\t{count}", file=file)
@@ -0,0 +1,127 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+
+import file_manager
+from change_source import PollingChangeSource
+from nc_tree import build_tree
+
+# Times how long it takes to get going, each run in a fresh interpreter so
+# nothing is already imported or cached:
+#   import gui            what the GUI pays before it can draw anything
+#   import file_manager   what the loader thread pays
+#   open state            FileManager plus open_store on a saved state
+#   window / ready        App until the window is drawn and until the saved
+#                         issues are shown (needs a display, skipped without)
+# The window time is checked against --budget so a slow import sneaking back
+# into the GUI shows up as a failing run.
+
+IMPORT_SCRIPT = '''
+import sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+'''
+
+OPEN_SCRIPT = '''
+import sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+import file_manager
+from change_source import PollingChangeSource
+fm = file_manager.FileManager({root!r}, change_source_factory=lambda root: PollingChangeSource(root))
+fm.open_store({db!r})
+fm.issues()
+print(time.perf_counter() - start)
+fm.close()
+'''
+
+WINDOW_SCRIPT = '''
+import sys, time, json
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+import gui
+def open_manager():
+    import file_manager
+    from change_source import PollingChangeSource
+    fm = file_manager.FileManager({root!r}, change_source_factory=lambda root: PollingChangeSource(root))
+    fm.open_store({db!r})
+    return fm
+gui.App.iconbitmap = lambda self, *args: None
+app = gui.App(open_manager)
+app.started = start
+def check():
+    if 'ready' in app.startup_times:
+        print(json.dumps(app.startup_times))
+        app.on_close()
+    else:
+        app.after(10, check)
+app.after(10, check)
+app.mainloop()
+'''
+
+def run_script(script:str) -> str:
+    completed = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, timeout=120)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else f'exit code {completed.returncode}')
+    return completed.stdout.strip().splitlines()[-1]
+
+def has_display() -> bool:
+    if os.name == 'nt' or sys.platform == 'darwin':
+        return True
+    return bool(os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the cold start of the GUI and the file manager.')
+    parser.add_argument('--files', type=int, default=5000, help='programs in the saved state')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per phase; the median is reported')
+    parser.add_argument('--budget', type=float, default=0.5, help='seconds allowed until the window is drawn')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as base:
+        root = build_tree(base, args.files)['root']
+        db = os.path.join(base, 'state.db')
+        fm = file_manager.FileManager(root, change_source_factory=lambda root: PollingChangeSource(root))
+        fm.open_store(db)
+        fm.process()
+        fm.close()
+
+        phases = {
+            'import gui':lambda: float(run_script(IMPORT_SCRIPT.format(repo=str(REPO_DIR), module='gui'))),
+            'import file_manager':lambda: float(run_script(IMPORT_SCRIPT.format(repo=str(REPO_DIR), module='file_manager'))),
+            'open state':lambda: float(run_script(OPEN_SCRIPT.format(repo=str(REPO_DIR), root=root, db=db))),
+        }
+        results = {phase:statistics.median(measure() for _ in range(args.runs)) for phase, measure in phases.items()}
+
+        if has_display():
+            runs = [json.loads(run_script(WINDOW_SCRIPT.format(repo=str(REPO_DIR), root=root, db=db))) for _ in range(args.runs)]
+            results['window'] = statistics.median(run['window'] for run in runs)
+            results['ready'] = statistics.median(run['ready'] for run in runs)
+        else:
+            print('No display, skipping the window phases')
+
+    print(f'{"phase":<20} {"seconds":>9}')
+    for phase, seconds in results.items():
+        print(f'{phase:<20} {seconds:>9.3f}')
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'files':args.files, 'budget':args.budget, 'results':results}, file, indent=2)
+
+    if results.get('window', 0.0) > args.budget:
+        print(f'Window took {results["window"]:.3f}s, over the {args.budget:.3f}s budget')
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import file_manager
+from change_source import PollingChangeSource
+from nc_tree import build_tree, simulated_latency
+from validation import ValidationCache, ValidationEngine
+
+# Times the scan, validate and gather paths against synthetic NC trees:
+#   cold scan       first process() on an empty FileManager
+#   warm scan       process() again with nothing changed
+#   reload          process() after reopening the SQLite state
+#   validate        ValidationEngine over every program, no cache
+#   gather cold     copy_all_valid_files into a partly filled ALL folder
+#   gather warm     copy_all_valid_files again with nothing left to copy
+#   asc cold/warm   the same for copy_asc_files
+# Run it before and after a change with the same arguments and compare.
+
+def make_manager(root:str, io_workers:int, parse_workers:int) -> file_manager.FileManager:
+    return file_manager.FileManager(root, change_source_factory=lambda root: PollingChangeSource(root, ignore=file_manager.is_gather_folder),
+                                    validator=ValidationEngine(file_manager.read_prg, file_manager.check_prg, io_workers, parse_workers, ValidationCache()))
+
+def measure(label:str, func, count:int, latency:float, memory:bool) -> dict:
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with simulated_latency(latency):
+        func()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    result = {'phase':label, 'files':count, 'seconds':round(elapsed, 4), 'files_per_second':round(count / elapsed, 1) if elapsed else 0.0}
+    if memory:
+        result['peak_kib'] = round(peak / 1024, 1)
+    return result
+
+def run(size:int, args) -> list[dict]:
+    with tempfile.TemporaryDirectory() as base:
+        stats = build_tree(base, size, seed=args.seed, error_rate=args.error_rate, duplicate_rate=args.duplicate_rate, body_lines=args.body_lines)
+        root = stats['root']
+        count = stats['files'] + stats['duplicates']
+        db_path = os.path.join(base, 'state.db')
+        results = []
+
+        fm = make_manager(root, args.io_workers, args.parse_workers)
+        fm.open_store(db_path)
+        results.append(measure('cold scan', fm.process, count, args.latency, args.memory))
+        results.append(measure('warm scan', fm.process, count, args.latency, args.memory))
+
+        gathered = sum(1 for record in fm.processed_files.values() if not record.issues) - stats['gathered']
+        results.append(measure('gather cold', fm.copy_all_valid_files, gathered, args.latency, args.memory))
+        results.append(measure('gather warm', fm.copy_all_valid_files, gathered, args.latency, args.memory))
+        asc_count = sum(1 for record in fm.processed_files.values() if not record.issues and record.case_type == 'ASC')
+        results.append(measure('asc cold', fm.copy_asc_files, asc_count, args.latency, args.memory))
+        results.append(measure('asc warm', fm.copy_asc_files, asc_count, args.latency, args.memory))
+        fm.close()
+
+        fm = make_manager(root, args.io_workers, args.parse_workers)
+        fm.open_store(db_path)
+        results.append(measure('reload', fm.process, count, args.latency, args.memory))
+        fm.close()
+
+        requests = []
+        for dir_path, _, names in os.walk(root):
+            if file_manager.is_gather_folder(dir_path):
+                continue
+            for name in names:
+                file_stat = os.stat(os.path.join(dir_path, name))
+                requests.append((os.path.join(dir_path, name), file_stat.st_size, file_stat.st_mtime))
+        engine = ValidationEngine(file_manager.read_prg, file_manager.check_prg, args.io_workers, args.parse_workers)
+        if args.parse_workers:
+            engine.validate(requests[:2])
+        results.append(measure('validate', lambda: engine.validate(requests), len(requests), args.latency, args.memory))
+        engine.close()
+
+        for result in results:
+            result['size'] = size
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark scan, validate and gather on synthetic NC trees.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000], help='programs per tree, e.g. 100 1000 10000 100000')
+    parser.add_argument('--latency', type=float, default=0.0, help='simulated seconds per stat, listing, open or copy')
+    parser.add_argument('--io-workers', type=int, default=8)
+    parser.add_argument('--parse-workers', type=int, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--duplicate-rate', type=float, default=0.02)
+    parser.add_argument('--body-lines', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory', action='store_true', help='record peak memory per phase (slower)')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    print(f'{"size":>7} {"phase":<12} {"seconds":>9} {"files/s":>11}' + (f' {"peak KiB":>10}' if args.memory else ''))
+    for size in args.sizes:
+        for result in run(size, args):
+            results.append(result)
+            line = f'{result["size"]:>7} {result["phase"]:<12} {result["seconds"]:>9.3f} {result["files_per_second"]:>11.1f}'
+            if args.memory:
+                line += f' {result["peak_kib"]:>10.1f}'
+            print(line)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
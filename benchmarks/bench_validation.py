@@ -0,0 +1,88 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import file_manager
+from validation import ValidationCache, ValidationEngine
+
+SAMPLE_PRG = """%O{number} (ASC CASE)
+$0
+#100=12.5
+#101=1
+#102=1
+#103=1
+#104=1
+#105=1
+$1
+T0100 (CUT-OFF)
+G00
+G01 12.5
+$2
+M30
+"""
+
+def write_programs(directory:str, count:int) -> list[str]:
+    paths = []
+    for i in range(count):
+        number = 1000 + i
+        path = os.path.join(directory, f'{number}.prg')
+        with open(path, 'w') as file:
+            file.write(SAMPLE_PRG.format(number=number) + 'G01 X1.0 Z-1.0\n' * 200)
+        paths.append(path)
+    return paths
+
+def slow_read(latency:float):
+    def read(path):
+        time.sleep(latency)
+        return file_manager.read_prg(path)
+    return read
+
+def slow_check(latency:float):
+    def check(path):
+        time.sleep(latency)
+        return file_manager.check_file(path)
+    return check
+
+def timed(label:str, func, count:int):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f'{label:<32} {elapsed:8.3f}s  {count / elapsed:10.1f} files/s')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare serial check_file with the ValidationEngine.')
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--io-workers', type=int, default=8)
+    parser.add_argument('--parse-workers', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.002, help='simulated seconds per file read')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_programs(directory, args.files)
+        requests = [(path, os.stat(path).st_size, os.stat(path).st_mtime) for path in paths]
+        check = slow_check(args.latency)
+        read = slow_read(args.latency)
+
+        timed('serial check_file', lambda: [check(path) for path in paths], len(paths))
+
+        engine = ValidationEngine(read, file_manager.check_prg, io_workers=args.io_workers)
+        timed(f'threads ({args.io_workers})', lambda: engine.validate(requests), len(paths))
+        engine.close()
+
+        engine = ValidationEngine(read, file_manager.check_prg, io_workers=args.io_workers, parse_workers=args.parse_workers)
+        engine.validate(requests[:2])
+        timed(f'threads ({args.io_workers}) + processes ({args.parse_workers})', lambda: engine.validate(requests), len(paths))
+        engine.close()
+
+        engine = ValidationEngine(read, file_manager.check_prg, io_workers=args.io_workers, cache=ValidationCache())
+        timed('cold cache', lambda: engine.validate(requests), len(paths))
+        timed('warm cache', lambda: engine.validate(requests), len(paths))
+        engine.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import builtins
+import errno
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import file_manager
+from aio import AsyncIO
+from change_source import PollingChangeSource
+from metrics import Metrics
+from nc_tree import build_tree
+
+# A local folder standing in for the SMB share, with faults that can be
+# switched on while FileManager is running against it:
+#   down        every call under the folder fails with EHOSTDOWN
+#   hang        every call under the folder blocks for this many seconds
+#   error_rate  this fraction of calls fails with ETIMEDOUT
+# Calls for paths outside the folder are left alone.
+#
+# Run on its own it drills an outage: scan, take the share down, gather
+# (which spools), bring it back and check the spooled copies arrive. While the
+# share is down or hanging, update() (the change source's poll and the scan)
+# must come back within a few call deadlines rather than the OS timeout.
+
+class FaultyShare:
+    PATCHED = [(os, 'stat'), (os, 'scandir'), (os, 'listdir'), (os, 'mkdir'), (os, 'rename'), (os, 'replace'), (os, 'remove'),
+               (shutil, 'copy2'), (builtins, 'open')]
+
+    def __init__(self, root:str, seed:int=0):
+        self.root = os.path.abspath(root)
+        self.down = False
+        self.hang = 0.0
+        self.error_rate = 0.0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.faults = 0
+        self.originals = []
+
+    def _on_share(self, path) -> bool:
+        if isinstance(path, int):
+            return False
+        try:
+            path = os.path.abspath(os.fspath(path))
+        except TypeError:
+            return False
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def _fault(self, path):
+        with self.lock:
+            self.calls += 1
+            failing = self.down or (self.error_rate and self.random.random() < self.error_rate)
+            if failing:
+                self.faults += 1
+        if self.hang:
+            time.sleep(self.hang)
+        if self.down:
+            raise OSError(errno.EHOSTDOWN, 'Host is down', os.fspath(path))
+        if failing:
+            raise OSError(errno.ETIMEDOUT, 'Connection timed out', os.fspath(path))
+
+    def _wrap(self, func):
+        def wrapper(*args, **kwargs):
+            paths = [arg for arg in args[:2] if isinstance(arg, (str, bytes, os.PathLike))]
+            for path in paths:
+                if self._on_share(path):
+                    self._fault(path)
+                    break
+            return func(*args, **kwargs)
+        return wrapper
+
+    def __enter__(self):
+        self.originals = [(module, attribute, getattr(module, attribute)) for module, attribute in self.PATCHED]
+        for module, attribute, func in self.originals:
+            setattr(module, attribute, self._wrap(func))
+        return self
+
+    def __exit__(self, *exc):
+        for module, attribute, func in self.originals:
+            setattr(module, attribute, func)
+        self.originals = []
+
+def drill(files:int, timeout:float, cooldown:float) -> bool:
+    base = tempfile.mkdtemp(prefix='faulty_share_')
+    try:
+        stats = build_tree(base, files, gathered_rate=0.0)
+        metrics = Metrics()
+        # Polled on every update, so each update() reaches the share.
+        change_source_factory = lambda root: PollingChangeSource(root, ignore=file_manager.is_gather_folder, min_interval=0.0, max_interval=0.0)
+        fm = file_manager.FileManager(stats['root'], change_source_factory=change_source_factory, metrics=metrics,
+                                      aio=AsyncIO(timeout=timeout, retries=1, backoff=0.05, breaker_threshold=3, breaker_cooldown=cooldown, metrics=metrics))
+        # Two attempts of one deadline each, plus the backoff and some slack.
+        update_limit = 2 * timeout + 0.5
+        update_times = []
+
+        def timed_update():
+            start = time.perf_counter()
+            fm.update(timeout=0.1)
+            update_times.append(time.perf_counter() - start)
+            return update_times[-1]
+
+        with FaultyShare(base) as share:
+            fm.update()
+            print(f"scanned {len(fm.processed_files)} programs")
+
+            share.down = True
+            start = time.perf_counter()
+            copied = fm.copy_all_valid_files()
+            spooled = sum(len(names) for names in fm.spool.values())
+            print(f"share down: copied {len(copied)}, spooled {spooled} in {time.perf_counter() - start:.2f}s")
+            paused = not fm.process()
+            print(f"share down: scan paused {paused}, breaker open {not fm.aio.available(fm.root)}")
+            print(f"share down: update took {timed_update():.2f}s")
+
+            share.down = False
+            share.hang = timeout * 2
+            time.sleep(cooldown)
+            print(f"share hanging: update took {timed_update():.2f}s")
+            time.sleep(cooldown)
+            fm.process()
+            print(f"share hanging: breaker open {not fm.aio.available(fm.root)}, spool {sum(len(names) for names in fm.spool.values())}")
+
+            share.hang = 0.0
+            time.sleep(cooldown)
+            fm.process()
+            all_folder = os.path.join(fm.root, 'ALL')
+            gathered = len(os.listdir(all_folder)) if os.path.isdir(all_folder) else 0
+            print(f"share back: spool {sum(len(names) for names in fm.spool.values())}, {gathered} programs in ALL")
+            print(f"{share.calls} calls, {share.faults} faults, counters {metrics.snapshot()['counters']}")
+        fm.close()
+        if max(update_times) > update_limit:
+            print(f"update() took {max(update_times):.2f}s, more than {update_limit:.2f}s")
+            return False
+        return not fm.spool and gathered == spooled
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run FileManager through a simulated share outage.')
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--timeout', type=float, default=0.2, help='per call deadline in seconds')
+    parser.add_argument('--cooldown', type=float, default=0.5, help='circuit breaker cooldown in seconds')
+    args = parser.parse_args()
+    ok = drill(args.files, args.timeout, args.cooldown)
+    print('OK' if ok else 'FAILED')
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
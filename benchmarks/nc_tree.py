@@ -0,0 +1,143 @@
+import argparse
+import builtins
+import contextlib
+import datetime
+import os
+import random
+import shutil
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import file_manager
+from prg_parser import UG_CASE_TYPES
+
+# Builds synthetic NC trees shaped like the share:
+#   <base>/Y2024/M03/D05/1. CAM/3. NC files/<job folders>/<number>.prg
+# plus an ALL folder and an M.D_ASC_(n) folder that already hold part of a
+# previous gather. Errors and duplicates are injected at fixed rates from a
+# seeded random generator, so the same arguments always build the same tree.
+
+CASE_HEADERS = {'ASC':'ASC', 'TLOC':'TLOC', 'AOT':'AOT14', 'ATPL':'ATPL', 'DS':'DS'}
+CASE_WEIGHTS = {'ASC':3, 'TLOC':2, 'AOT':1, 'ATPL':1, 'DS':3}
+
+ERRORS = ('part_length', 'subprogram', 'ug_values', 'internal_name', 'invalid_name')
+
+def program(number:int, case_type:str='DS', part_length:float=12.5, error:str|None=None, body_lines:int=200) -> str:
+    header_number = number + 1 if error == 'internal_name' else number
+    lines = [f'%O{header_number} ({CASE_HEADERS[case_type]} CASE)', '$0', 'G00 G40 G80 G99', f'#100={part_length}']
+    if case_type in UG_CASE_TYPES:
+        ug_variables = ('#101=', '#102=', '#103=', '#104=', '#105=')
+        if error == 'ug_values':
+            ug_variables = ug_variables[:-1]
+        lines += [f'{variable}1.0' for variable in ug_variables]
+    lines += ['G01 X1.0 Z-1.0 F0.2'] * body_lines
+
+    cut_off = part_length + 0.5 if error == 'part_length' else part_length
+    if error != 'subprogram':
+        lines.append('$1')
+    lines.append('T0100 (CUT-OFF)')
+    if case_type == 'ATPL':
+        lines += ['G97 S1200 M03', 'G00 X1.2', 'M08', f'G01 X0 Z{cut_off}']
+    else:
+        lines += ['G97 S1200 M03', f'G01 {cut_off}']
+    lines += ['$2', 'M30', '%']
+    return '\n'.join(lines) + '\n'
+
+def build_tree(base:str, files:int, date:datetime.date|None=None, seed:int=0, error_rate:float=0.05,
+               duplicate_rate:float=0.02, files_per_job:int=25, gathered_rate:float=0.5, body_lines:int=200) -> dict:
+    # Returns the NC folder and the counts that were generated, so callers can
+    # check a scan found what was planted.
+    rng = random.Random(seed)
+    root = file_manager.remote_prg_path(date, base)
+    os.makedirs(root, exist_ok=True)
+    today = date if date else datetime.date.today()
+    all_folder = os.path.join(root, 'ALL')
+    asc_folder = os.path.join(root, f'{today.month}.{today.day}_ASC_(0)')
+    os.makedirs(all_folder, exist_ok=True)
+    os.makedirs(asc_folder, exist_ok=True)
+
+    case_types = list(CASE_WEIGHTS)
+    weights = list(CASE_WEIGHTS.values())
+    stats = {'root':root, 'files':0, 'errors':0, 'duplicates':0, 'gathered':0, 'asc':0}
+    job_folders = []
+    written = []
+
+    for i in range(files):
+        if i % files_per_job == 0:
+            job = os.path.join(root, f'{100 + len(job_folders)} ({rng.randint(1, 9)}) {rng.choice(("Job", "Rework", "Hot"))}')
+            os.makedirs(job, exist_ok=True)
+            job_folders.append(job)
+
+        number = 1000 + i
+        case_type = rng.choices(case_types, weights)[0]
+        error = rng.choice(ERRORS) if rng.random() < error_rate else None
+        name = f'p{number}.prg' if error == 'invalid_name' else f'{number}.prg'
+        part_length = round(rng.uniform(5, 60), 3)
+
+        path = os.path.join(job_folders[-1], name)
+        with open(path, 'w') as file:
+            file.write(program(number, case_type, part_length, error, body_lines))
+        written.append((path, name, case_type, error))
+        stats['files'] += 1
+        stats['errors'] += error is not None
+        stats['asc'] += case_type == 'ASC' and error is None
+
+    for path, name, case_type, error in written:
+        if len(job_folders) > 1 and rng.random() < duplicate_rate:
+            other = rng.choice([job for job in job_folders if job != os.path.dirname(path)])
+            if not os.path.exists(os.path.join(other, name)):
+                shutil.copy2(path, os.path.join(other, name))
+                stats['duplicates'] += 1
+        if error is None and rng.random() < gathered_rate:
+            shutil.copy2(path, os.path.join(all_folder, name))
+            if case_type == 'ASC':
+                shutil.copy2(path, os.path.join(asc_folder, name))
+            stats['gathered'] += 1
+    return stats
+
+@contextlib.contextmanager
+def simulated_latency(seconds:float):
+    # Adds a fixed delay to every stat, listing, open and copy, which is
+    # roughly what each round trip to the SMB share costs. Everything in the
+    # process is slowed down while the context is active.
+    if seconds <= 0:
+        yield
+        return
+
+    def slow(func):
+        def wrapper(*args, **kwargs):
+            time.sleep(seconds)
+            return func(*args, **kwargs)
+        return wrapper
+
+    patched = [(os, 'stat'), (os, 'scandir'), (os, 'listdir'), (os, 'replace'), (shutil, 'copy2'), (builtins, 'open')]
+    originals = [(module, attribute, getattr(module, attribute)) for module, attribute in patched]
+    for module, attribute, func in originals:
+        setattr(module, attribute, slow(func))
+    try:
+        yield
+    finally:
+        for module, attribute, func in originals:
+            setattr(module, attribute, func)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a synthetic NC tree for benchmarking.')
+    parser.add_argument('base', help='folder standing in for the share')
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--date', type=datetime.date.fromisoformat, help='dated folder to build (YYYY-MM-DD), today by default')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    parser.add_argument('--duplicate-rate', type=float, default=0.02)
+    parser.add_argument('--files-per-job', type=int, default=25)
+    parser.add_argument('--body-lines', type=int, default=200)
+    args = parser.parse_args()
+
+    stats = build_tree(args.base, args.files, args.date, args.seed, args.error_rate, args.duplicate_rate, args.files_per_job, body_lines=args.body_lines)
+    for key, value in stats.items():
+        print(f'{key:<12} {value}')
+
+if __name__ == "__main__":
+    main()
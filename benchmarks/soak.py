@@ -0,0 +1,222 @@
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import file_manager
+from change_events import REMOVED_KINDS, ChangeKind
+from change_source import PollingChangeSource
+from metrics import Metrics
+from nc_tree import CASE_WEIGHTS, ERRORS, build_tree, program
+from records import is_gatherable, to_issue_types
+from validation import ValidationCache, ValidationEngine
+
+# Runs the auto-gather loop against a synthetic NC folder that keeps changing,
+# for as long as asked (hours for a real soak), and checks the station does
+# not get heavier over time. Every cycle adds, rewrites and deletes a few
+# programs, keeping the folder the same size, then runs what the
+# worker runs: a scan, the change events into a consumer's view, and a
+# gather into ALL.
+#
+# Memory (traced Python allocations after a collection) and the time of each
+# cycle are sampled. The validation cache is sized to the folder, so it is
+# full from the first scan on rather than filling up during the run; the median of the last window must stay within the
+# allowed growth over the first window after warm-up. With --crash-every the
+# manager is dropped without closing every so many cycles and reopened from
+# its state file, which must give back the same issues.
+
+class ChangingTree:
+    def __init__(self, root:str, seed:int=0, error_rate:float=0.05):
+        self.root = root
+        self.rng = random.Random(seed)
+        self.error_rate = error_rate
+        self.jobs = sorted(entry.path for entry in os.scandir(root) if entry.is_dir() and not file_manager.is_gather_folder(entry.path))
+        self.programs = [os.path.join(job, name) for job in self.jobs for name in sorted(os.listdir(job))]
+        # Programs are added and deleted around this count.
+        self.size = len(self.programs)
+        self.next_number = 100000
+
+    def _write(self, path:str, number:int):
+        error = self.rng.choice(ERRORS) if self.rng.random() < self.error_rate else None
+        case_type = self.rng.choices(list(CASE_WEIGHTS), list(CASE_WEIGHTS.values()))[0]
+        # Written next to the program and swapped in, like CAM saves them.
+        temp_path = os.path.splitext(path)[0] + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(program(number, case_type, round(self.rng.uniform(5, 60), 3), error if error != 'invalid_name' else None, 50))
+        os.replace(temp_path, path)
+
+    def step(self, changes:int):
+        for _ in range(changes):
+            if self.programs and self.rng.random() < 1 / 3:
+                path = self.rng.choice(self.programs)
+                self._write(path, int(os.path.splitext(os.path.basename(path))[0].lstrip('p')))
+            elif len(self.programs) < self.size:
+                self.next_number += 1
+                path = os.path.join(self.rng.choice(self.jobs), f'{self.next_number}.prg')
+                self._write(path, self.next_number)
+                self.programs.append(path)
+            else:
+                path = self.programs.pop(self.rng.randrange(len(self.programs)))
+                os.remove(path)
+
+class IssueView:
+    # What a consumer of the change events (the issue panel) ends up holding.
+    def __init__(self, fm):
+        self.fm = fm
+        self.issues = {}
+        self.reset()
+        fm.events.subscribe(self.on_changes)
+
+    def reset(self):
+        self.issues = {(name, location):issues for name, location, issues, duplicate in self.fm.entries() if issues}
+
+    def on_changes(self, events):
+        if any(event.kind is ChangeKind.RESET for event in events):
+            self.reset()
+            return
+        for event in events:
+            if event.kind in REMOVED_KINDS or not event.issues:
+                self.issues.pop((event.name, event.location), None)
+            else:
+                self.issues[(event.name, event.location)] = event.issues
+
+    def matches(self) -> bool:
+        return {(name, location, issue) for (name, location), issues in self.issues.items() for issue in to_issue_types(issues)} == set(self.fm.issues())
+
+def open_manager(root:str, db:str, metrics:Metrics, cache_entries:int) -> file_manager.FileManager:
+    validator = ValidationEngine(file_manager.read_prg, file_manager.check_prg, cache=ValidationCache(cache_entries), metrics=metrics)
+    fm = file_manager.FileManager(root, change_source_factory=lambda root: PollingChangeSource(root, ignore=file_manager.is_gather_folder),
+                                  validator=validator, metrics=metrics, event_window=0.0, checkpoint_interval=5.0)
+    fm.open_store(db)
+    return fm
+
+def crash(fm:file_manager.FileManager):
+    # Drops the manager the way a killed process would: nothing is saved.
+    fm.change_source.stop()
+    fm.validator.close()
+    fm.aio.close()
+    fm.store.connection.close()
+
+def window_median(samples:list, window:int, last:bool) -> float:
+    return statistics.median(samples[-window:] if last else samples[:window])
+
+def soak(args) -> dict:
+    base = tempfile.mkdtemp(prefix='soak_')
+    try:
+        root = build_tree(base, args.files, seed=args.seed, gathered_rate=0.0, body_lines=50)['root']
+        db = os.path.join(base, 'state.db')
+        metrics = Metrics()
+        fm = open_manager(root, db, metrics, args.files)
+        view = IssueView(fm)
+        tree = ChangingTree(root, args.seed)
+        tracemalloc.start()
+
+        memory = []
+        latency = []
+        crashes = 0
+        mismatches = 0
+        cycle = 0
+        start = time.monotonic()
+        while time.monotonic() - start < args.duration or cycle < args.warmup + 2 * args.window:
+            cycle += 1
+            tree.step(args.changes)
+            pass_start = time.perf_counter()
+            fm.process()
+            fm.events.flush()
+            fm.copy_all_valid_files()
+            elapsed = time.perf_counter() - pass_start
+
+            if args.crash_every and cycle % args.crash_every == 0:
+                issues = sorted(fm.issues(), key=lambda issue: (issue[0], issue[1], issue[2].value))
+                crash(fm)
+                fm = open_manager(root, db, metrics, args.files)
+                view = IssueView(fm)
+                crashes += 1
+                if sorted(fm.issues(), key=lambda issue: (issue[0], issue[1], issue[2].value)) != issues:
+                    mismatches += 1
+                    print(f'cycle {cycle}: issues differ after reopening')
+
+            if cycle > args.warmup:
+                gc.collect()
+                memory.append(tracemalloc.get_traced_memory()[0])
+                latency.append(elapsed)
+            if args.report_every and cycle % args.report_every == 0:
+                print(f'cycle {cycle:>6} {time.monotonic() - start:>8.0f}s {len(fm.processed_files):>7} programs '
+                      f'{memory[-1] / 1024 if memory else 0:>10.0f} KiB {elapsed * 1000:>8.1f} ms')
+            if args.interval:
+                time.sleep(args.interval)
+
+        tracemalloc.stop()
+        fm.process()
+        fm.events.flush()
+        fm.copy_all_valid_files()
+        gathered = set(os.listdir(os.path.join(root, 'ALL')))
+        valid = {name for name, record in fm.processed_files.items() if is_gatherable(record.issues)}
+        result = {
+            'cycles':cycle,
+            'seconds':round(time.monotonic() - start, 1),
+            'programs':len(fm.processed_files),
+            'memory_first_kib':round(window_median(memory, args.window, False) / 1024, 1),
+            'memory_last_kib':round(window_median(memory, args.window, True) / 1024, 1),
+            'latency_first_ms':round(window_median(latency, args.window, False) * 1000, 2),
+            'latency_last_ms':round(window_median(latency, args.window, True) * 1000, 2),
+            'crashes':crashes,
+            'crash_mismatches':mismatches,
+            'view_matches':view.matches(),
+            'all_matches':gathered == valid,
+        }
+        fm.close()
+        return result
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Soak the auto-gather loop against a changing NC folder.')
+    parser.add_argument('--files', type=int, default=2000, help='programs in the folder')
+    parser.add_argument('--duration', type=float, default=120.0, help='seconds to run (e.g. 14400 for four hours)')
+    parser.add_argument('--changes', type=int, default=20, help='programs added, rewritten or deleted per cycle')
+    parser.add_argument('--interval', type=float, default=0.0, help='seconds between cycles')
+    parser.add_argument('--warmup', type=int, default=20, help='cycles before sampling starts')
+    parser.add_argument('--window', type=int, default=50, help='cycles compared at the start and the end')
+    parser.add_argument('--crash-every', type=int, default=0, help='drop and reopen the manager every this many cycles')
+    parser.add_argument('--max-memory-growth', type=float, default=0.10, help='allowed growth of memory between the windows')
+    parser.add_argument('--max-latency-growth', type=float, default=0.50, help='allowed growth of cycle time between the windows')
+    parser.add_argument('--report-every', type=int, default=100, help='print a line every this many cycles (0 for none)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    result = soak(args)
+    for key, value in result.items():
+        print(f'{key:<20} {value}')
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(result, file, indent=2)
+
+    failures = []
+    # A little slack on top of the ratios so tiny values do not flap.
+    if result['memory_last_kib'] > result['memory_first_kib'] * (1 + args.max_memory_growth) + 256:
+        failures.append('memory grew')
+    if result['latency_last_ms'] > result['latency_first_ms'] * (1 + args.max_latency_growth) + 5:
+        failures.append('cycles got slower')
+    if result['crash_mismatches']:
+        failures.append('state was lost in a crash')
+    if not result['view_matches']:
+        failures.append('the change events drifted from the records')
+    if not result['all_matches']:
+        failures.append('ALL does not hold exactly the valid programs')
+    print('FAILED: ' + ', '.join(failures) if failures else 'OK')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
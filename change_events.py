@@ -0,0 +1,108 @@
+import threading
+import time
+from enum import Enum
+from typing import NamedTuple
+
+from records import IssueFlag
+
+# Changes to FileManager's records, for consumers that keep their own view of
+# them (the issue panel, a log). Events are collected by a ChangeBatcher and
+# handed out in batches, with all the changes to one program location inside
+# the coalescing window folded into one event, so a consumer's work follows
+# the number of changed locations rather than the number of programs.
+
+ChangeKind = Enum('ChangeKind', [
+    'FILE_ADDED',
+    'FILE_REVALIDATED',
+    'FILE_REMOVED',
+    'DUPLICATE_ADDED',
+    'DUPLICATE_REVALIDATED',
+    'DUPLICATE_REMOVED',
+    # Everything changed (a new day, a reload); take a full snapshot.
+    'RESET'])
+
+ADDED_KINDS = {ChangeKind.FILE_ADDED, ChangeKind.DUPLICATE_ADDED}
+REMOVED_KINDS = {ChangeKind.FILE_REMOVED, ChangeKind.DUPLICATE_REMOVED}
+REVALIDATED_KIND = {ChangeKind.FILE_ADDED:ChangeKind.FILE_REVALIDATED, ChangeKind.DUPLICATE_ADDED:ChangeKind.DUPLICATE_REVALIDATED}
+ADDED_KIND = {revalidated:added for added, revalidated in REVALIDATED_KIND.items()}
+
+class ChangeEvent(NamedTuple):
+    kind:ChangeKind
+    name:str|None = None
+    location:str|None = None
+    # The issues of the program at this location after the change; 0 for
+    # removals.
+    issues:IssueFlag = IssueFlag(0)
+
+class ChangeBatcher:
+    def __init__(self, window:float=0.5, max_pending:int=10000):
+        # A batch is due window seconds after the first change in it. When
+        # nobody flushes for long enough to collect more than max_pending
+        # changes, they are dropped for a RESET, which tells the consumer to
+        # take a full snapshot instead.
+        self.window = window
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        # (name, location) -> (kind of the first event in the batch, last event)
+        self.pending:dict[tuple, tuple[ChangeKind, ChangeEvent]] = {}
+        self.reset = False
+        self.first_at:float|None = None
+        self.subscribers = []
+
+    def subscribe(self, callback):
+        # callback(events) is called with every batch that is flushed.
+        self.subscribers.append(callback)
+
+    def emit(self, event:ChangeEvent):
+        with self.lock:
+            if self.first_at is None:
+                self.first_at = time.monotonic()
+            if event.kind is ChangeKind.RESET:
+                # Nothing before a reset matters to the consumer.
+                self.pending = {}
+                self.reset = True
+                return
+            key = (event.name, event.location)
+            first = self.pending.get(key)
+            self.pending[key] = (first[0] if first else event.kind, event)
+            if len(self.pending) > self.max_pending:
+                self.pending = {}
+                self.reset = True
+
+    def __len__(self):
+        return len(self.pending) + self.reset
+
+    def due(self) -> bool:
+        with self.lock:
+            return self.first_at is not None and time.monotonic() - self.first_at >= self.window
+
+    def _coalesce(self) -> list[ChangeEvent]:
+        # Called with the lock held.
+        events = [ChangeEvent(ChangeKind.RESET)] if self.reset else []
+        for first_kind, event in self.pending.values():
+            if first_kind in ADDED_KINDS and event.kind in REMOVED_KINDS:
+                # Came and went within the batch.
+                continue
+            if first_kind in REMOVED_KINDS and event.kind in ADDED_KINDS:
+                # Replaced within the batch, so to the consumer it changed.
+                event = event._replace(kind=REVALIDATED_KIND[event.kind])
+            elif first_kind in ADDED_KINDS and event.kind in ADDED_KIND:
+                # New to the consumer, however often it changed since.
+                event = event._replace(kind=ADDED_KIND[event.kind])
+            events.append(event)
+        self.pending = {}
+        self.reset = False
+        self.first_at = None
+        return events
+
+    def flush(self) -> list[ChangeEvent]:
+        # Hands out everything pending, due or not.
+        with self.lock:
+            events = self._coalesce()
+        if events:
+            for callback in self.subscribers:
+                callback(events)
+        return events
+
+    def flush_due(self) -> list[ChangeEvent]:
+        return self.flush() if self.due() else []
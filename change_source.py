@@ -0,0 +1,249 @@
+import asyncio
+import os
+import threading
+import time
+
+from aio import is_transient
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+# A change source tells FileManager which directories need to be rescanned.
+# wait_for_changes() returns a set of directory paths, an empty set when nothing
+# changed, or None when a full rescan of the tree is required.
+#
+# With an aio (FileManager hands over its own), every call on the share goes
+# through it, so a hung share is given up on after aio's timeout and nothing
+# is polled while the share's breaker is open.
+
+def call_all(aio, func, paths:list) -> list:
+    # func(path) for every path, side by side through aio when there is one.
+    # Each outcome is the result or the OSError that was raised.
+    if aio is None:
+        outcomes = []
+        for path in paths:
+            try:
+                outcomes.append(func(path))
+            except OSError as e:
+                outcomes.append(e)
+        return outcomes
+
+    async def run_all():
+        return await asyncio.gather(*(aio.settle(path, func, path) for path in paths))
+
+    outcomes = asyncio.run(run_all()) if paths else []
+    for outcome in outcomes:
+        if isinstance(outcome, Exception) and not isinstance(outcome, OSError):
+            raise outcome
+    return outcomes
+
+def dir_mtime(path:str) -> float:
+    return os.stat(path).st_mtime
+
+class PollingChangeSource:
+    def __init__(self, root:str, ignore=None, min_interval:float=1.0, max_interval:float=30.0, backoff:float=2.0, full_scan_interval:float=300.0, aio=None):
+        self.root = root
+        self.ignore = ignore if ignore else lambda path: False
+        self.aio = aio
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.full_scan_interval = full_scan_interval
+
+        self.interval = min_interval
+        self.next_poll = 0.0
+        self.dir_mtimes:dict[str, float] = {}
+        self.started = False
+        self.last_full_scan = 0.0
+        self.stop_event = threading.Event()
+
+    def start(self):
+        self.stop_event.clear()
+        self.snapshot()
+        self.next_poll = time.monotonic() + self.interval
+        self.started = True
+
+    def stop(self):
+        self.stop_event.set()
+
+    def snapshot(self):
+        self.dir_mtimes = {}
+        self._add_tree(self.root, set())
+        self.last_full_scan = time.monotonic()
+
+    def _subdirs(self, path:str) -> list[str]:
+        with os.scandir(path) as it:
+            return [entry.path for entry in it if entry.is_dir() and not self.ignore(entry.path)]
+
+    def _dir_info(self, path:str) -> tuple[float, list[str]]:
+        return os.stat(path).st_mtime, self._subdirs(path)
+
+    def _add_tree(self, path:str, changed:set[str]):
+        # One level at a time, the directories of a level side by side.
+        level = [path]
+        while level:
+            next_level = []
+            for current, outcome in zip(level, call_all(self.aio, self._dir_info, level)):
+                if isinstance(outcome, OSError):
+                    continue
+                mtime, subdirs = outcome
+                self.dir_mtimes[current] = mtime
+                changed.add(current)
+                next_level += subdirs
+            level = next_level
+
+    def poll(self) -> set[str]:
+        changed:set[str] = set()
+
+        if self.root not in self.dir_mtimes:
+            self._add_tree(self.root, changed)
+            return changed
+
+        paths = list(self.dir_mtimes)
+        moved = []
+        for path, outcome in zip(paths, call_all(self.aio, dir_mtime, paths)):
+            if isinstance(outcome, OSError):
+                # A directory on a share that is slow or down is polled again
+                # next time rather than reported as gone.
+                if not is_transient(outcome):
+                    del(self.dir_mtimes[path])
+                    changed.add(path)
+                continue
+            if outcome != self.dir_mtimes[path]:
+                self.dir_mtimes[path] = outcome
+                changed.add(path)
+                moved.append(path)
+
+        for path, outcome in zip(moved, call_all(self.aio, self._subdirs, moved)):
+            if isinstance(outcome, OSError):
+                continue
+            for new_dir in outcome:
+                if new_dir not in self.dir_mtimes:
+                    self._add_tree(new_dir, changed)
+        return changed
+
+    def wait_for_changes(self, timeout:float|None=None) -> set[str]|None:
+        # A timeout shorter than the current interval returns an empty set
+        # without polling, so callers can wake up often without defeating the
+        # backoff.
+        delay = max(0.0, self.next_poll - time.monotonic())
+        if timeout is not None and timeout < delay:
+            self.stop_event.wait(timeout)
+            return set()
+        if self.stop_event.wait(delay):
+            return set()
+        if self.aio is not None and not self.aio.available(self.root):
+            self.next_poll = time.monotonic() + self.interval
+            return set()
+
+        if time.monotonic() - self.last_full_scan >= self.full_scan_interval:
+            self.snapshot()
+            self.interval = self.min_interval
+            self.next_poll = time.monotonic() + self.interval
+            return None
+
+        changed = self.poll()
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff, self.max_interval)
+        self.next_poll = time.monotonic() + self.interval
+        return changed
+
+class _DirectoryEventHandler(FileSystemEventHandler):
+    def __init__(self, source):
+        super().__init__()
+        self.source = source
+
+    def on_any_event(self, event):
+        paths = [event.src_path]
+        if getattr(event, 'dest_path', None):
+            paths.append(event.dest_path)
+        for path in paths:
+            if event.is_directory:
+                self.source.notify(path)
+            self.source.notify(os.path.dirname(path))
+
+class EventChangeSource:
+    def __init__(self, root:str, ignore=None, settle_delay:float=0.5, full_scan_interval:float=600.0, aio=None):
+        self.root = root
+        self.ignore = ignore if ignore else lambda path: False
+        self.aio = aio
+        self.settle_delay = settle_delay
+        self.full_scan_interval = full_scan_interval
+
+        self.pending:set[str] = set()
+        self.lock = threading.Lock()
+        self.pending_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.observer = None
+        self.started = False
+        self.last_full_scan = 0.0
+
+    def _start_observer(self, root:str):
+        if not os.path.isdir(root):
+            raise FileNotFoundError(f'{root} does not exist')
+        observer = Observer()
+        observer.schedule(_DirectoryEventHandler(self), root, recursive=True)
+        observer.start()
+        return observer
+
+    def start(self):
+        # Setting up the watch lists the tree, so it is bounded like any
+        # other call on the share. Raises OSError when the tree cannot be
+        # watched.
+        self.stop_event.clear()
+        outcome, = call_all(self.aio, self._start_observer, [self.root])
+        if isinstance(outcome, OSError):
+            raise outcome
+        self.observer = outcome
+        self.started = True
+        self.last_full_scan = time.monotonic()
+
+    def stop(self):
+        self.stop_event.set()
+        self.pending_event.set()
+        if self.observer:
+            self.observer.stop()
+
+    def notify(self, path:str):
+        if self.ignore(path):
+            return
+        with self.lock:
+            self.pending.add(path)
+        self.pending_event.set()
+
+    def wait_for_changes(self, timeout:float|None=None) -> set[str]|None:
+        until_full_scan = max(0.0, self.full_scan_interval - (time.monotonic() - self.last_full_scan))
+        delay = until_full_scan if timeout is None else min(timeout, until_full_scan)
+
+        if self.pending_event.wait(delay) and not self.stop_event.is_set():
+            # Give a burst of writes (e.g. a batch of posted programs) time to land.
+            self.stop_event.wait(self.settle_delay)
+
+        if self.stop_event.is_set():
+            return set()
+
+        if time.monotonic() - self.last_full_scan >= self.full_scan_interval:
+            self.last_full_scan = time.monotonic()
+            with self.lock:
+                self.pending.clear()
+                self.pending_event.clear()
+            return None
+
+        with self.lock:
+            changed = self.pending
+            self.pending = set()
+            self.pending_event.clear()
+        return changed
+
+def make_change_source(root:str, ignore=None, prefer_events:bool=True, min_interval:float=1.0, max_interval:float=30.0, full_scan_interval:float=300.0, aio=None):
+    # A root that cannot be watched with events (e.g. it does not exist yet)
+    # fails in start(), and FileManager falls back to polling.
+    if prefer_events and Observer is not None:
+        return EventChangeSource(root, ignore, full_scan_interval=full_scan_interval, aio=aio)
+    return PollingChangeSource(root, ignore, min_interval=min_interval, max_interval=max_interval, full_scan_interval=full_scan_interval, aio=aio)
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+# Copies programs into a gather folder. What to copy is planned from the copy
+# manifest (see copy_manifest.py); the copies run through aio, a few at a time.
+
+def list_folder(folder:str) -> dict[str, tuple[int, float]]:
+    listing = {}
+    with os.scandir(folder) as it:
+        for entry in it:
+            if entry.is_file():
+                entry_stat = entry.stat()
+                listing[entry.name] = (entry_stat.st_size, entry_stat.st_mtime)
+    return listing
+
+def copy_atomic(src:str, dst:str, retries:int=3, retry_delay:float=0.5):
+    # Copy next to the destination first so readers never see a half written
+    # program, then swap it into place. Every attempt gets its own temp file,
+    # so a copy that timed out but is still running cannot be swapped in by a
+    # retry. PermissionError usually means the file is open somewhere else,
+    # so it is retried.
+    folder = os.path.dirname(dst)
+    stem = os.path.splitext(os.path.basename(dst))[0]
+    for attempt in range(retries + 1):
+        fd, temp_path = tempfile.mkstemp(prefix=f'~{stem}.', suffix='.tmp', dir=folder)
+        os.close(fd)
+        try:
+            shutil.copy2(src, temp_path)
+            os.replace(temp_path, dst)
+            return
+        except PermissionError:
+            if attempt == retries:
+                raise
+            time.sleep(retry_delay * (attempt + 1))
+        finally:
+            if os.path.exists(temp_path):
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+class Copier:
+    def __init__(self, max_workers:int=4, retries:int=3, retry_delay:float=0.5):
+        self.max_workers = max_workers
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    async def copy_async(self, plan:list[tuple[str, str]], folder:str, aio, progress=None, cancel_event=None) -> tuple[list[str], dict[str, Exception]]:
+        # Copies (source path, file name) pairs into folder through aio, so they
+        # share its per-share limits and timeouts. progress(done, total) is
+        # called as copies finish. Setting cancel_event or cancelling the task
+        # stops copies that have not started yet; finished ones are kept.
+        copied = []
+        failed = {}
+        if not plan:
+            return copied, failed
+
+        def run(source_path, name):
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            copy_atomic(source_path, os.path.join(folder, name), self.retries, self.retry_delay)
+            return name
+
+        workers = asyncio.Semaphore(self.max_workers)
+
+        async def copy_one(source_path, name):
+            try:
+                async with workers:
+                    return name, await aio.run(folder, run, source_path, name)
+            except OSError as e:
+                return name, e
+
+        tasks = [asyncio.ensure_future(copy_one(*item)) for item in plan]
+        try:
+            for done, next_copy in enumerate(asyncio.as_completed(tasks), start=1):
+                name, outcome = await next_copy
+                if isinstance(outcome, OSError):
+                    failed[name] = outcome
+                elif outcome is not None:
+                    copied.append(name)
+                if progress:
+                    progress(done, len(plan))
+        finally:
+            for task in tasks:
+                task.cancel()
+        return copied, failed
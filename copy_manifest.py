@@ -0,0 +1,94 @@
+from typing import NamedTuple
+
+# What FileManager has copied into its gather folders ('all' for ALL, 'asc'
+# for the ASC folder), so a gather is a diff between the programs that should
+# be there and what was copied before, rather than a listing of the folder.
+# When nothing changed, a gather does no I/O on the destination at all.
+#
+# The first gather into a folder, or one asked to verify, lists the folder
+# once to seed the manifest. Copies deleted from the folder by hand are only
+# noticed by such a verifying gather.
+
+class CopiedFile(NamedTuple):
+    # The source a file in a gather folder was copied from, as it was then.
+    source:str
+    size:int
+    mtime:float
+    digest:str|None = None
+
+class GatherPlan(NamedTuple):
+    # (source path, file name) of the programs to copy.
+    copy:list[tuple[str, str]]
+    # File names to remove: no longer valid, or gone from the NC folder.
+    retract:list[str]
+    # Copies whose source was touched without its contents changing; only
+    # the manifest needs updating.
+    touched:dict[str, CopiedFile]
+    up_to_date:int
+
+    def __bool__(self):
+        return bool(self.copy or self.retract or self.touched)
+
+def seed_copies(listing:dict[str, tuple[int, float]], wanted:dict[str, CopiedFile], known) -> dict[str, CopiedFile]:
+    # Builds the manifest of a folder from a listing of it. Files matching the
+    # program that should be there are taken as copies of it; files named like
+    # another known program are taken as stale copies, so the plan retracts
+    # them. Anything else in the folder is left alone.
+    copies = {}
+    for name, stat in listing.items():
+        source = wanted.get(name)
+        if source is not None:
+            if stat == (source.size, source.mtime):
+                copies[name] = source
+        elif name in known:
+            copies[name] = CopiedFile('', *stat)
+    return copies
+
+def plan_gather(wanted:dict[str, CopiedFile], copies:dict[str, CopiedFile]) -> GatherPlan:
+    copy = []
+    touched = {}
+    for name, source in wanted.items():
+        copied = copies.get(name)
+        if copied == source:
+            continue
+        if copied is not None and copied.source == source.source and copied.digest is not None and copied.digest == source.digest:
+            touched[name] = source
+        else:
+            copy.append((source.source, name))
+    retract = sorted(name for name in copies if name not in wanted)
+    return GatherPlan(copy, retract, touched, len(wanted) - len(copy) - len(touched))
+
+class CopyManifest:
+    def __init__(self):
+        # kind -> folder the manifest was seeded from. A kind missing here
+        # has never been listed.
+        self.folders:dict[str, str] = {}
+        # kind -> file name -> CopiedFile
+        self.copies:dict[str, dict[str, CopiedFile]] = {}
+
+    def knows(self, kind:str) -> bool:
+        return kind in self.folders
+
+    def get(self, kind:str) -> dict[str, CopiedFile]:
+        return self.copies.get(kind, {})
+
+    def seed(self, kind:str, folder:str, copies:dict[str, CopiedFile]):
+        self.folders[kind] = folder
+        self.copies[kind] = copies
+
+    def record(self, kind:str, changes:dict[str, CopiedFile|None]):
+        # None removes the name.
+        copies = self.copies.setdefault(kind, {})
+        for name, copied in changes.items():
+            if copied is None:
+                copies.pop(name, None)
+            else:
+                copies[name] = copied
+
+    def forget(self, kind:str):
+        # The next gather lists the folder again.
+        self.folders.pop(kind, None)
+        self.copies.pop(kind, None)
+
+    def __len__(self):
+        return sum(len(copies) for copies in self.copies.values())
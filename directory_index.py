@@ -0,0 +1,151 @@
+import asyncio
+import os
+
+# Snapshot of a directory tree: for every directory its mtime, the files it
+# holds as name -> (size, mtime) and its subdirectories. Directories whose mtime
+# is unchanged are not listed again, so a refresh costs one stat per directory
+# plus one listing per directory that actually changed.
+
+class DirectoryIndex:
+    def __init__(self, root:str, ignore=None, file_filter=None):
+        self.root = root
+        self.ignore = ignore if ignore else lambda path: False
+        self.file_filter = file_filter if file_filter else lambda name: True
+        self.dirs:dict[str, dict] = {}
+        self.complete = True
+        # Directories whose snapshot changed since the caller last cleared this set.
+        self.changed_dirs:set[str] = set()
+        # Work done by the last refresh(), for metrics.
+        self.last_refresh = {'dirs_stat':0, 'dirs_listed':0, 'files_stat':0}
+
+    def contains(self, location:str, name:str) -> bool:
+        snapshot = self.dirs.get(location)
+        return snapshot is not None and name in snapshot['files']
+
+    def _in_tree(self, path:str) -> bool:
+        return (path == self.root or path.startswith(self.root + os.sep)) and not self.ignore(path)
+
+    def prune(self) -> list[str]:
+        # Drops the snapshots of directories outside the tree and returns them.
+        outside = [path for path in self.dirs if not self._in_tree(path)]
+        for path in outside:
+            del(self.dirs[path])
+            self.changed_dirs.add(path)
+        return outside
+
+    def _list(self, path:str):
+        files = {}
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if not self.ignore(entry.path):
+                        subdirs.append(entry.path)
+                elif entry.is_file() and self.file_filter(entry.name):
+                    entry_stat = entry.stat()
+                    files[entry.name] = (entry_stat.st_size, entry_stat.st_mtime)
+        return files, subdirs
+
+    def _drop(self, path:str, removed:list):
+        snapshot = self.dirs.pop(path, None)
+        if snapshot is None:
+            return
+        self.changed_dirs.add(path)
+        for name in snapshot['files']:
+            removed.append((path, name))
+        for subdir in snapshot['subdirs']:
+            self._drop(subdir, removed)
+
+    def _visit(self, path:str, cached:dict|None, skip_unchanged:bool):
+        # The I/O half of visiting a directory. Returns ('unchanged', mtime),
+        # ('listed', mtime, files, subdirs) or ('gone',); other errors are
+        # raised so the caller can tell the share is in trouble.
+        try:
+            mtime = os.stat(path).st_mtime
+            if skip_unchanged and cached is not None and cached['mtime'] == mtime:
+                return ('unchanged', mtime)
+            files, subdirs = self._list(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return ('gone',)
+        return ('listed', mtime, files, subdirs)
+
+    def _apply(self, path:str, outcome:tuple, explicit:bool, added:list, modified:list, removed:list) -> list[str]:
+        # Folds a _visit() outcome into the snapshot and returns the
+        # subdirectories to visit next.
+        cached = self.dirs.get(path)
+        kind = outcome[0]
+        if kind == 'gone':
+            self._drop(path, removed)
+            return []
+        if kind == 'error':
+            # The share is unreachable; keep the last known listing.
+            self.complete = False
+            return []
+        self.last_refresh['dirs_stat'] += 1
+        if kind == 'unchanged':
+            return list(cached['subdirs'])
+
+        mtime, files, subdirs = outcome[1:]
+        self.last_refresh['dirs_listed'] += 1
+        self.last_refresh['files_stat'] += len(files)
+        old_files = cached['files'] if cached else {}
+        for name, file_stat in files.items():
+            old_stat = old_files.get(name)
+            if old_stat is None:
+                added.append((path, name, file_stat[0], file_stat[1]))
+            elif old_stat != file_stat:
+                modified.append((path, name, file_stat[0], file_stat[1]))
+        for name in old_files:
+            if name not in files:
+                removed.append((path, name))
+
+        if cached:
+            for subdir in cached['subdirs']:
+                if subdir not in subdirs:
+                    self._drop(subdir, removed)
+
+        snapshot = {'mtime':mtime, 'files':files, 'subdirs':subdirs}
+        if snapshot != cached:
+            self.dirs[path] = snapshot
+            self.changed_dirs.add(path)
+        return [subdir for subdir in subdirs if not explicit or subdir not in self.dirs]
+
+    def _start(self, dirs:set[str]|None) -> list[str]:
+        self.complete = True
+        self.last_refresh = {'dirs_stat':0, 'dirs_listed':0, 'files_stat':0}
+        return [path for path in dirs if self._in_tree(path)] if dirs is not None else [self.root]
+
+    async def refresh_async(self, aio, dirs:set[str]|None=None, force:bool=False):
+        # Returns (added, modified, removed): added and modified hold
+        # (location, name, size, mtime) tuples, removed holds (location, name).
+        # Every directory of a level is visited at once through aio; one that
+        # times out counts as unreachable.
+        added = []
+        modified = []
+        removed = []
+
+        explicit = dirs is not None
+        level = self._start(dirs)
+        visited = set()
+        while level:
+            level = [path for path in dict.fromkeys(level) if path not in visited]
+            visited.update(level)
+            outcomes = await asyncio.gather(*(aio.settle(path, self._visit, path, self.dirs.get(path), not force and not explicit) for path in level))
+            next_level = []
+            for path, outcome in zip(level, outcomes):
+                if isinstance(outcome, Exception):
+                    outcome = ('error',)
+                next_level.extend(self._apply(path, outcome, explicit, added, modified, removed))
+            level = next_level
+        return added, modified, removed
+
+    def to_dict(self) -> dict:
+        return {'root':self.root, 'dirs':self.dirs}
+
+    def from_dict(self, data:dict):
+        if data.get('root') != self.root:
+            return
+        self.dirs = {}
+        for path, snapshot in data['dirs'].items():
+            files = {name:tuple(file_stat) for name, file_stat in snapshot['files'].items()}
+            self.dirs[path] = {'mtime':snapshot['mtime'], 'files':files, 'subdirs':list(snapshot['subdirs'])}
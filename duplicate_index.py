@@ -0,0 +1,115 @@
+from records import IssueFlag
+
+# Inverted index over every program seen in the current NC folder and the
+# previous days' folders. Programs are looked up by name and by content hash,
+# so checking a program against all other days is two dict lookups instead of
+# probing the share for each candidate location.
+
+class ProgramEntry:
+    __slots__ = ('day', 'digest', 'size', 'mtime')
+
+    def __init__(self, day:str, digest:str|None, size:int, mtime:float):
+        self.day = day
+        self.digest = digest
+        self.size = size
+        self.mtime = mtime
+
+    def __eq__(self, other):
+        return (isinstance(other, ProgramEntry) and self.day == other.day and self.digest == other.digest
+                and self.size == other.size and self.mtime == other.mtime)
+
+    def __repr__(self):
+        return f'ProgramEntry({self.day!r}, {self.digest!r}, {self.size!r}, {self.mtime!r})'
+
+# Issues that come from this index rather than from the program itself. They
+# are recomputed whenever another program with the same name or content
+# changes, and they never go into the validation cache.
+HISTORY_FLAGS = IssueFlag.NAME_CONFLICT_ERR | IssueFlag.CONTENT_COPY_ERR
+
+class DuplicateIndex:
+    def __init__(self):
+        # name -> location -> ProgramEntry
+        self.by_name:dict[str, dict[str, ProgramEntry]] = {}
+        # content hash -> {(name, location)}
+        self.by_digest:dict[str, set[tuple[str, str]]] = {}
+        # (name, location) pairs added, changed or removed since the caller
+        # last cleared this set.
+        self.changed:set[tuple[str, str]] = set()
+
+    def __len__(self):
+        return sum(len(locations) for locations in self.by_name.values())
+
+    def get(self, name:str, location:str) -> ProgramEntry|None:
+        locations = self.by_name.get(name)
+        return locations.get(location) if locations else None
+
+    def _names_with_digest(self, digest:str|None) -> set[str]:
+        if digest is None:
+            return set()
+        return {name for name, location in self.by_digest.get(digest, ())}
+
+    def add(self, name:str, location:str, day:str, digest:str|None, size:int, mtime:float) -> set[str]:
+        # Returns the names whose flags may have changed.
+        entry = ProgramEntry(day, digest, size, mtime)
+        old = self.get(name, location)
+        if old == entry:
+            return set()
+
+        affected = {name}
+        if old is not None:
+            self._unlink_digest(name, location, old.digest)
+            affected |= self._names_with_digest(old.digest)
+        self.by_name.setdefault(name, {})[location] = entry
+        if digest is not None:
+            self.by_digest.setdefault(digest, set()).add((name, location))
+            affected |= self._names_with_digest(digest)
+        self.changed.add((name, location))
+        return affected
+
+    def remove(self, name:str, location:str) -> set[str]:
+        locations = self.by_name.get(name)
+        if not locations or location not in locations:
+            return set()
+        entry = locations.pop(location)
+        if not locations:
+            del(self.by_name[name])
+        self._unlink_digest(name, location, entry.digest)
+        self.changed.add((name, location))
+        return {name} | self._names_with_digest(entry.digest)
+
+    def _unlink_digest(self, name:str, location:str, digest:str|None):
+        if digest is None:
+            return
+        holders = self.by_digest.get(digest)
+        if holders is not None:
+            holders.discard((name, location))
+            if not holders:
+                del(self.by_digest[digest])
+
+    def remove_day(self, day:str) -> set[str]:
+        affected = set()
+        for name, location in [(name, location) for name, locations in self.by_name.items() for location, entry in locations.items() if entry.day == day]:
+            affected |= self.remove(name, location)
+        return affected
+
+    def days(self) -> set[str]:
+        return {entry.day for locations in self.by_name.values() for entry in locations.values()}
+
+    def flags(self, name:str, location:str) -> IssueFlag:
+        # NAME_CONFLICT_ERR: a program with this name but different content was
+        # posted on another day. CONTENT_COPY_ERR: the same content is saved
+        # under another name.
+        flags = IssueFlag(0)
+        entry = self.get(name, location)
+        if entry is None or entry.digest is None:
+            return flags
+
+        for other_location, other in self.by_name[name].items():
+            if other.day != entry.day and other.digest is not None and other.digest != entry.digest:
+                flags |= IssueFlag.NAME_CONFLICT_ERR
+                break
+        for other_name, other_location in self.by_digest.get(entry.digest, ()):
+            if other_name != name:
+                flags |= IssueFlag.CONTENT_COPY_ERR
+                break
+        return flags
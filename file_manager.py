@@ -1,14 +1,29 @@
+import asyncio
 import datetime
+import io
 import json
-import math
+import logging
 import os
 import re
-from enum import Enum
-import subprocess
-import shutil
+import sys
+import time
+
+from aio import AsyncIO, is_transient
+from asc_staging import AscStaging, asc_folder_regex
+from change_events import ChangeBatcher, ChangeEvent, ChangeKind
+from change_source import PollingChangeSource, make_change_source
+from copier import Copier, list_folder
+from copy_manifest import CopiedFile, CopyManifest, GatherPlan, plan_gather, seed_copies
+from directory_index import DirectoryIndex
+from duplicate_index import HISTORY_FLAGS, DuplicateIndex
+from metrics import DEFAULT_METRICS, Metrics, setup_logging
+from prg_parser import RULES_VERSION, check_summary, get_case_type, parse_prg
+from records import DuplicateRecord, IssueFlag, IssueType, PrgRecord, PrgResult, is_gatherable, to_flags, to_issue_types
+from state_store import SqliteStateStore
+from validation import ValidationCache, ValidationEngine
+
+log = logging.getLogger(__name__)
 
-prg_regex = re.compile(r'(\d{4,})([A-Za-z.]+)')
-asc_folder_regex = re.compile(r"\d+.\d+_ASC_\((\d+)\)")
 folder_regex = re.compile(r'(\d+) ?\((\d+)?\) ?([A-Za-z\+ ]+)?')
 
 def date_as_path(date=None):
@@ -19,302 +34,994 @@ def date_as_path(date=None):
     _year = f'Y{str(date.year)}'
     return os.path.join(_year, _month, _day)
 
-REMOTE_PRG_PATH = fr'\\192.168.1.100\Trubox\####ERP_RM####\{date_as_path()}\1. CAM\3. NC files'
-TODAYS_DATE = datetime.datetime.now().date()
+REMOTE_BASE_PATH = r'\\192.168.1.100\Trubox\####ERP_RM####'
 
-def xcopy(src:str, dst:str) -> None:
-    shutil.copy2(src, dst)
+def remote_prg_path(date=None, base:str=REMOTE_BASE_PATH) -> str:
+    return os.path.join(base, date_as_path(date), '1. CAM', '3. NC files')
+
+def date_key(date=None) -> str:
+    if(date == None):
+        date = datetime.datetime.now().date()
+    return f'{date.month}{date.day}'
 
-IssueType = Enum('IssueType',[
-    'SUBPROGRAM_0_ERR',
-    'SUBPROGRAM_1_ERR',
-    'SUBPROGRAM_2_ERR',
-    'INVALID_NAME_ERR',
-    'DUPLICATE_PRG_ERR',
-    'PART_LENGTH_ERR',
-    'MISSING_UG_VALUES_ERR',
-    'INTERNAL_NAME_ERR'])
+def read_prg(path) -> bytes:
+    with open(path, 'rb') as file:
+        return file.read()
 
 def check_file(path) -> list[IssueType]:
-    issues:list[IssueType] = []
+    with open(path, 'r') as file:
+        summary = parse_prg(file)
+    return check_summary(os.path.basename(path), summary)
 
-    file_name = os.path.basename(path).lower()
+def check_prg(file_name:str, data:bytes) -> PrgResult:
+    # Decoded the same way open(path, 'r') would decode the file.
+    summary = parse_prg(io.TextIOWrapper(io.BytesIO(data)))
+    return PrgResult(to_flags(check_summary(file_name, summary)), summary.case_type)
 
-    part_length = 0
-    cut_off = 0
+def is_prg_name(name:str) -> bool:
+    return '.prg' in name.lower()
 
-    with open(path, 'r') as file:
-        first_line = file.readline()
-        contents = file.readlines()
-
-    if 'ASC' in first_line:
-        case_type = 'ASC'
-    elif 'T-L' in first_line or 'TLCS' in first_line or 'TLOC' in first_line:
-        case_type = 'TLOC'
-    elif 'AOT14' in first_line:
-        case_type = 'AOT'
-    elif 'ATPL' in first_line:
-        case_type = 'ATPL'
-    else:
-        case_type = 'DS'
+def is_gather_folder(path) -> bool:
+    folder_name = os.path.basename(path)
+    return "ALL" in folder_name or bool(asc_folder_regex.match(folder_name))
 
-    contains_subprogram_0 = False
-    contains_subprogram_1 = False
-    contains_subprogram_2 = False
+def read_case_type(file_path) -> str|None:
+    # Only needed for programs checked before the case type was recorded.
+    try:
+        with open(file_path, 'r') as file:
+            return get_case_type(file.readline())
+    except (FileNotFoundError, UnicodeDecodeError, PermissionError, OSError) as e:
+        log.warning("Could not read %s: %s", file_path, e)
+        return None
 
-    contains_ug_101 = False
-    contains_ug_102 = False
-    contains_ug_103 = False
-    contains_ug_104 = False
-    contains_ug_105 = False
+def encode_cached_result(result:PrgResult) -> list:
+    return [int(result.issues), result.case_type]
 
-    for i, line in enumerate(contents):
-        if '$0' in line:
-            contains_subprogram_0 = True
-        
-        if '$1' in line:
-            contains_subprogram_1 = True
-        
-        if '$2' in line:
-            contains_subprogram_2 = True
-        
-        if "#100=" in line:
-            if line.split('=')[1].strip() != '':
-                part_length = float(line.split('=')[1].strip())
-                    
-        if "T0100 (CUT-OFF)" in line:
-            if case_type == 'ATPL':
-                cut_off = float(contents[i+4].split(' ')[2][1:])
-            else:
-                cut_off = float(contents[i+2][4:])
-        
-        if "#101=" in line:
-            contains_ug_101 = True
-        
-        if "#102=" in line:
-            contains_ug_102 = True
-        
-        if "#103=" in line:
-            contains_ug_103 = True
-        
-        if "#104=" in line:
-            contains_ug_104 = True
-        
-        if "#105=" in line:
-            contains_ug_105 = True
+def decode_cached_result(value) -> PrgResult:
+    # Older caches stored only the issues, first as a list of IssueType values
+    # and then as a bitmask.
+    if isinstance(value, list) and len(value) == 2 and (value[1] is None or isinstance(value[1], str)):
+        return PrgResult(IssueFlag(value[0]), value[1])
+    if isinstance(value, list):
+        return PrgResult(to_flags(IssueType(i) for i in value))
+    return PrgResult(IssueFlag(value))
+
+class FileManager:
+    def __init__(self, root:str|None=None, base:str=REMOTE_BASE_PATH, change_source_factory=None, validator=None, copier=None, metrics:Metrics|None=None,
+                 day:datetime.date|None=None, history_days:int=3, aio:AsyncIO|None=None, event_window:float=0.5, checkpoint_interval:float=60.0):
+        # Without a root or a day the manager watches today's NC folder under
+        # base and moves on to the next day's folder when the date changes.
+        # Programs from the history_days days before are indexed too, so
+        # duplicates across days are flagged; that needs a dated folder, so it
+        # is off when an explicit root is given. Filesystem calls go through
+        # aio; the sync methods run its coroutines to completion. Changes to
+        # the records are reported through self.events, coalesced over
+        # event_window seconds. With a store, every pass writes what changed
+        # and the validation cache is saved every checkpoint_interval seconds,
+        # so a crash loses at most that much.
+        self.base = base
+        self.follow_date = root is None and day is None
+        self.day = (day if day else datetime.date.today()) if root is None else None
+        self.root = root if root else remote_prg_path(self.day, base)
+        self.history_days = history_days
+        self.duplicate_index = DuplicateIndex()
+        self.indexed_days:set[str] = set()
+        self.change_source_factory = change_source_factory if change_source_factory else lambda root: make_change_source(root, ignore=is_gather_folder)
+
+        self.processed_files = {}
+        self.events = ChangeBatcher(event_window)
+        self.dirty_names:set[str] = set()
+        # Names whose duplicate index flags need to be recomputed.
+        self.history_pending:set[str] = set()
+        # (location, name) of files that could not be read last time, e.g.
+        # because they were open elsewhere or the share timed out.
+        self.retry_files:set[tuple[str, str]] = set()
+        # Gathers that could not finish because the share was down, as
+        # 'all' or 'asc' -> program names. They are run again once it is back.
+        self.spool:dict[str, set[str]] = {}
+        # Set when changes may have been missed while the share was down, so
+        # the next pass checks the whole tree.
+        self.missed_changes = False
+        # What has been copied into ALL and the ASC folder.
+        self.manifest = CopyManifest()
+        self.store = None
+        self.checkpoint_interval = checkpoint_interval
+        self.last_checkpoint = time.monotonic()
+        # ValidationCache.version of what the store holds, None if unknown.
+        self.saved_cache_version = None
+        self.metrics = metrics if metrics else DEFAULT_METRICS
+        self.validator = validator if validator else ValidationEngine(read_prg, check_prg, cache=ValidationCache(), metrics=self.metrics)
+        self.copier = copier if copier else Copier()
+        self.aio = aio if aio else AsyncIO(metrics=self.metrics)
+        self.dir_index = DirectoryIndex(self.root, ignore=is_gather_folder, file_filter=is_prg_name)
+        self.asc_staging = AscStaging(self.root, self.day)
+        self.change_source = self._make_change_source(self.root)
 
-    if file_name.split('.')[0] not in first_line:
-        issues.append(IssueType.INTERNAL_NAME_ERR)
-    
-    if not contains_subprogram_0: 
-        issues.append(IssueType.SUBPROGRAM_0_ERR)
-    if not contains_subprogram_1:
-        issues.append(IssueType.SUBPROGRAM_1_ERR)
-    if not contains_subprogram_2:
-        issues.append(IssueType.SUBPROGRAM_2_ERR)
+    def _make_change_source(self, root:str):
+        # Change sources stat the share too, so they get the same deadlines
+        # and breaker as the scans.
+        source = self.change_source_factory(root)
+        if source.aio is None:
+            source.aio = self.aio
+        return source
 
-    if round(math.fabs(part_length - cut_off), 4) > 0.015:
-        issues.append(IssueType.PART_LENGTH_ERR)
+    def day_key(self) -> str:
+        return (self.day if self.day else datetime.date.today()).isoformat()
 
-    if not prg_regex.match(file_name):
-        issues.append(IssueType.INVALID_NAME_ERR)
+    def roll_over(self, day:datetime.date):
+        # The folder that was watched until now becomes part of the history.
+        self.indexed_days.add(self.day_key())
+        self.change_source.stop()
+        self.day = day
+        self.root = root = remote_prg_path(day, self.base)
+        self.processed_files = {}
+        self.events.emit(ChangeEvent(ChangeKind.RESET))
+        self.dirty_names = set()
+        self.retry_files = set()
+        if self.spool:
+            log.warning("Dropping %d spooled copies of the previous day", sum(len(names) for names in self.spool.values()))
+            self.spool = {}
+        self.missed_changes = False
+        self.manifest = CopyManifest()
+        self.dir_index = DirectoryIndex(root, ignore=is_gather_folder, file_filter=is_prg_name)
+        self.asc_staging = AscStaging(root, day)
+        self.change_source = self._make_change_source(root)
+        if self.store:
+            self.store.clear_files()
+            self.store.set_meta('date', date_key(day))
+            self.store.set_meta('indexed_days', sorted(self.indexed_days))
+            self.store.set_meta('spool', {})
 
-    if file_name == "4001.prg" and case_type == "ASC":
-        issues.append(IssueType.INVALID_NAME_ERR)
+    def update(self, timeout:float|None=None) -> bool:
+        if self.follow_date and self.day != datetime.date.today():
+            self.roll_over(datetime.date.today())
 
-    if case_type == "ASC" or case_type == "TLOC" or case_type == "AOT":
-        if not (contains_ug_101 and contains_ug_102 and contains_ug_103 and contains_ug_104 and contains_ug_105):
-            issues.append(IssueType.MISSING_UG_VALUES_ERR)
+        if not self.change_source.started:
+            try:
+                self.change_source.start()
+            except OSError:
+                self.change_source = PollingChangeSource(self.root, ignore=is_gather_folder, aio=self.aio)
+                self.change_source.start()
+            updated = self.process()
+            return self.index_history() or updated
 
-    return issues
+        changed_dirs = self.change_source.wait_for_changes(timeout)
+        if changed_dirs is None:
+            return self.process(full=True)
+        if not changed_dirs:
+            return False
+        return self.process(changed_dirs)
 
-def asc_folder_exists(dir_path) -> bool:
-    for entry in os.listdir(dir_path):
-        if asc_folder_regex.match(entry) and os.path.isdir(os.path.join(dir_path, entry)):
-            return True
-    return False
-
-def create_asc_folder(dir_path):
-    if not asc_folder_exists(dir_path):
-        todays_date = datetime.datetime.now()
-        os.mkdir(os.path.join(dir_path, f'{todays_date.month}.{todays_date.day}_ASC_(0)'))
-
-def get_asc_folder(dir_path):
-    for entry in os.listdir(dir_path):
-        if asc_folder_regex.match(entry) and os.path.isdir(os.path.join(dir_path, entry)):
-            return entry
-
-def update_asc_folder(dir_path):
-    todays_date = datetime.datetime.now()
-    asc_folder = get_asc_folder(dir_path)
-    if asc_folder:
-        new_asc_folder = f'{todays_date.month}.{todays_date.day}_ASC_({len(os.listdir(os.path.join(dir_path, asc_folder)))})'
-        
+    def close(self, close_io:bool=True):
+        # close_io=False leaves the validator and aio running, for managers
+        # that share them.
+        self.change_source.stop()
+        if close_io:
+            self.validator.close()
+            self.aio.close()
+        if self.store:
+            self.save_store()
+            self.store.close()
+            self.store = None
+
+    def process(self, changed_dirs:set[str]|None=None, full:bool=False) -> bool:
+        return asyncio.run(self.process_async(changed_dirs, full))
+
+    async def process_async(self, changed_dirs:set[str]|None=None, full:bool=False) -> bool:
+        # With no changed_dirs the whole tree is checked, relisting only the
+        # directories whose mtime moved. full=True relists every directory,
+        # which also catches files that were rewritten in place. Nothing is
+        # done while the share is marked down; gathers spooled while it was
+        # down are retried after the first pass that reaches it again.
+        if not self.aio.available(self.root):
+            self.missed_changes = True
+            self.metrics.count('scans_paused')
+            return False
+        if self.missed_changes:
+            changed_dirs = None
+            self.missed_changes = False
+        with self.metrics.profiled(), self.metrics.timer('process'):
+            updated = await self._process(changed_dirs, full)
+        self.checkpoint()
+        if not self.dir_index.complete:
+            self.missed_changes = True
+        elif self.spool:
+            await self.flush_spool()
+        return updated
+
+    async def scan(self, changed_dirs:set[str]|None=None, full:bool=False):
+        # Refreshes the directory index, listing the directories of each level
+        # at once. Returns (added, modified, removed) like DirectoryIndex.refresh_async().
+        with self.metrics.timer('scan'):
+            changes = await self.dir_index.refresh_async(self.aio, changed_dirs, force=full)
+        for key, amount in self.dir_index.last_refresh.items():
+            self.metrics.count(key, amount)
+        return changes
+
+    async def validate(self, requests) -> tuple[dict, dict]:
+        # Same as ValidationEngine.validate_with_digests(), with the files the
+        # cache cannot answer read through aio, at most validator.io_workers at
+        # a time. A file that times out gets the TimeoutError as its result.
+        def check(request):
+            # Raised rather than returned, so aio retries it and the share's
+            # breaker sees it.
+            result, digest = self.validator.check(request)
+            if is_transient(result):
+                raise result
+            return result, digest
+
+        workers = asyncio.Semaphore(max(1, self.validator.io_workers))
+
+        async def check_one(request):
+            async with workers:
+                return await self.aio.settle(request[0], check, request)
+
+        with self.metrics.timer('validate'):
+            results, digests, pending = self.validator.split_cached(requests)
+            outcomes = await asyncio.gather(*(check_one(request) for request in pending))
+        for request, outcome in zip(pending, outcomes):
+            result, digest = (outcome, None) if isinstance(outcome, Exception) else outcome
+            results[request] = result
+            if digest is not None:
+                digests[request] = digest
+        return results, digests
+
+    async def _process(self, changed_dirs:set[str]|None, full:bool) -> bool:
+        rebuilt = not self.dir_index.dirs
+        added, modified, removed = await self.scan(changed_dirs, full)
+
+        updated = False
+        if (rebuilt or full) and self.dir_index.complete:
+            updated = self._reconcile()
+
+        for location, name in removed:
+            if self._remove_file(location, name):
+                updated = True
+
+        pending = [(location, name, size, mtime) for location, name, size, mtime in added + modified if self._needs_check(location, name, mtime)]
+        self.metrics.count('files_skipped', len(added) + len(modified) - len(pending))
+        if (rebuilt or full) and self.dir_index.complete:
+            pending += self._unindexed(pending)
+        pending += self._retries(pending)
+        results, digests = await self.validate([(os.path.join(location, name), size, mtime) for location, name, size, mtime in pending])
+
+        day = self.day_key()
         try:
-            os.rename(os.path.join(dir_path, asc_folder), os.path.join(dir_path, new_asc_folder))
-        except OSError:
-            print("Folder not found:", dir_path)
+            for location, name, size, mtime in pending:
+                request = (os.path.join(location, name), size, mtime)
+                result = results[request]
+                if isinstance(result, Exception):
+                    self.metrics.count(f'errors.{type(result).__name__}')
+                # The scan has already taken in the file's mtime, so a file
+                # that could not be read is queued for the next pass rather
+                # than waiting for it to change.
+                if isinstance(result, OSError) and not isinstance(result, FileNotFoundError):
+                    self.retry_files.add((location, name))
+                if isinstance(result, PermissionError):
+                    log.warning("File %s is open in another process.", name)
+                elif isinstance(result, FileNotFoundError):
+                    log.warning("Could not find the file %s", name)
+                elif isinstance(result, OSError):
+                    log.warning("Could not read %s: %s", request[0], result)
+                else:
+                    if isinstance(result, Exception):
+                        # One malformed program is reported on its own
+                        # instead of stopping the pass; it is checked again
+                        # when it changes.
+                        log.warning("Could not check %s: %s: %s", request[0], type(result).__name__, result)
+                        result = PrgResult(IssueFlag.UNREADABLE_PRG_ERR)
+                    issues, case_type = result if isinstance(result, PrgResult) else (result, None)
+                    for issue in to_issue_types(issues):
+                        self.metrics.count(f'issues.{issue.name}')
+                    if self._update_file(location, name, mtime, issues, case_type):
+                        updated = True
+                    self.history_pending.add(name)
+                    self.history_pending |= self.duplicate_index.add(name, location, day, digests.get(request), size, mtime)
+            if self._apply_history_flags():
+                updated = True
+        finally:
+            with self.metrics.timer('write_state'):
+                self.write_changes()
+        return updated
 
-def copy_to_asc(file_path):
-    asc_folder = os.path.join(REMOTE_PRG_PATH, get_asc_folder(REMOTE_PRG_PATH))
+    def write_changes(self):
+        if self.store is None:
+            return
+        if self.dirty_names:
+            self.store.write_files(self.processed_files, self.dirty_names)
+            self.dirty_names = set()
+        if self.dir_index.changed_dirs:
+            self.store.write_directories(self.dir_index.dirs, self.dir_index.changed_dirs)
+            self.dir_index.changed_dirs = set()
+        if self.duplicate_index.changed:
+            self.store.write_programs(self.duplicate_index, self.duplicate_index.changed)
+            self.duplicate_index.changed = set()
 
-    file_name = os.path.basename(file_path)
-    file_mtime = os.stat(file_path).st_mtime
+    def _unindexed(self, pending:list) -> list:
+        # Current programs missing from the duplicate index, e.g. after
+        # importing data.json. They are hashed on the next full pass.
+        queued = {(location, name) for location, name, size, mtime in pending}
+        missing = []
+        for name, record in self.processed_files.items():
+            for location in (record.location, *record.duplicates):
+                if (location, name) not in queued and self.duplicate_index.get(name, location) is None and self.dir_index.contains(location, name):
+                    missing.append((location, name, *self.dir_index.dirs[location]['files'][name]))
+        return missing
 
-    if file_name not in os.listdir(asc_folder):
-        xcopy(file_path, os.path.join(asc_folder, file_name))
-    elif file_name in os.listdir(asc_folder):
-        all_file_mtime = os.stat(os.path.join(asc_folder, file_name)).st_mtime
+    def _retries(self, pending:list) -> list:
+        # Files that could not be read last time and have not changed since,
+        # so the scan did not report them again.
+        queued = {(location, name) for location, name, size, mtime in pending}
+        retries = [(location, name, *self.dir_index.dirs[location]['files'][name]) for location, name in self.retry_files
+                   if (location, name) not in queued and self.dir_index.contains(location, name)]
+        self.retry_files = set()
+        return retries
 
-        if file_mtime != all_file_mtime:
-            xcopy(file_path, os.path.join(asc_folder, file_name))
+    def _apply_history_flags(self) -> bool:
+        # Recomputes the duplicate index flags of the programs whose name or
+        # content was involved in a change since the last call.
+        updated = False
+        for name in self.history_pending:
+            record = self.processed_files.get(name)
+            if record is None:
+                continue
+            for entry in (record, *record.duplicates.values()):
+                issues = (entry.issues & ~HISTORY_FLAGS) | self.duplicate_index.flags(name, entry.location)
+                if issues != entry.issues:
+                    entry.issues = issues
+                    self.dirty_names.add(name)
+                    kind = ChangeKind.FILE_REVALIDATED if entry is record else ChangeKind.DUPLICATE_REVALIDATED
+                    self.events.emit(ChangeEvent(kind, name, entry.location, issues))
+                    updated = True
+        self.history_pending = set()
+        return updated
 
-def copy_to_all(file_path):
-    all_folder = os.path.join(REMOTE_PRG_PATH, "ALL")
+    def index_history(self) -> bool:
+        return asyncio.run(self.index_history_async())
 
-    file_name = os.path.basename(file_path)
-    file_mtime = os.stat(file_path).st_mtime
+    async def index_history_async(self) -> bool:
+        # Makes sure the previous history_days dated folders are in the
+        # duplicate index. A day is listed and hashed once; unchanged files
+        # come out of the validation cache without being read.
+        if self.day is None or not self.history_days:
+            return False
+        window = {(self.day - datetime.timedelta(days=n)).isoformat() for n in range(1, self.history_days + 1)}
+        for day in self.duplicate_index.days() - window - {self.day_key()}:
+            self.history_pending |= self.duplicate_index.remove_day(day)
+        self.indexed_days &= window
 
-    if file_name not in os.listdir(all_folder):
-        xcopy(file_path, os.path.join(REMOTE_PRG_PATH, "ALL", file_name))
-    elif file_name in os.listdir(all_folder):
-        all_file_mtime = os.stat(os.path.join(all_folder, file_name)).st_mtime
+        for n in range(1, self.history_days + 1):
+            day = self.day - datetime.timedelta(days=n)
+            if day.isoformat() in self.indexed_days:
+                continue
+            with self.metrics.timer('index_history'):
+                index = DirectoryIndex(remote_prg_path(day, self.base), ignore=is_gather_folder, file_filter=is_prg_name)
+                added, modified, removed = await index.refresh_async(self.aio)
+                if not index.complete:
+                    log.warning("Could not index the programs of %s", day.isoformat())
+                    continue
+                results, digests = await self.validate([(os.path.join(location, name), size, mtime) for location, name, size, mtime in added])
+                self.history_pending |= self.duplicate_index.remove_day(day.isoformat())
+                for location, name, size, mtime in added:
+                    self.history_pending |= self.duplicate_index.add(name, location, day.isoformat(), digests.get((os.path.join(location, name), size, mtime)), size, mtime)
+            self.indexed_days.add(day.isoformat())
 
-        if file_mtime != all_file_mtime:
-            xcopy(file_path, os.path.join(all_folder, file_name))
-        
+        updated = self._apply_history_flags()
+        self.write_changes()
+        if self.store:
+            self.store.set_meta('indexed_days', sorted(self.indexed_days))
+        return updated
 
-def is_asc_file(file_path) -> bool:
-    try:
-        with open(file_path, 'r') as file:
-            firstline = file.readline()
-        if "ASC" in firstline:
+    def _reconcile(self) -> bool:
+        # Drop state for files that are no longer in the index, e.g. files
+        # deleted while the application was closed.
+        stale = []
+        for name, record in self.processed_files.items():
+            if not self.dir_index.contains(record.location, name):
+                stale.append((record.location, name))
+            for location in record.duplicates:
+                if not self.dir_index.contains(location, name):
+                    stale.append((location, name))
+
+        updated = False
+        for location, name in stale:
+            if self._remove_file(location, name):
+                updated = True
+        return updated
+
+    def _remove_file(self, location:str, name:str) -> bool:
+        record = self.processed_files.get(name)
+        if record is None:
+            return False
+
+        self.history_pending |= self.duplicate_index.remove(name, location)
+        if record.location == location:
+            if record.duplicates:
+                # The first remaining duplicate takes over as the primary entry.
+                promoted = record.duplicates.pop(next(iter(record.duplicates)))
+                self.processed_files[name] = PrgRecord(promoted.location, promoted.mtime, promoted.issues & ~IssueFlag.DUPLICATE_PRG_ERR, record.duplicates, promoted.case_type)
+                self.events.emit(ChangeEvent(ChangeKind.FILE_REVALIDATED, name, promoted.location, self.processed_files[name].issues))
+            else:
+                del(self.processed_files[name])
+            self.events.emit(ChangeEvent(ChangeKind.FILE_REMOVED, name, location))
+            self.dirty_names.add(name)
+            return True
+
+        if record.duplicates.pop(location, None) is not None:
+            self.events.emit(ChangeEvent(ChangeKind.DUPLICATE_REMOVED, name, location))
+            self.dirty_names.add(name)
             return True
-        return False
-    except (FileNotFoundError, UnicodeDecodeError, PermissionError, OSError) as e:
-        print(e)
         return False
 
-class FileManager:
-    def __init__(self):
-        self.processed_files = {}
-    def process(self) -> bool:
-        updated = False
+    def _needs_check(self, location:str, name:str, mtime:float) -> bool:
+        record = self.processed_files.get(name)
+        if record is None:
+            return True
+        if record.location == location:
+            return record.mtime != mtime
+        duplicate = record.duplicates.get(location)
+        return duplicate is None or duplicate.mtime != mtime
 
-        keys_to_remove = []
-        for key in self.processed_files:
-            entry = self.processed_files[key]
-            if not os.path.exists(os.path.join(entry['location'], key)):
-                keys_to_remove.append(key)
-        
-        for key in keys_to_remove:
-            del(self.processed_files[key])
-            updated = True
-
-        for root, dirs, files in os.walk(REMOTE_PRG_PATH):
-            if "ALL" not in os.path.basename(root) and not asc_folder_regex.match(os.path.basename(root)):
-                for name in files:
-                    if '.prg' in name.lower():
-                        try:
-                            f_stat = os.stat(os.path.join(root, name))
-                            if name not in self.processed_files.keys():
-                                self.processed_files[name] = {'location':root, 'mtime':f_stat.st_mtime, 'errors':check_file(os.path.join(root, name)), 'duplicates':[]}
-                                updated = True
-                            else:
-                                # Remove any duplicates that no longer exist
-                                existing_duplicates = []
-                                for duplicate in self.processed_files[name]['duplicates']:
-                                    if os.path.exists(os.path.join(duplicate['location'], name)) and duplicate['location'] != self.processed_files[name]['location']:
-                                        existing_duplicates.append(duplicate)
-                                
-                                if len(existing_duplicates) != len(self.processed_files[name]['duplicates']):
-                                    self.processed_files[name] = {'location':root, 'mtime':f_stat.st_mtime, 'errors':check_file(os.path.join(root, name)), 'duplicates':existing_duplicates}
-                                    updated = True
-                                if self.processed_files[name]['mtime'] != f_stat.st_mtime and self.processed_files[name]['location'] == root:
-                                    self.processed_files[name] = {'location':root, 'mtime':f_stat.st_mtime, 'errors':check_file(os.path.join(root, name)), 'duplicates':self.processed_files[name]['duplicates']}
-                                    updated = True
-                                elif self.processed_files[name]['location'] != root:
-                                    duplicate_file = {'location':root, 'mtime':f_stat.st_mtime, 'errors':check_file(os.path.join(root, name))}
-                                    duplicate_file['errors'].append(IssueType.DUPLICATE_PRG_ERR)
-                                    if duplicate_file not in self.processed_files[name]['duplicates']:
-                                        self.processed_files[name]['duplicates'].append(duplicate_file)
-                                        updated = True
-                        except PermissionError:
-                            print(f"File: {name}, is open in another process.")
-                        except FileNotFoundError:
-                            print("Could not find the file", name)
-        return updated
-    
-    def copy_all_valid_files(self):
-        if not os.path.exists(os.path.join(REMOTE_PRG_PATH, 'ALL')):
-            os.mkdir(os.path.join(REMOTE_PRG_PATH, 'ALL'))
-        
-        for name, data in self.processed_files.items():
-            file_path = os.path.join(data['location'], name)
-            if len(data['errors']) == 0:
-                copy_to_all(file_path)
-
-    def copy_asc_files(self):
-        if not asc_folder_exists(REMOTE_PRG_PATH):
-                create_asc_folder(REMOTE_PRG_PATH)
-        for name, data in self.processed_files.items():
-            file_path = os.path.join(data['location'], name)
-            if len(data['errors']) == 0 and is_asc_file(file_path):
-                copy_to_asc(file_path)
-        update_asc_folder(REMOTE_PRG_PATH)
+    def _update_file(self, location:str, name:str, mtime:float, issues:IssueFlag, case_type:str|None=None) -> bool:
+        record = self.processed_files.get(name)
+        self.dirty_names.add(name)
+
+        if record is None:
+            self.processed_files[name] = PrgRecord(location, mtime, issues, case_type=case_type)
+            self.events.emit(ChangeEvent(ChangeKind.FILE_ADDED, name, location, issues))
+        elif record.location == location:
+            record.mtime = mtime
+            record.issues = issues
+            record.case_type = case_type
+            self.events.emit(ChangeEvent(ChangeKind.FILE_REVALIDATED, name, location, issues))
+        else:
+            kind = ChangeKind.DUPLICATE_REVALIDATED if location in record.duplicates else ChangeKind.DUPLICATE_ADDED
+            record.duplicates[location] = DuplicateRecord(location, mtime, issues | IssueFlag.DUPLICATE_PRG_ERR, case_type)
+            self.events.emit(ChangeEvent(kind, name, location, issues | IssueFlag.DUPLICATE_PRG_ERR))
+        return True
+
+    def program_count(self) -> int:
+        return len(self.processed_files)
+
+    def entries(self):
+        # (file name, location, issues, is a duplicate) for every program.
+        for name, record in self.processed_files.items():
+            yield name, record.location, record.issues, False
+            for duplicate in record.duplicates.values():
+                yield name, duplicate.location, duplicate.issues, True
+
+    def issues(self) -> list[tuple[str, str, IssueType]]:
+        # (file name, location, issue type) for every issue, including the
+        # duplicates. Cheap enough to hand to another thread as a snapshot.
+        issues = []
+        for name, record in self.processed_files.items():
+            for issue in to_issue_types(record.issues):
+                issues.append((name, record.location, issue))
+            for duplicate in record.duplicates.values():
+                for issue in to_issue_types(duplicate.issues):
+                    issues.append((name, duplicate.location, issue))
+        return issues
+
+    async def _source_stat(self, location:str, name:str) -> tuple[int, float]:
+        snapshot = self.dir_index.dirs.get(location)
+        if snapshot and name in snapshot['files']:
+            return snapshot['files'][name]
+        path = os.path.join(location, name)
+        f_stat = await self.aio.run(path, os.stat, path)
+        return (f_stat.st_size, f_stat.st_mtime)
+
+    async def _wanted(self, names) -> dict[str, CopiedFile]:
+        # The named programs as they should be in a gather folder.
+        wanted = {}
+        for name in names:
+            location = self.processed_files[name].location
+            try:
+                size, mtime = await self._source_stat(location, name)
+            except FileNotFoundError:
+                log.warning("Could not find the file %s", name)
+                continue
+            entry = self.duplicate_index.get(name, location)
+            wanted[name] = CopiedFile(os.path.join(location, name), size, mtime, entry.digest if entry else None)
+        return wanted
+
+    def _gatherable_names(self) -> list[str]:
+        return [name for name, record in self.processed_files.items() if is_gatherable(record.issues)]
+
+    async def _gather_names(self, kind:str) -> list[str]:
+        # The case type comes from the check, so ASC programs are not read again.
+        if kind == 'asc':
+            return [name for name in self._gatherable_names() if await self._case_type(name, self.processed_files[name]) == 'ASC']
+        return self._gatherable_names()
+
+    async def _gather_folder(self, kind:str, create:bool=True) -> str|None:
+        # The ALL or ASC folder, created when missing unless create is False,
+        # in which case a missing folder is None.
+        if kind == 'asc':
+            if create:
+                return await self.aio.run(self.root, self.asc_staging.prepare)
+            folder = await self.aio.run(self.root, self.asc_staging.find)
+            return os.path.join(self.root, folder) if folder else None
+        folder = os.path.join(self.root, 'ALL')
+        if not await self.aio.run(folder, os.path.exists, folder):
+            if not create:
+                return None
+            await self.aio.run(folder, os.mkdir, folder)
+        return folder
+
+    def _write_manifest(self, kind:str, names):
+        if self.store:
+            self.store.write_copies(self.manifest, kind, names)
+
+    async def _plan_gather(self, kind:str, verify:bool=False, dry_run:bool=False) -> tuple[GatherPlan, dict[str, CopiedFile]]:
+        # (plan, programs that should be in the folder) for gathering kind,
+        # 'all' or 'asc'. The folder is only listed when the manifest has not
+        # seen it yet or verify is set. A dry run neither creates the folder
+        # nor changes the manifest.
+        wanted = await self._wanted(await self._gather_names(kind))
+        if verify or not self.manifest.knows(kind):
+            folder = await self._gather_folder(kind, create=not dry_run)
+            if folder is None:
+                listing = {}
+            elif kind == 'asc' and not dry_run:
+                listing = self.asc_staging.listing
+            else:
+                listing = await self.aio.run(folder, list_folder, folder)
+            copies = seed_copies(listing, wanted, self.processed_files)
+            if dry_run:
+                return plan_gather(wanted, copies), wanted
+            names = set(self.manifest.get(kind)) | set(copies)
+            self.manifest.seed(kind, folder, copies)
+            self._write_manifest(kind, names)
+        return plan_gather(wanted, self.manifest.get(kind)), wanted
+
+    def dry_run_gather(self, kind:str='all', verify:bool=False) -> GatherPlan:
+        # What copy_all_valid_files ('all') or copy_asc_files ('asc') would
+        # copy and remove, without doing it.
+        return asyncio.run(self._plan_gather(kind, verify, dry_run=True))[0]
+
+    async def _retract(self, folder:str, names) -> tuple[list[str], dict[str, Exception]]:
+        async def remove(name):
+            path = os.path.join(folder, name)
+            try:
+                await self.aio.run(folder, os.remove, path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                return name, e
+            return name, None
+
+        retracted = []
+        failed = {}
+        for name, outcome in await asyncio.gather(*(remove(name) for name in names)):
+            if outcome is None:
+                retracted.append(name)
+            else:
+                failed[name] = outcome
+        return retracted, failed
+
+    async def gather(self, kind:str, progress=None, cancel_event=None, verify:bool=False) -> dict[str, tuple[int, float]]:
+        # Brings the ALL ('all') or ASC ('asc') folder in line with the valid
+        # programs: copies new and changed ones, removes copies of programs
+        # that became invalid or were deleted, and returns the (size, mtime)
+        # of every program that was copied, keyed by name. Work that fails
+        # because the share is down is spooled under kind.
+        try:
+            plan, wanted = await self._plan_gather(kind, verify)
+        except OSError as e:
+            if not is_transient(e):
+                raise
+            self._spool(kind, self._gatherable_names(), e)
+            return {}
+
+        changes:dict[str, CopiedFile|None] = dict(plan.touched)
+        copied = []
+        retracted = []
+        failed = {}
+        if plan.copy or plan.retract:
+            try:
+                folder = await self._gather_folder(kind)
+            except OSError as e:
+                if not is_transient(e):
+                    raise
+                self._spool(kind, [name for source_path, name in plan.copy] + plan.retract, e)
+                return {}
+            retracted, failed = await self._retract(folder, plan.retract)
+            copied, copy_failed = await self.copier.copy_async(plan.copy, folder, self.aio, progress, cancel_event)
+            failed.update(copy_failed)
+            for name, e in failed.items():
+                log.warning("Could not %s %s: %s", 'remove' if name in plan.retract else 'copy', name, e)
+                self.metrics.count(f'errors.{type(e).__name__}')
+            self._spool(kind, [name for name, e in failed.items() if is_transient(e)])
+            changes.update({name:wanted[name] for name in copied})
+            changes.update({name:None for name in retracted})
+            if kind == 'asc' and (copied or retracted):
+                try:
+                    await self.aio.run(folder, self.asc_staging.record_copies, {name:(wanted[name].size, wanted[name].mtime) for name in copied}, retracted)
+                    await self.aio.run(self.root, self.asc_staging.update_name)
+                except OSError as e:
+                    # Retried on the next gather that changes the folder.
+                    log.warning("Could not rename the ASC folder in %s: %s", self.root, e)
+        self.manifest.record(kind, changes)
+        if any(isinstance(e, FileNotFoundError) for e in failed.values()):
+            # The folder may have been removed under us; list it next time.
+            self.manifest.forget(kind)
+        self._write_manifest(kind, changes)
+
+        self.metrics.count('files_copied', len(copied))
+        self.metrics.count('bytes_copied', sum(wanted[name].size for name in copied))
+        self.metrics.count('files_retracted', len(retracted))
+        self.metrics.count('files_up_to_date', plan.up_to_date + len(plan.touched))
+        if retracted:
+            log.info("Removed %d copies of programs that are no longer valid", len(retracted))
+        return {name:(wanted[name].size, wanted[name].mtime) for name in copied}
+
+    def _spool(self, kind:str, names, reason:Exception|None=None):
+        names = set(names)
+        if not names:
+            return
+        if reason is not None:
+            log.warning("Could not gather %d programs (%s), they will be copied when the share is back", len(names), reason)
+        self.spool.setdefault(kind, set()).update(names)
+        self.metrics.count('copies_spooled', len(names))
+        if self.store:
+            self.store.set_meta('spool', {kind:sorted(names) for kind, names in self.spool.items()})
+
+    async def flush_spool(self) -> list[str]:
+        # Runs the spooled gathers again. They work from the manifest, so
+        # programs copied since or no longer valid are skipped.
+        spool, self.spool = self.spool, {}
+        if self.store:
+            self.store.set_meta('spool', {})
+        copied = []
+        for kind in spool:
+            copied += await (self.gather_asc() if kind == 'asc' else self.gather_valid())
+        self.metrics.count('copies_unspooled', len(copied))
+        if copied:
+            log.info("Copied %d spooled programs", len(copied))
+        return copied
+
+    def copy_all_valid_files(self, progress=None, cancel_event=None, verify:bool=False) -> list[str]:
+        return asyncio.run(self.gather_valid(progress, cancel_event, verify))
+
+    async def gather_valid(self, progress=None, cancel_event=None, verify:bool=False) -> list[str]:
+        with self.metrics.profiled(), self.metrics.timer('gather_all'):
+            return list(await self.gather('all', progress, cancel_event, verify))
+
+    async def _case_type(self, name:str, record:PrgRecord) -> str|None:
+        if record.case_type is None:
+            path = os.path.join(record.location, name)
+            try:
+                record.case_type = await self.aio.run(path, read_case_type, path)
+            except OSError as e:
+                log.warning("Could not read %s: %s", path, e)
+            if record.case_type is not None:
+                self.dirty_names.add(name)
+        return record.case_type
+
+    def copy_asc_files(self, progress=None, cancel_event=None, verify:bool=False) -> list[str]:
+        return asyncio.run(self.gather_asc(progress, cancel_event, verify))
+
+    async def gather_asc(self, progress=None, cancel_event=None, verify:bool=False) -> list[str]:
+        with self.metrics.profiled(), self.metrics.timer('gather_asc'):
+            return list(await self.gather('asc', progress, cancel_event, verify))
 
     def save(self, json_file_path):
         serialized_processed_files = {}
         
-        serialized_processed_files["date"] = f'{TODAYS_DATE.month}{TODAYS_DATE.day}'
+        serialized_processed_files["date"] = date_key(self.day)
 
-        for key, entry in self.processed_files.items():
-            location = entry['location']
-            mtime = entry['mtime']
-            errors = [error.value for error in entry['errors']]
+        for key, record in self.processed_files.items():
+            errors = [error.value for error in to_issue_types(record.issues)]
             serialized_duplicates = []
             
-            for duplicate in entry['duplicates']:
-                duplicate_location = duplicate['location']
-                duplicate_mtime = duplicate['mtime']
-                duplicate_errors = [error.value for error in duplicate['errors']]
-                serialized_duplicate = {'location':duplicate_location, 'mtime':duplicate_mtime, 'errors':duplicate_errors}
+            for duplicate in record.duplicates.values():
+                duplicate_errors = [error.value for error in to_issue_types(duplicate.issues)]
+                serialized_duplicate = {'location':duplicate.location, 'mtime':duplicate.mtime, 'errors':duplicate_errors, 'case_type':duplicate.case_type}
                 serialized_duplicates.append(serialized_duplicate)
 
-            serialized_processed_files[key] = {'location':location, 'mtime':mtime, 'errors':errors, 'duplicates':serialized_duplicates}
+            serialized_processed_files[key] = {'location':record.location, 'mtime':record.mtime, 'errors':errors, 'duplicates':serialized_duplicates,
+                                               'case_type':record.case_type}
+
+        serialized_processed_files['directory_index'] = self.dir_index.to_dict()
+        if self.validator.cache is not None:
+            serialized_processed_files['validation_cache'] = self.validator.cache.to_dict(encode_cached_result, RULES_VERSION)
         with open(json_file_path, 'w+') as file:
             file.write(json.dumps(serialized_processed_files, indent=2))
 
     def load(self, json_file_path):
+        self.events.emit(ChangeEvent(ChangeKind.RESET))
         if os.path.exists(json_file_path):
             with open(json_file_path, 'r') as file:
                 contents = file.read()
             json_data = json.loads(contents)
-            if json_data['date'] != f'{TODAYS_DATE.month}{TODAYS_DATE.day}':
+            index_data = json_data.pop('directory_index', None)
+            cache_data = json_data.pop('validation_cache', None)
+            if cache_data and self.validator.cache is not None:
+                # Validation results only depend on file contents and the rules, so they are kept across days.
+                self.validator.cache.from_dict(cache_data, decode_cached_result, RULES_VERSION)
+            if json_data['date'] != date_key(self.day):
                 self.processed_files = {}
             else:
                 del(json_data['date'])
+                if index_data:
+                    self.dir_index.from_dict(index_data)
                 for key, entry in json_data.items():
-                    deserialized_location = entry['location']
-                    deserialized_mtime = entry['mtime']
-                    deserialized_errors = [IssueType(i) for i in entry['errors']]
-                    deserialized_duplicates = []
+                    deserialized_issues = to_flags(IssueType(i) for i in entry['errors'])
+                    deserialized_duplicates = {}
 
                     for duplicate in entry['duplicates']:
-                        deserialized_duplicate_location = duplicate['location']
-                        deserialized_duplicate_mtime = duplicate['mtime']
-                        deserialized_duplicate_errors = [IssueType(i) for i in duplicate['errors']]
-                        deserialized_duplicate = {'location':deserialized_duplicate_location, 'mtime':deserialized_duplicate_mtime, 'errors':deserialized_duplicate_errors}
-                        deserialized_duplicates.append(deserialized_duplicate)
+                        deserialized_duplicate_issues = to_flags(IssueType(i) for i in duplicate['errors'])
+                        deserialized_duplicates[duplicate['location']] = DuplicateRecord(duplicate['location'], duplicate['mtime'], deserialized_duplicate_issues, duplicate.get('case_type'))
                     
-                    deserialized_entry = {'location':deserialized_location, 'mtime':deserialized_mtime, 'errors':deserialized_errors, 'duplicates':deserialized_duplicates}
-                    self.processed_files[key] = deserialized_entry
+                    self.processed_files[key] = PrgRecord(entry['location'], entry['mtime'], deserialized_issues, deserialized_duplicates, entry.get('case_type'))
         else:
             self.processed_files = {}
 
+    def open_store(self, db_path, migrate_from=None):
+        # Switches persistence to a SQLite database. An existing data.json is
+        # imported the first time the database is created.
+        self.store = SqliteStateStore(db_path)
+        todays_date = date_key(self.day)
+
+        if self.store.is_empty():
+            if migrate_from:
+                self.load(migrate_from)
+            self.store.set_meta('date', todays_date)
+            self.dirty_names = set(self.processed_files)
+            self.dir_index.changed_dirs = set(self.dir_index.dirs)
+            self.save_store()
+            for kind in self.manifest.folders:
+                self._write_manifest(kind, self.manifest.get(kind))
+            return
+
+        if self.validator.cache is not None:
+            store = self.store
+            self.validator.cache.defer_load(lambda: store.get_meta('validation_cache'), decode_cached_result, RULES_VERSION)
+            self.saved_cache_version = self.validator.cache.version
+        self.store.read_programs(self.duplicate_index)
+        self.indexed_days = set(self.store.get_meta('indexed_days') or [])
+
+        if self.store.get_meta('date') != todays_date:
+            self.store.clear_files()
+            self.store.set_meta('date', todays_date)
+            self.processed_files = {}
+            return
+
+        self.processed_files = self.store.read_files()
+        self.manifest = self.store.read_copies()
+        self.events.emit(ChangeEvent(ChangeKind.RESET))
+        self.spool = {kind:set(names) for kind, names in (self.store.get_meta('spool') or {}).items()}
+        self.dir_index.from_dict({'root':self.dir_index.root, 'dirs':self.store.read_directories()})
+        self.dirty_names = set()
+        self.dir_index.changed_dirs = set()
+        self._evict_foreign()
+
+    def _evict_foreign(self):
+        # Drops the programs and directories of other roots, left behind when
+        # the state file was last used with another folder.
+        foreign = [(location, name) for name, location, issues, duplicate in self.entries()
+                   if location != self.root and not location.startswith(self.root + os.sep)]
+        for location, name in foreign:
+            self._remove_file(location, name)
+        self.dir_index.prune()
+        if foreign:
+            log.info("Dropped %d programs from outside %s", len(foreign), self.root)
+            self.metrics.count('records_evicted', len(foreign))
+        self.write_changes()
+
+    def checkpoint(self, force:bool=False) -> bool:
+        # Writes the records that changed since the last call. The validation
+        # cache is saved whole, so only when it changed and checkpoint_interval
+        # has passed (or force). Returns True when the cache was saved.
+        if self.store is None:
+            return False
+        self.write_changes()
+        if not force and time.monotonic() - self.last_checkpoint < self.checkpoint_interval:
+            return False
+        self.last_checkpoint = time.monotonic()
+        cache = self.validator.cache
+        if cache is None or not cache.is_loaded() or cache.version == self.saved_cache_version:
+            return False
+        version = cache.version
+        with self.metrics.timer('save_cache'):
+            self.store.set_meta('validation_cache', cache.to_dict(encode_cached_result, RULES_VERSION))
+        self.saved_cache_version = version
+        return True
+
+    def save_store(self):
+        self.checkpoint(force=True)
+
+def print_issues(fm:FileManager) -> int:
+    issues = sorted(fm.issues(), key=lambda issue: (issue[0], issue[1], issue[2].value))
+    for name, location, issue in issues:
+        print(f'{issue.name}\t{name}\t{location}')
+    return len(issues)
+
+def print_plan(plan:GatherPlan):
+    for source_path, name in plan.copy:
+        print(f'copy\t{name}\t{source_path}')
+    for name in plan.retract:
+        print(f'remove\t{name}')
+    print(f"{len(plan.copy)} to copy, {len(plan.retract)} to remove, {plan.up_to_date + len(plan.touched)} up to date")
+
+def toggle_profiling(fm:FileManager, profile_path:str):
+    if fm.metrics.profiling:
+        fm.metrics.set_profiling(False)
+        fm.metrics.dump_profile(profile_path)
+        log.info("Profiling stopped, wrote %s", profile_path)
+    else:
+        fm.metrics.set_profiling(True)
+        log.info("Profiling started")
+
+def log_changes(events:list[ChangeEvent]):
+    for event in events:
+        if event.kind is ChangeKind.RESET:
+            log.info("All programs changed")
+        else:
+            log.info("%s %s in %s: %s", event.kind.name, event.name, event.location, ', '.join(issue.name for issue in to_issue_types(event.issues)) or 'OK')
+
+def run_daemon(fm, auto_gather:bool, profile_path:str, api_address:tuple[str, int]|None=None):
+    # fm is a FileManager or a MultiRootManager. With an api_address the
+    # status is also served over HTTP.
+    import signal
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    # kill -USR1 toggles the profiler, kill -USR2 logs the metrics.
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda signum, frame: toggle_profiling(fm, profile_path))
+        signal.signal(signal.SIGUSR2, lambda signum, frame: log.info("Metrics: %s", json.dumps(fm.metrics.snapshot())))
+    fm.events.subscribe(log_changes)
+    server = None
+    if api_address:
+        from status_api import StatusServer
+        server = StatusServer(fm, *api_address)
+        server.start()
+        print(f"Serving status on http://{server.address[0]}:{server.address[1]}")
+    print(f"Watching {fm.root}")
+    try:
+        while True:
+            root = fm.root
+            # Wakes up at least once per event window so changes are flushed
+            # even while nothing else happens.
+            updated = fm.update(max(fm.events.window, 0.1))
+            fm.events.flush_due()
+            if updated:
+                issue_count = len(fm.issues())
+                print(f"{datetime.datetime.now():%H:%M:%S} {fm.program_count()} programs, {issue_count} issues")
+                if auto_gather:
+                    copied = fm.copy_all_valid_files()
+                    print(f"{datetime.datetime.now():%H:%M:%S} gathered {len(copied)} programs")
+            if fm.root != root:
+                print(f"Watching {fm.root}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server:
+            server.stop()
+
+def build_parser() -> 'argparse.ArgumentParser':
+    # Imported here so the GUI does not pay for it.
+    import argparse
+    parser = argparse.ArgumentParser(prog='file_manager', description='Check and gather PRG files without the GUI.')
+    parser.add_argument('--root', help="NC folder to use instead of today's folder")
+    parser.add_argument('--base', default=REMOTE_BASE_PATH, help='share holding the dated Y/M/D folders')
+    parser.add_argument('--date', type=datetime.date.fromisoformat, help='use the NC folder of this day (YYYY-MM-DD)')
+    parser.add_argument('--state', default='data.db', help="SQLite state file, one per instance ('' to keep no state)")
+    parser.add_argument('--io-workers', type=int, default=8, help='threads reading programs')
+    parser.add_argument('--parse-workers', type=int, default=0, help='processes parsing programs (0 parses on the reading threads)')
+    parser.add_argument('--copy-workers', type=int, default=4, help='threads copying programs')
+    parser.add_argument('--per-share', type=int, default=8, help='filesystem calls in flight at once on one share')
+    parser.add_argument('--io-timeout', type=float, default=30.0, help='seconds before a hung filesystem call is given up on')
+    parser.add_argument('--io-retries', type=int, default=2, help='retries of a filesystem call that failed because the share is slow or down')
+    parser.add_argument('--breaker-cooldown', type=float, default=30.0, help='seconds to leave the share alone after it stops answering')
+    parser.add_argument('--history-days', type=int, default=3, help='earlier dated folders checked for duplicates (0 to turn off)')
+    parser.add_argument('--log', help='write a rotating log to this file')
+    parser.add_argument('--metrics', action='store_true', help='print the collected metrics as JSON to stderr on exit')
+    parser.add_argument('--profile', help='write cProfile stats to this file (the daemon starts and stops the profiler on SIGUSR1)')
+
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('scan', help='scan the NC folder once and list the issues')
+    validate_parser = subparsers.add_parser('validate', help='check PRG files and list their issues')
+    validate_parser.add_argument('paths', nargs='+')
+    archive_parser = subparsers.add_parser('validate-archive', help='check every program under folders or in path lists and write a report')
+    archive_parser.add_argument('sources', nargs='+', help="folders to walk, or files listing one path per line ('-' for stdin)")
+    archive_parser.add_argument('--output', required=True, help='report to write')
+    archive_parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl')
+    archive_parser.add_argument('--workers', type=int, help='processes checking programs (default: one per CPU)')
+    archive_parser.add_argument('--chunk-size', type=int, default=2000, help='programs checked between checkpoints')
+    archive_parser.add_argument('--resume', action='store_true', help='carry on from the checkpoint of an interrupted run')
+    archive_parser.add_argument('--include-gathered', action='store_true', help='also check the copies in ALL and ASC folders')
+    for command, folder in (('gather', 'ALL'), ('gather-asc', 'the ASC folder')):
+        gather_parser = subparsers.add_parser(command, help=f'scan once, copy the valid {"ASC " if command == "gather-asc" else ""}programs to {folder} and remove stale copies')
+        gather_parser.add_argument('--dry-run', action='store_true', help='only list what would be copied and removed')
+        gather_parser.add_argument('--verify', action='store_true', help=f'list {folder} again instead of trusting what was copied before')
+
+    daemon_parser = subparsers.add_parser('daemon', help='keep watching the NC folder')
+    daemon_parser.add_argument('--auto-gather', action='store_true', help='copy valid programs to ALL after every change')
+    daemon_parser.add_argument('--polling', action='store_true', help='poll even when watchdog is installed')
+    daemon_parser.add_argument('--min-interval', type=float, default=1.0, help='seconds between polls while files are changing')
+    daemon_parser.add_argument('--max-interval', type=float, default=30.0, help='longest wait between polls while idle')
+    daemon_parser.add_argument('--full-scan-interval', type=float, default=300.0, help='seconds between full rescans')
+    daemon_parser.add_argument('--days-before', type=int, default=0, help='also watch this many earlier dated folders')
+    daemon_parser.add_argument('--days-after', type=int, default=0, help='also watch this many later dated folders')
+    daemon_parser.add_argument('--extra-root', action='append', default=[], help='also watch this folder (repeatable)')
+    daemon_parser.add_argument('--hot-interval', type=float, default=5.0, help="seconds between scans of today's folder when watching several")
+    daemon_parser.add_argument('--cold-interval', type=float, default=60.0, help='seconds between scans of the other folders')
+    daemon_parser.add_argument('--scan-budget', type=float, default=2.0, help='seconds of scanning started per cycle across all folders')
+    daemon_parser.add_argument('--api-port', type=int, help='serve the status read-only over HTTP on this port')
+    daemon_parser.add_argument('--api-host', default='127.0.0.1', help="address to serve the status on ('0.0.0.0' for other stations)")
+    return parser
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'daemon' and (args.hot_interval <= 0 or args.cold_interval <= 0):
+        parser.error('--hot-interval and --cold-interval must be positive')
+    if args.log:
+        setup_logging(args.log)
+    else:
+        logging.basicConfig(format='%(levelname)s: %(message)s')
+
+    if args.command == 'validate':
+        issue_count = 0
+        for path in args.paths:
+            try:
+                issues = check_file(path)
+            except (OSError, UnicodeDecodeError, ValueError, IndexError) as e:
+                print(f'{path}\tERROR\t{e}')
+                issue_count += 1
+                continue
+            print(f"{path}\t{', '.join(issue.name for issue in issues) if issues else 'OK'}")
+            issue_count += len(issues)
+        return 1 if issue_count else 0
+
+    if args.command == 'validate-archive':
+        from batch_validate import print_summary, run_batch
+        summary = run_batch(args.sources, args.output, args.format, args.workers, args.chunk_size, resume=args.resume, include_gathered=args.include_gathered,
+                            progress=lambda done, seconds: print(f"{done} programs checked in {seconds:.0f}s", file=sys.stderr))
+        print_summary(summary)
+        return 1 if summary['files'] != summary['ok'] else 0
+
+    change_source_factory = None
+    if args.command == 'daemon':
+        change_source_factory = lambda root: make_change_source(root, ignore=is_gather_folder, prefer_events=not args.polling, min_interval=args.min_interval,
+                                                                max_interval=args.max_interval, full_scan_interval=args.full_scan_interval)
+
+    validator = ValidationEngine(read_prg, check_prg, args.io_workers, args.parse_workers, ValidationCache())
+    aio = AsyncIO(args.per_share, max(32, args.io_workers + args.copy_workers), args.io_timeout, args.io_retries, breaker_cooldown=args.breaker_cooldown)
+    if args.command == 'daemon' and not args.root and (args.days_before or args.days_after or args.extra_root):
+        from multi_root import MultiRootManager, ScanScheduler
+        fm = MultiRootManager(args.base, args.date, args.days_before, args.days_after, args.extra_root, args.state, args.history_days,
+                              args.hot_interval, args.cold_interval, args.full_scan_interval, ScanScheduler(args.scan_budget),
+                              validator, Copier(args.copy_workers), aio)
+    else:
+        fm = FileManager(args.root, args.base, change_source_factory, validator, Copier(args.copy_workers), day=args.date,
+                         history_days=args.history_days, aio=aio)
+        if args.state:
+            fm.open_store(args.state)
+    if args.profile and args.command != 'daemon':
+        fm.metrics.set_profiling(True)
+
+    try:
+        if args.command == 'daemon':
+            run_daemon(fm, args.auto_gather, args.profile if args.profile else 'file_manager.prof',
+                       (args.api_host, args.api_port) if args.api_port is not None else None)
+            return 0
+
+        fm.process()
+        fm.index_history()
+        if args.command in ('gather', 'gather-asc') and args.dry_run:
+            print_plan(fm.dry_run_gather('asc' if args.command == 'gather-asc' else 'all', args.verify))
+        elif args.command == 'gather':
+            print(f"Gathered {len(fm.copy_all_valid_files(verify=args.verify))} programs")
+        elif args.command == 'gather-asc':
+            print(f"Gathered {len(fm.copy_asc_files(verify=args.verify))} ASC programs")
+        return 1 if print_issues(fm) else 0
+    finally:
+        fm.close()
+        if args.profile and fm.metrics.profiling:
+            fm.metrics.dump_profile(args.profile)
+        if args.metrics:
+            print(json.dumps(fm.metrics.snapshot(), indent=2), file=sys.stderr)
+
 if __name__ == "__main__":
-    fm = FileManager()
-    fm.load('data.json')
-    # fm.process()
-    fm.save('data.json')
-    
\ No newline at end of file
+    sys.exit(main())
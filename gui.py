@@ -1,12 +1,23 @@
+import json
+import logging
+import queue
 import threading
+import time
 import tkinter as tk
+from tkinter import ttk
 import os
 from pathlib import Path
 
-import info_widget
-import file_manager
+import metrics
+
+# file_manager, info_widget and worker pull in asyncio, sqlite and the parser,
+# so they are imported on a loader thread once the window is up, together with
+# opening the saved state. The first scan then runs on the worker.
 
 ROOT_DIR = Path(__file__).resolve().parent
+RESULT_POLL_MS = 100
+
+log = logging.getLogger(__name__)
 
 class MenuBar(tk.Menu):
     def __init__(self, master=None):
@@ -15,8 +26,12 @@ class MenuBar(tk.Menu):
         self.file_menu = tk.Menu(self, tearoff=False)
         self.file_menu.add_command(label='   Exit   ', command=master.on_close)
 
+        self.profiling = tk.BooleanVar()
         self.help_menu = tk.Menu(self, tearoff=False)
         self.help_menu.add_command(label='   View Help   ', command=self.on_help_option)
+        self.help_menu.add_separator()
+        self.help_menu.add_checkbutton(label='   Profile Scans   ', variable=self.profiling, command=lambda: master.on_profile_toggle(self.profiling.get()))
+        self.help_menu.add_command(label='   Save Diagnostics   ', command=master.save_diagnostics)
 
         self.add_cascade(label='File', menu=self.file_menu)
         self.add_cascade(label='Help', menu=self.help_menu)
@@ -27,12 +42,25 @@ class MenuBar(tk.Menu):
         elif os.name == 'posix':
             os.system(f'open {os.path.join(ROOT_DIR, "resources/help/index.html")}')
 
+def open_manager():
+    import file_manager
+    fm = file_manager.FileManager()
+    fm.open_store(os.path.join(ROOT_DIR, "data.db"), migrate_from=os.path.join(ROOT_DIR, "data.json"))
+    return fm
+
 class App(tk.Tk):
-    def __init__(self):
+    def __init__(self, manager_factory=open_manager):
+        # manager_factory() builds the FileManager on the loader thread.
+        self.started = time.perf_counter()
+        # Seconds from start to the window being drawn ('window') and to the
+        # saved issues being shown ('ready').
+        self.startup_times:dict[str, float] = {}
         super().__init__()
-        self.fm = file_manager.FileManager()
-        self.fm.load(os.path.join(ROOT_DIR, "data.json"))
-        self.fm.process()
+        self.manager_factory = manager_factory
+        self.fm = None
+        self.worker = None
+        self.loaded = queue.Queue()
+        self.closing = False
 
         self.geometry("445x275")
         self.minsize(445, 275)
@@ -49,13 +77,16 @@ class App(tk.Tk):
         self.auto_gather_checkbutton = tk.Checkbutton(master=self.control_frame, text="Auto Gather", variable=self.auto_check, onvalue=True, offvalue=False, command=self.on_auto_gather_toggle)
         self.gather_prg_button = tk.Button(master=self.control_frame, text="Gather All NC", command=self.gather_prg, padx=20, pady=20)
         self.gather_asc_button = tk.Button(master=self.control_frame, text="Gather All ASC", command=self.gather_asc, padx=20, pady=20)
+        self.progress_bar = ttk.Progressbar(master=self.control_frame, mode='determinate')
+        self.cancel_button = tk.Button(master=self.control_frame, text="Cancel", command=self.on_cancel)
 
-        self.info_widget = info_widget.InfoWidget()
-        self.info_widget.updateErrors(self.fm)
+        # Stands in for the issue panel until the saved state is loaded.
+        self.info_widget = tk.Label(master=self, text="Loading...")
 
         self.auto_gather_checkbutton.pack(side=tk.TOP)
         self.gather_prg_button.pack(fill=tk.X, side=tk.TOP)
         self.gather_asc_button.pack(fill=tk.X, side=tk.TOP)
+        self.set_controls_enabled(False)
 
         self.control_frame.grid(row=0, column=0, sticky='nsew')
         self.info_widget.grid(row=0, column=1, sticky='nsew')
@@ -66,50 +97,146 @@ class App(tk.Tk):
 
         self.config(menu=self.menu_bar)
 
-        self.stop_event = threading.Event()
-        self.enabled_event = threading.Event()
-        self.auto_gather_thread = threading.Thread(target=self.auto_gather, args=[self.stop_event, self.enabled_event])
-        self.auto_gather_thread.start()
+        # Idle callbacks run once the window has been drawn.
+        self.after_idle(self.start_loading)
+        self.after(RESULT_POLL_MS, self.process_results)
+
+    def set_controls_enabled(self, enabled:bool):
+        state = tk.NORMAL if enabled else tk.DISABLED
+        for widget in (self.auto_gather_checkbutton, self.gather_prg_button, self.gather_asc_button):
+            widget.configure(state=state)
+
+    def start_loading(self):
+        self.startup_times['window'] = time.perf_counter() - self.started
+        threading.Thread(target=self.load, name='file-manager-loader', daemon=True).start()
+
+    def load(self):
+        # Runs on the loader thread; Tk is only touched from process_results.
+        try:
+            # Imported here so on_loaded() finds them already loaded.
+            import info_widget
+            import worker
+            fm = self.manager_factory()
+        except Exception as e:
+            log.exception("Could not open the file manager")
+            self.loaded.put(e)
+            return
+        if self.closing:
+            fm.close()
+            return
+        self.loaded.put(fm)
+
+    def on_loaded(self, fm):
+        import info_widget
+        import worker
+
+        self.fm = fm
+        placeholder = self.info_widget
+        self.info_widget = info_widget.InfoWidget(metrics=self.fm.metrics)
+        self.info_widget.updateErrors(self.fm)
+        placeholder.destroy()
+        self.info_widget.grid(row=0, column=1, sticky='nsew')
+        self.set_controls_enabled(True)
+
+        self.worker = worker.BackgroundWorker(self.fm)
+        self.worker.start()
+        self.startup_times['ready'] = time.perf_counter() - self.started
+        log.info("Window shown after %.3fs, saved issues after %.3fs", self.startup_times['window'], self.startup_times['ready'])
+
+    def set_gathering(self, gathering:bool):
+        state = tk.DISABLED if gathering or self.auto_check.get() else tk.NORMAL
+        self.gather_prg_button.configure(state=state)
+        self.gather_asc_button.configure(state=state)
+        if gathering:
+            self.progress_bar['value'] = 0
+            self.progress_bar.pack(fill=tk.X, side=tk.TOP, pady=(5, 0))
+            self.cancel_button.pack(fill=tk.X, side=tk.TOP)
+        else:
+            self.progress_bar.pack_forget()
+            self.cancel_button.pack_forget()
 
     def gather_prg(self):
-        self.fm.copy_all_valid_files()
+        import worker
+        self.set_gathering(True)
+        self.worker.request_gather(worker.GATHER_ALL)
 
     def gather_asc(self):
-        self.fm.copy_asc_files()
+        import worker
+        self.set_gathering(True)
+        self.worker.request_gather(worker.GATHER_ASC)
+
+    def on_cancel(self):
+        self.worker.cancel()
 
     def print_value(self):
-        print(self.auto_check.get())
+        log.debug("Auto gather: %s", self.auto_check.get())
+
+    def on_profile_toggle(self, enabled:bool):
+        metrics.DEFAULT_METRICS.set_profiling(enabled)
+
+    def save_diagnostics(self):
+        # Writes the metrics and, when profiling was used, the profile next to
+        # the log so they can be sent along with a problem report.
+        snapshot = metrics.DEFAULT_METRICS.snapshot()
+        snapshot['startup'] = self.startup_times
+        with open(os.path.join(ROOT_DIR, "diagnostics.json"), 'w') as file:
+            json.dump(snapshot, file, indent=2)
+        metrics.DEFAULT_METRICS.dump_profile(os.path.join(ROOT_DIR, "diagnostics.prof"))
+        log.info("Saved diagnostics to %s", ROOT_DIR)
 
     def on_auto_gather_toggle(self):
-        if(self.enabled_event.is_set()):
-            self.enabled_event.clear()
-            self.gather_prg_button.configure(state=tk.NORMAL)
-            self.gather_asc_button.configure(state=tk.NORMAL)
-        else:
-            self.enabled_event.set()
+        if self.auto_check.get():
+            self.worker.set_auto_gather(True)
             self.gather_prg_button.configure(state=tk.DISABLED)
             self.gather_asc_button.configure(state=tk.DISABLED)
+        else:
+            self.worker.set_auto_gather(False)
+            self.gather_prg_button.configure(state=tk.NORMAL)
+            self.gather_asc_button.configure(state=tk.NORMAL)
+
+    def process_results(self):
+        # Results are handled on the Tk thread; the worker only ever puts
+        # plain data on the queue.
+        if self.worker is None:
+            try:
+                loaded = self.loaded.get_nowait()
+            except queue.Empty:
+                loaded = None
+            if isinstance(loaded, Exception):
+                self.info_widget.configure(text=f"Could not load:\n{loaded}")
+            elif loaded is not None:
+                self.on_loaded(loaded)
+            self.after(RESULT_POLL_MS, self.process_results)
+            return
+        try:
+            while True:
+                result = self.worker.results.get_nowait()
+                match result[0]:
+                    case 'issues':
+                        self.info_widget.show_issues(result[1])
+                    case 'changes':
+                        self.info_widget.apply_changes(result[1])
+                    case 'progress':
+                        kind, done, total = result[1:]
+                        self.progress_bar.configure(maximum=total, value=done)
+                    case 'gather_done':
+                        self.set_gathering(False)
+                    case 'error':
+                        log.error(result[1])
+        except queue.Empty:
+            pass
+        self.after(RESULT_POLL_MS, self.process_results)
 
     def on_close(self):
-        self.stop_event.set()
-        self.fm.save(os.path.join(ROOT_DIR, "data.json"))
+        self.closing = True
+        if self.worker:
+            self.worker.stop(timeout=5)
+        if self.fm:
+            self.fm.close()
         self.destroy()
 
-    def auto_gather(self, disable_event:threading.Event, enabled_event:threading.Event):
-        while True:
-            if self.fm.process():
-                    self.info_widget.updateErrors(self.fm)
-            if enabled_event.is_set():
-                try:
-                    self.fm.copy_all_valid_files()
-                except (FileNotFoundError, UnicodeDecodeError, PermissionError, OSError) as e:
-                    print(e, type(e))
-
-                    
-            if(disable_event.is_set()):
-                return False
-
 def main():
+  metrics.setup_logging(os.path.join(ROOT_DIR, "file_gatherer.log"))
   app = App()
   app.mainloop()
 
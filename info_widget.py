@@ -1,10 +1,37 @@
+import bisect
 import os
 import tkinter as tk
 from tkinter import ttk
 from dataclasses import dataclass
+from change_events import REMOVED_KINDS, ChangeEvent
 from file_manager import FileManager, IssueType
+from metrics import DEFAULT_METRICS, Metrics
+from records import to_issue_types
 import subprocess
 
+# Issue type -> (tag, message) used for each block in the issue panel.
+ISSUE_MESSAGES = {
+    IssueType.SUBPROGRAM_0_ERR: ('error', " Error: $0 Subprogram Missing"),
+    IssueType.SUBPROGRAM_1_ERR: ('error', " Error: $1 Subprogram Missing"),
+    IssueType.SUBPROGRAM_2_ERR: ('error', " Error: $2 Subprogram Missing"),
+    IssueType.INVALID_NAME_ERR: ('error', " Error: Invalid Name"),
+    IssueType.PART_LENGTH_ERR: ('error', " Error: Part-Length does not equal Cut-off"),
+    IssueType.MISSING_UG_VALUES_ERR: ('error', " Error: Missing one or more UG values"),
+    IssueType.INTERNAL_NAME_ERR: ('error', " Error: File name and internal name don't match"),
+    IssueType.DUPLICATE_PRG_ERR: ('warning', " Warning: Duplicate PRG"),
+    IssueType.NAME_CONFLICT_ERR: ('warning', " Warning: A different program with this name was posted on an earlier day"),
+    IssueType.CONTENT_COPY_ERR: ('warning', " Warning: The same program is saved under another name"),
+    IssueType.UNREADABLE_PRG_ERR: ('error', " Error: The program could not be read"),
+}
+
+# Every issue block is the same height: spacer, message, file, location, spacer
+# and the gap before the next block.
+BLOCK_LINES = 6
+
+# Above this many issues the panel switches to a Treeview, which only draws the
+# rows that are visible.
+TREE_VIEW_THRESHOLD = 1000
+
 @dataclass
 class GUIError:
     file:str
@@ -12,19 +39,30 @@ class GUIError:
     issue_type:IssueType
     line_start:int = 0
     line_end:int = 0
+    iid:str = ''
 
     def __eq__(self, other):
         return self.file == other.file and self.location == other.location and self.issue_type == other.issue_type
 
+    def key(self) -> tuple:
+        return (self.file, self.location, self.issue_type)
+
 class InfoWidget(tk.Frame):
-    def __init__(self, master=None):
+    def __init__(self, master=None, metrics:Metrics|None=None):
         super().__init__(master)
-        self.text = tk.Text(self, wrap='none', state='normal', font="Arial 11")
+        self.metrics = metrics if metrics else DEFAULT_METRICS
+        self.text = tk.Text(self, wrap='none', state='normal', font="Arial 11", cursor='arrow')
 
         self.text.insert('end', "Processing...")
+        self.placeholder = True
 
         self.info_count = 0
         self.issue_list:list[GUIError] = []
+        # (file, location) -> issue type -> the block shown for it.
+        self.entry_issues:dict[tuple[str, str], dict[IssueType, GUIError]] = {}
+        self.line_starts:list[int] = []
+        self.tree = None
+        self.tree_issues:dict[str, GUIError] = {}
 
         self.text.tag_configure('spacer', font='Arial 3')
         self.text.tag_configure('spacer2', font='Arial 2')
@@ -55,129 +93,146 @@ class InfoWidget(tk.Frame):
             self.text.bind("<Button-2>", self.on_right_click)
 
     def get_issue_by_pos(self, x, y) -> GUIError:
+        if self.tree is not None:
+            return self.tree_issues.get(self.tree.identify_row(y))
+
         line = int(self.text.index(f'@{x},{y}').split('.')[0])
+        i = bisect.bisect_right(self.line_starts, line) - 1
+        if i >= 0 and line < self.issue_list[i].line_end:
+            return self.issue_list[i]
+
+    def _block_start(self, i:int) -> int:
+        return 1 + i * BLOCK_LINES
+
+    def _insert_block(self, issue:GUIError, bg_tag:str):
+        tag, message = ISSUE_MESSAGES[issue.issue_type]
+        self.text.insert('end',
+                         '\n', (tag, 'spacer2'),
+                         f'{message}\n', (tag, 'issue_message', bg_tag),
+                         f' File: {issue.file} \n', (tag, bg_tag),
+                         f' Location: {issue.location} \n', (tag, bg_tag),
+                         '\n', (tag, 'spacer2'),
+                         '\n', ('spacer',))
+
+    def render(self, removed:list[int], added:list[GUIError]):
+        # Deletes the blocks at the removed positions, appends the added
+        # issues and then fixes up the alternating background from the first
+        # block that moved. Untouched blocks and the scroll position are kept.
+        self.text['state'] = 'normal'
+        if self.placeholder:
+            self.text.delete('1.0', 'end')
+            self.placeholder = False
+
+        for i in reversed(removed):
+            start = self._block_start(i)
+            self.text.delete(f'{start}.0', f'{start + BLOCK_LINES}.0')
+            del(self.issue_list[i])
+
+        first_changed = removed[0] if removed else len(self.issue_list)
+        for issue in added:
+            self.issue_list.append(issue)
+            self._insert_block(issue, 'odd' if len(self.issue_list) % 2 else 'even')
+
+        self.line_starts = []
+        for i, issue in enumerate(self.issue_list):
+            issue.line_start = self._block_start(i)
+            issue.line_end = issue.line_start + BLOCK_LINES - 1
+            self.line_starts.append(issue.line_start)
+
+        for i in range(first_changed, len(self.issue_list) - len(added)):
+            start = self._block_start(i)
+            self.text.tag_remove('even', f'{start}.0', f'{start + BLOCK_LINES}.0')
+            self.text.tag_remove('odd', f'{start}.0', f'{start + BLOCK_LINES}.0')
+            self.text.tag_add('even' if i % 2 else 'odd', f'{start + 1}.0', f'{start + 4}.0')
+        self.text['state'] = 'disabled'
+
+    def render_tree(self, removed:list[int], added:list[GUIError]):
+        if self.tree is None:
+            self.tree = ttk.Treeview(self, columns=('issue', 'file', 'location'), show='headings')
+            self.tree.heading('issue', text='Issue')
+            self.tree.heading('file', text='File')
+            self.tree.heading('location', text='Location')
+            self.tree.column('issue', width=260, stretch=False)
+            self.tree.column('file', width=90, stretch=False)
+            self.tree.tag_configure('error', background='#F7B0B0')
+            self.tree.tag_configure('warning', background='#F7CCB0')
+            self.tree.bind("<Button-3>" if os.name == 'nt' else "<Button-2>", self.on_right_click)
+
+            self.ys.configure(command=self.tree.yview)
+            self.tree['yscrollcommand'] = self.ys.set
+            self.xs.configure(command=self.tree.xview)
+            self.tree['xscrollcommand'] = self.xs.set
+
+            self.text.grid_remove()
+            self.tree.grid(column=0, row=0, sticky='nsew')
+
+            removed_positions = set(removed)
+            added = [issue for i, issue in enumerate(self.issue_list) if i not in removed_positions] + added
+            removed = []
+            self.issue_list = []
+
+        for i in reversed(removed):
+            self.tree.delete(self.issue_list[i].iid)
+            del(self.tree_issues[self.issue_list[i].iid])
+            del(self.issue_list[i])
+
+        for issue in added:
+            tag, message = ISSUE_MESSAGES[issue.issue_type]
+            issue.iid = self.tree.insert('', 'end', values=(message.strip(), issue.file, issue.location), tags=(tag,))
+            self.tree_issues[issue.iid] = issue
+            self.issue_list.append(issue)
 
-        for issue in self.issue_list:
-            if line >= issue.line_start and line < issue.line_end:
-                return issue
-        
-    def render(self):
-        new_text = tk.Text(self,wrap='none', font="Arial 11", state='disabled', cursor='arrow')
-        if os.name == 'nt':
-            new_text.bind("<Button-3>", self.on_right_click)
-        else:
-            new_text.bind("<Button-2>", self.on_right_click)
-
-        new_text.tag_configure('spacer', font='Arial 3')
-        new_text.tag_configure('spacer2', font='Arial 2')
-        new_text.tag_configure('even', background="#EEEEEE", foreground="black", selectforeground="white", selectbackground="blue")
-        new_text.tag_configure('odd', background="#DDDDDD", foreground="black", selectforeground="white", selectbackground="blue")
-        new_text.tag_configure('error', background='#F7B0B0', selectforeground="white", selectbackground="blue")
-        new_text.tag_configure('warning', background='#F7CCB0', selectforeground="white", selectbackground="blue")
-        new_text.tag_configure('issue_message', font="Arial 11 bold", selectforeground="white", selectbackground="blue")
-
-        self.ys.configure(command=new_text.yview)
-        new_text['yscrollcommand'] = self.ys.set
-
-        self.xs.configure(command=new_text.xview)
-        new_text['xscrollcommand'] = self.xs.set
-
-        new_text['state'] = 'normal'
-        bg_tag = 'even'
-        for i in self.issue_list:
-            if bg_tag == 'even':
-                bg_tag = 'odd'
-            elif bg_tag == 'odd':
-                bg_tag = 'even'
-
-            match i.issue_type:
-                case IssueType.SUBPROGRAM_0_ERR:
-                    i.line_start = int(new_text.index('end-1l').split('.')[0])
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    new_text.insert('end'," Error: $0 Subprogram Missing\n", ('error', 'issue_message', bg_tag))
-                    new_text.insert('end', f' File: {i.file} \n', ('error', bg_tag))
-                    new_text.insert('end', f' Location: {i.location} \n', ('error', bg_tag))
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    i.line_end = int(new_text.index('end-1l').split('.')[0])
-                case IssueType.SUBPROGRAM_1_ERR:
-                    i.line_start = int(new_text.index('end-1l').split('.')[0])
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    new_text.insert('end'," Error: $1 Subprogram Missing\n", ('error', 'issue_message', bg_tag))
-                    new_text.insert('end', f' File: {i.file} \n', ('error', bg_tag))
-                    new_text.insert('end', f' Location: {i.location} \n', ('error', bg_tag))
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    i.line_end = int(new_text.index('end-1l').split('.')[0])
-                case IssueType.SUBPROGRAM_2_ERR:
-                    i.line_start = int(new_text.index('end-1l').split('.')[0])
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    new_text.insert('end'," Error: $2 Subprogram Missing\n", ('error', 'issue_message', bg_tag))
-                    new_text.insert('end', f' File: {i.file} \n', ('error', bg_tag))
-                    new_text.insert('end', f' Location: {i.location} \n', ('error', bg_tag))
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    i.line_end = int(new_text.index('end-1l').split('.')[0])
-                case IssueType.INVALID_NAME_ERR:
-                    i.line_start = int(new_text.index('end-1l').split('.')[0])
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    new_text.insert('end'," Error: Invalid Name\n", ('error', 'issue_message', bg_tag))
-                    new_text.insert('end', f' File: {i.file} \n', ('error', bg_tag))
-                    new_text.insert('end', f' Location: {i.location} \n', ('error', bg_tag))
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    i.line_end = int(new_text.index('end-1l').split('.')[0])
-                case IssueType.PART_LENGTH_ERR:
-                    i.line_start = int(new_text.index('end-1l').split('.')[0])
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    new_text.insert('end'," Error: Part-Length does not equal Cut-off\n", ('error', 'issue_message', bg_tag))
-                    new_text.insert('end', f' File: {i.file} \n', ('error', bg_tag))
-                    new_text.insert('end', f' Location: {i.location} \n', ('error', bg_tag))
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    i.line_end = int(new_text.index('end-1l').split('.')[0])
-                case IssueType.MISSING_UG_VALUES_ERR:
-                    i.line_start = int(new_text.index('end-1l').split('.')[0])
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    new_text.insert('end'," Error: Missing one or more UG values\n", ('error', 'issue_message', bg_tag))
-                    new_text.insert('end', f' File: {i.file} \n', ('error', bg_tag))
-                    new_text.insert('end', f' Location: {i.location} \n', ('error', bg_tag))
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    i.line_end = int(new_text.index('end-1l').split('.')[0])
-                case IssueType.INTERNAL_NAME_ERR:
-                    i.line_start = int(new_text.index('end-1l').split('.')[0])
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    new_text.insert('end'," Error: File name and internal name don't match\n", ('error', 'issue_message', bg_tag))
-                    new_text.insert('end', f' File: {i.file} \n', ('error', bg_tag))
-                    new_text.insert('end', f' Location: {i.location} \n', ('error', bg_tag))
-                    new_text.insert('end', '\n', ('error', 'spacer2'))
-                    i.line_end = int(new_text.index('end-1l').split('.')[0])
-                case IssueType.DUPLICATE_PRG_ERR:
-                    i.line_start = int(new_text.index('end-1l').split('.')[0])
-                    new_text.insert('end', '\n', ('warning', 'spacer2'))
-                    new_text.insert('end'," Warning: Duplicate PRG\n", ('warning', 'issue_message', bg_tag))
-                    new_text.insert('end', f' File: {i.file} \n', ('warning', bg_tag))
-                    new_text.insert('end', f' Location: {i.location} \n', ('warning', bg_tag))
-                    new_text.insert('end', '\n', ('warning', 'spacer2'))
-                    i.line_end = int(new_text.index('end-1l').split('.')[0])
-            new_text.insert('end', '\n', ('spacer'))
-        new_text['state'] = 'disabled'
-
-        self.text.destroy()
-        self.text = new_text
-        new_text.grid(column=0, row=0, sticky='nsew')
-        self.grid(row=0, column=1, sticky='nsew')
-    
     def updateErrors(self, fm:FileManager):
-        self.issue_list = []
-        for entry in fm.processed_files:
-            if len(fm.processed_files[entry]['errors']) > 0:
-                for error in fm.processed_files[entry]['errors']:
-                    gui_error = GUIError(entry, fm.processed_files[entry]['location'], error)
-                    if gui_error not in self.issue_list:
-                        self.issue_list.append(gui_error)
-            if len(fm.processed_files[entry]['duplicates']) > 0:
-                for duplicate in fm.processed_files[entry]['duplicates']:
-                    for error in duplicate['errors']:
-                        gui_error = GUIError(entry, duplicate['location'], error)
-                        if gui_error not in self.issue_list:
-                            self.issue_list.append(gui_error)
-        self.render()
+        self.show_issues(fm.issues())
+
+    def show_issues(self, issues:list[tuple[str, str, IssueType]]):
+        current = {}
+        for name, location, issue_type in issues:
+            issue = GUIError(name, location, issue_type)
+            current[issue.key()] = issue
+
+        removed = []
+        for i, issue in enumerate(self.issue_list):
+            if current.pop(issue.key(), None) is None:
+                removed.append(i)
+        added = list(current.values())
+        self._render(removed, added)
+
+        self.entry_issues = {}
+        for issue in self.issue_list:
+            self.entry_issues.setdefault((issue.file, issue.location), {})[issue.issue_type] = issue
+
+    def apply_changes(self, events:list[ChangeEvent]):
+        # Only the blocks of the program locations in events are touched, so
+        # the cost follows the number of changes rather than the day's size.
+        dropped = set()
+        added = []
+        for event in events:
+            key = (event.name, event.location)
+            shown = self.entry_issues.pop(key, {})
+            wanted = set() if event.kind in REMOVED_KINDS else set(to_issue_types(event.issues))
+            for issue_type in [issue_type for issue_type in shown if issue_type not in wanted]:
+                dropped.add(id(shown.pop(issue_type)))
+            for issue_type in wanted:
+                if issue_type not in shown:
+                    shown[issue_type] = GUIError(event.name, event.location, issue_type)
+                    added.append(shown[issue_type])
+            if shown:
+                self.entry_issues[key] = shown
+
+        removed = [i for i, issue in enumerate(self.issue_list) if id(issue) in dropped] if dropped else []
+        self._render(removed, added)
+
+    def _render(self, removed:list[int], added:list[GUIError]):
+        if not removed and not added and not self.placeholder:
+            return
+
+        self.metrics.count('issues_rendered', len(added))
+        with self.metrics.timer('render'):
+            if self.tree is not None or len(self.issue_list) - len(removed) + len(added) > TREE_VIEW_THRESHOLD:
+                self.render_tree(removed, added)
+            else:
+                self.render(removed, added)
 
     def on_right_click(self, event):
         clicked_gui_error:GUIError = self.get_issue_by_pos(event.x, event.y)
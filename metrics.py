@@ -0,0 +1,132 @@
+import io
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler
+
+# Counters and timers for the scan, validate and gather paths. Everything is
+# kept in memory and read through snapshot(); components share DEFAULT_METRICS
+# unless they are handed their own instance.
+
+log = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+def setup_logging(path:str, level:int=logging.INFO, max_bytes:int=1_000_000, backup_count:int=3):
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    root_logger = logging.getLogger()
+    root_logger.addHandler(handler)
+    root_logger.setLevel(level)
+    return handler
+
+class Metrics:
+    def __init__(self, slow_file_seconds:float=1.0, max_slow_files:int=50):
+        self.slow_file_seconds = slow_file_seconds
+        self.lock = threading.Lock()
+        self.counters:dict[str, int] = {}
+        # phase -> [calls, total seconds, longest call]
+        self.timers:dict[str, list] = {}
+        self.slow_files:deque = deque(maxlen=max_slow_files)
+        self.started = time.time()
+
+        self.profiling = False
+        self.profiler = None
+        self.profile_lock = threading.Lock()
+
+    def count(self, name:str, amount:int=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, phase:str, seconds:float):
+        with self.lock:
+            timer = self.timers.get(phase)
+            if timer is None:
+                self.timers[phase] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, phase:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def file_time(self, path:str, seconds:float):
+        # Records files that took longer than slow_file_seconds to check, which
+        # usually points at a share or a machine that is struggling.
+        if seconds < self.slow_file_seconds:
+            return
+        with self.lock:
+            self.slow_files.append((path, round(seconds, 3), time.time()))
+        log.info('Slow file %s took %.2fs', path, seconds)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'uptime':round(time.time() - self.started, 1),
+                'counters':dict(self.counters),
+                'timers':{phase:{'calls':calls, 'total':round(total, 4), 'max':round(longest, 4), 'mean':round(total / calls, 4)}
+                          for phase, (calls, total, longest) in self.timers.items()},
+                'slow_files':[{'path':path, 'seconds':seconds, 'at':at} for path, seconds, at in self.slow_files],
+                'profiling':self.profiling,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.timers = {}
+            self.slow_files.clear()
+            self.started = time.time()
+
+    def set_profiling(self, enabled:bool):
+        # Takes effect at the start of the next profiled() block, on whichever
+        # thread runs it; a new profile is started each time it is enabled.
+        with self.profile_lock:
+            if enabled and not self.profiling:
+                import cProfile
+                self.profiler = cProfile.Profile()
+            self.profiling = enabled
+
+    @contextmanager
+    def profiled(self):
+        with self.profile_lock:
+            profiler = self.profiler if self.profiling else None
+        if profiler is None:
+            yield
+            return
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+    def profile_stats(self, limit:int=30, sort:str='cumulative') -> str:
+        with self.profile_lock:
+            profiler = self.profiler
+        if profiler is None:
+            return ''
+        import pstats
+        stream = io.StringIO()
+        try:
+            pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(limit)
+        except TypeError:
+            # Nothing has been profiled yet.
+            return ''
+        return stream.getvalue()
+
+    def dump_profile(self, path:str) -> bool:
+        with self.profile_lock:
+            profiler = self.profiler
+        if profiler is None:
+            return False
+        profiler.dump_stats(path)
+        return True
+
+DEFAULT_METRICS = Metrics()
@@ -0,0 +1,239 @@
+import asyncio
+import datetime
+import logging
+import os
+import re
+import time
+
+from aio import AsyncIO
+from change_events import ChangeBatcher, ChangeEvent, ChangeKind
+from change_source import PollingChangeSource
+from copier import Copier
+from file_manager import REMOTE_BASE_PATH, FileManager, is_gather_folder, read_prg, check_prg
+from metrics import DEFAULT_METRICS, Metrics
+from validation import ValidationCache, ValidationEngine
+
+# Watches several NC folders at once: the dated folders around today, where
+# late programs for yesterday's or tomorrow's jobs end up, plus any other
+# shares or staging folders. Every root has its own FileManager and state
+# file; they share the I/O pools, the validation cache and one stream of
+# change events, so issues() and events give one combined view.
+#
+# Instead of a change source per root, a ScanScheduler decides which roots to
+# scan. Hot roots (today) are due every hot_interval seconds, cold ones every
+# cold_interval, and each cycle only starts as many scans as fit in the
+# budget, judged by how long each root took last time.
+
+log = logging.getLogger(__name__)
+
+class WatchedRoot:
+    def __init__(self, label:str, fm:FileManager, interval:float, full_scan_interval:float=300.0):
+        self.label = label
+        self.fm = fm
+        self.interval = interval
+        self.full_scan_interval = full_scan_interval
+        self.next_due = 0.0
+        self.last_full = time.monotonic()
+        # Seconds the last scan took, which is what it is expected to cost.
+        self.cost = 0.0
+        self.scans = 0
+        # Set when the root's earlier days should be indexed on its next scan.
+        self.needs_history = False
+
+    def lateness(self, now:float) -> float:
+        # How overdue the root is, in intervals, so a cold root that is late
+        # by a whole interval goes before a hot root that just became due.
+        return (now - self.next_due) / self.interval
+
+class ScanScheduler:
+    def __init__(self, budget:float=2.0, max_concurrent:int=4):
+        # budget is the seconds of scanning started per cycle. The most overdue
+        # root always runs, even when it costs more than the budget on its own.
+        self.budget = budget
+        self.max_concurrent = max_concurrent
+
+    def pick(self, roots, now:float) -> list[WatchedRoot]:
+        due = sorted((root for root in roots if root.next_due <= now), key=lambda root: root.lateness(now), reverse=True)
+        picked = []
+        spent = 0.0
+        for root in due:
+            if picked and (len(picked) >= self.max_concurrent or spent + root.cost > self.budget):
+                continue
+            picked.append(root)
+            spent += root.cost
+        return picked
+
+    def wait_time(self, roots, now:float) -> float:
+        # Seconds until the next root is due.
+        return max(0.0, min((root.next_due for root in roots), default=1.0) - now)
+
+def root_label(path:str) -> str:
+    # A file name friendly label for a root that is not a dated folder.
+    return re.sub(r'[^A-Za-z0-9]+', '_', path).strip('_')[-60:] or 'root'
+
+class MultiRootManager:
+    def __init__(self, base:str=REMOTE_BASE_PATH, day:datetime.date|None=None, days_before:int=1, days_after:int=1, extra_roots=(),
+                 state_path:str|None=None, history_days:int=3, hot_interval:float=5.0, cold_interval:float=60.0, full_scan_interval:float=300.0,
+                 scheduler:ScanScheduler|None=None, validator:ValidationEngine|None=None, copier:Copier|None=None, aio:AsyncIO|None=None,
+                 metrics:Metrics|None=None, event_window:float=0.5):
+        # Without a day the dated roots move along with the date. Each root
+        # keeps its state next to state_path, with the root's label added to
+        # the name ('' or None keeps no state).
+        if hot_interval <= 0 or cold_interval <= 0:
+            raise ValueError(f'Scan intervals must be positive, got {hot_interval} and {cold_interval}')
+        self.base = base
+        self.follow_date = day is None
+        self.day = day if day else datetime.date.today()
+        self.days_before = days_before
+        self.days_after = days_after
+        self.extra_roots = list(extra_roots)
+        self.state_path = state_path
+        self.history_days = history_days
+        self.hot_interval = hot_interval
+        self.cold_interval = cold_interval
+        self.full_scan_interval = full_scan_interval
+        self.scheduler = scheduler if scheduler else ScanScheduler()
+        self.metrics = metrics if metrics else DEFAULT_METRICS
+        self.validator = validator if validator else ValidationEngine(read_prg, check_prg, cache=ValidationCache(), metrics=self.metrics)
+        self.copier = copier if copier else Copier()
+        self.aio = aio if aio else AsyncIO(metrics=self.metrics)
+        self.events = ChangeBatcher(event_window)
+        self.roots:dict[str, WatchedRoot] = {}
+        self.set_day(self.day)
+
+    @property
+    def root(self) -> str:
+        return ', '.join(watched.fm.root for watched in self.roots.values())
+
+    def _state_path(self, label:str) -> str|None:
+        if not self.state_path:
+            return None
+        stem, extension = os.path.splitext(self.state_path)
+        return f'{stem}-{label}{extension}'
+
+    def _add(self, label:str, hot:bool, root:str|None=None, day:datetime.date|None=None):
+        fm = FileManager(root, self.base, lambda root: PollingChangeSource(root, ignore=is_gather_folder), self.validator, self.copier, self.metrics,
+                         day=day, history_days=self.history_days if hot else 0, aio=self.aio)
+        fm.events = self.events
+        state_path = self._state_path(label)
+        if state_path:
+            fm.open_store(state_path)
+        watched = self.roots[label] = WatchedRoot(label, fm, self.hot_interval if hot else self.cold_interval, self.full_scan_interval)
+        watched.needs_history = hot
+
+    def _remove(self, label:str):
+        watched = self.roots.pop(label)
+        watched.fm.close(close_io=False)
+        self.events.emit(ChangeEvent(ChangeKind.RESET))
+        # A day that dropped out of range is not watched again, so its state
+        # file would only pile up.
+        state_path = self._state_path(label)
+        if state_path and watched.fm.day is not None:
+            for path in (state_path, state_path + '-wal', state_path + '-shm'):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    log.warning("Could not remove %s: %s", path, e)
+
+    def set_day(self, day:datetime.date):
+        # Keeps the roots of days that are still in range and only opens the
+        # new ones; today's root is the hot one.
+        self.day = day
+        wanted = {(day + datetime.timedelta(days=offset)).isoformat():offset for offset in range(-self.days_before, self.days_after + 1)}
+        for label in [label for label, watched in self.roots.items() if watched.fm.day is not None and label not in wanted]:
+            self._remove(label)
+        for label, offset in wanted.items():
+            if label in self.roots:
+                # Only the hot root checks earlier days for duplicates.
+                watched = self.roots[label]
+                watched.interval = self.hot_interval if offset == 0 else self.cold_interval
+                watched.fm.history_days = self.history_days if offset == 0 else 0
+                watched.needs_history = offset == 0
+                continue
+            self._add(label, offset == 0, day=datetime.date.fromisoformat(label))
+        for root in self.extra_roots:
+            if root_label(root) not in self.roots:
+                self._add(root_label(root), False, root=root)
+
+    async def _scan(self, watched:WatchedRoot) -> bool:
+        start = time.perf_counter()
+        full = time.monotonic() - watched.last_full >= watched.full_scan_interval
+        try:
+            updated = await watched.fm.process_async(full=full)
+            if watched.needs_history:
+                watched.needs_history = False
+                updated = await watched.fm.index_history_async() or updated
+        finally:
+            watched.cost = time.perf_counter() - start
+            watched.next_due = time.monotonic() + watched.interval
+            watched.scans += 1
+            if full:
+                watched.last_full = time.monotonic()
+        self.metrics.add_time(f'scan_root.{watched.label}', watched.cost)
+        return updated
+
+    async def run_once(self) -> bool:
+        # Scans the roots the scheduler picks, side by side.
+        picked = self.scheduler.pick(self.roots.values(), time.monotonic())
+        outcomes = await asyncio.gather(*(self._scan(watched) for watched in picked), return_exceptions=True)
+        updated = False
+        for watched, outcome in zip(picked, outcomes):
+            if isinstance(outcome, Exception):
+                log.warning("Scanning %s failed: %s", watched.fm.root, outcome)
+                self.metrics.count(f'errors.{type(outcome).__name__}')
+            elif outcome:
+                updated = True
+        return updated
+
+    async def update_async(self, timeout:float|None=None) -> bool:
+        # Waits until a root is due (at most timeout seconds) and scans.
+        if self.follow_date and self.day != datetime.date.today():
+            self.set_day(datetime.date.today())
+        wait = self.scheduler.wait_time(self.roots.values(), time.monotonic())
+        if timeout is not None and wait > timeout:
+            await asyncio.sleep(timeout)
+            return False
+        await asyncio.sleep(wait)
+        return await self.run_once()
+
+    def update(self, timeout:float|None=None) -> bool:
+        return asyncio.run(self.update_async(timeout))
+
+    def issues(self) -> list:
+        issues = []
+        for watched in self.roots.values():
+            issues += watched.fm.issues()
+        return issues
+
+    def entries(self):
+        for watched in self.roots.values():
+            yield from watched.fm.entries()
+
+    def program_count(self) -> int:
+        return sum(watched.fm.program_count() for watched in self.roots.values())
+
+    def copy_all_valid_files(self, progress=None, cancel_event=None) -> list[str]:
+        # Gathers each root into its own ALL folder. Days that have no NC
+        # folder yet, or nothing in it to gather or retract, are skipped; a
+        # root that fails does not stop the others.
+        copied = []
+        for watched in self.roots.values():
+            fm = watched.fm
+            if not fm.program_count() and not fm.manifest.get('all'):
+                continue
+            if not os.path.isdir(fm.root):
+                continue
+            try:
+                copied += fm.copy_all_valid_files(progress, cancel_event)
+            except Exception as e:
+                log.warning("Gathering %s failed: %s", fm.root, e)
+                self.metrics.count(f'errors.{type(e).__name__}')
+        return copied
+
+    def close(self):
+        for label in list(self.roots):
+            self.roots.pop(label).fm.close(close_io=False)
+        self.validator.close()
+        self.aio.close()
@@ -0,0 +1,166 @@
+import io
+import itertools
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Callable
+
+from records import IssueType
+
+UG_VARIABLES = ('#101=', '#102=', '#103=', '#104=', '#105=')
+UG_CASE_TYPES = ('ASC', 'TLOC', 'AOT')
+CASE_TYPES = ('ASC', 'TLOC', 'AOT', 'ATPL', 'DS')
+
+prg_regex = re.compile(r'(\d{4,})([A-Za-z.]+)')
+
+@dataclass
+class PrgSummary:
+    header:str = ''
+    case_type:str = 'DS'
+    subprograms:set[str] = field(default_factory=set)
+    ug_values:set[str] = field(default_factory=set)
+    part_length:float = 0
+    cut_off:float = 0
+
+    def has_all_ug_values(self) -> bool:
+        return len(self.ug_values) == len(UG_VARIABLES)
+
+# Facts a rule can wait for. Once every fact used by the rules of a case type
+# holds, nothing later in the program can change them. The part length and the
+# cut-off are not facts: a later #100= or T0100 (CUT-OFF) replaces the value,
+# so they are read up to the end of the program.
+FACTS = {
+    '$0': lambda summary: '$0' in summary.subprograms,
+    '$1': lambda summary: '$1' in summary.subprograms,
+    '$2': lambda summary: '$2' in summary.subprograms,
+    'ug_values': lambda summary: summary.has_all_ug_values(),
+}
+
+@dataclass(frozen=True)
+class Rule:
+    issue:IssueType
+    # check(file name, summary) is True when the program has the issue. The
+    # file name is already lower case.
+    check:Callable[[str, PrgSummary], bool]
+    needs:tuple[str, ...] = ()
+    case_types:tuple[str, ...] = CASE_TYPES
+
+# In the order the issues are reported. To add a rule, add it here; if it
+# needs something new from the program, add a token below and a fact above.
+RULES = (
+    Rule(IssueType.INTERNAL_NAME_ERR, lambda name, summary: name.split('.')[0] not in summary.header),
+    Rule(IssueType.SUBPROGRAM_0_ERR, lambda name, summary: '$0' not in summary.subprograms, ('$0',)),
+    Rule(IssueType.SUBPROGRAM_1_ERR, lambda name, summary: '$1' not in summary.subprograms, ('$1',)),
+    Rule(IssueType.SUBPROGRAM_2_ERR, lambda name, summary: '$2' not in summary.subprograms, ('$2',)),
+    Rule(IssueType.PART_LENGTH_ERR, lambda name, summary: round(math.fabs(summary.part_length - summary.cut_off), 4) > 0.015),
+    Rule(IssueType.INVALID_NAME_ERR, lambda name, summary: not prg_regex.match(name)),
+    Rule(IssueType.INVALID_NAME_ERR, lambda name, summary: name == '4001.prg', case_types=('ASC',)),
+    Rule(IssueType.MISSING_UG_VALUES_ERR, lambda name, summary: not summary.has_all_ug_values(), ('ug_values',), UG_CASE_TYPES),
+)
+
+# Bump when a change to the rules or the parser can change what a program is
+# reported with. Results cached under another version are dropped.
+RULES_VERSION = 1
+
+RULE_SETS = {case_type:tuple(rule for rule in RULES if case_type in rule.case_types) for case_type in CASE_TYPES}
+RULE_SET_FACTS = {case_type:tuple(dict.fromkeys(fact for rule in rules for fact in rule.needs)) for case_type, rules in RULE_SETS.items()}
+
+# Everything the rules look for, as (first character, rest of the pattern).
+# They are compiled into one regex that starts with a character class of the
+# first characters, so the regex engine can skip straight to candidate
+# positions and the program is scanned once no matter how many rules there are.
+TOKENS = {
+    'subprogram': ('$', r'[012]'),
+    'part_length': ('#', r'100=(?P<part_length_value>[^=\n]*)'),
+    'ug_value': ('#', r'10[1-5]='),
+    'cut_off': ('T', r'0100 \(CUT-OFF\)'),
+}
+
+def compile_tokens(tokens:dict) -> re.Pattern:
+    first_characters = ''.join(dict.fromkeys(first for first, rest in tokens.values()))
+    alternatives = '|'.join(f'(?<={re.escape(first)})(?P<{name}>{rest})' for name, (first, rest) in tokens.items())
+    return re.compile(f'[{re.escape(first_characters)}](?:{alternatives})')
+
+# Tokens whose last value counts. They are still looked for once every fact
+# holds.
+LAST_VALUE_TOKENS = ('part_length', 'cut_off')
+
+token_regex = compile_tokens(TOKENS)
+last_value_regex = compile_tokens({name:TOKENS[name] for name in LAST_VALUE_TOKENS})
+
+def get_case_type(header:str) -> str:
+    if 'ASC' in header:
+        return 'ASC'
+    elif 'T-L' in header or 'TLCS' in header or 'TLOC' in header:
+        return 'TLOC'
+    elif 'AOT14' in header:
+        return 'AOT'
+    elif 'ATPL' in header:
+        return 'ATPL'
+    return 'DS'
+
+def parse_cut_off(line:str, case_type:str) -> float:
+    if case_type == 'ATPL':
+        return float(line.split(' ')[2][1:])
+    return float(line[4:])
+
+# Lines searched at once. Only this many lines of a program are in memory
+# while it is parsed.
+BLOCK_LINES = 256
+
+def parse_prg(lines) -> PrgSummary:
+    # lines is an iterable of the program's lines (e.g. an open file) or the
+    # whole program as one string. They are read a block at a time and each
+    # block is searched for every token at once. The cut-off value sits two
+    # lines below "T0100 (CUT-OFF)", or four lines below on ATPL programs. A
+    # later #100= or cut-off replaces the earlier value, so every line is
+    # read; once every fact for the program's case type holds, blocks are only
+    # searched for those two.
+    if isinstance(lines, str):
+        lines = io.StringIO(lines)
+    lines = iter(lines)
+    summary = PrgSummary()
+    summary.header = next(lines, '')
+    summary.case_type = get_case_type(summary.header)
+    cut_off_offset = 4 if summary.case_type == 'ATPL' else 2
+    facts = [FACTS[fact] for fact in RULE_SET_FACTS[summary.case_type]]
+
+    regex = token_regex
+    # Numbers of the lines below the header that hold cut-off values in
+    # blocks not read yet.
+    cut_offs = []
+    start = 0
+    while block := list(itertools.islice(lines, BLOCK_LINES)):
+        end = start + len(block)
+        while cut_offs and cut_offs[0] < end:
+            summary.cut_off = parse_cut_off(block[cut_offs.pop(0) - start], summary.case_type)
+
+        text = ''.join(block)
+        for match in regex.finditer(text):
+            token = match.lastgroup
+            if token == 'subprogram':
+                summary.subprograms.add(match.group())
+            elif token == 'part_length':
+                value = match.group('part_length_value').strip()
+                if value != '':
+                    summary.part_length = float(value)
+            elif token == 'ug_value':
+                summary.ug_values.add(match.group())
+            else:
+                line = start + text.count('\n', 0, match.start()) + cut_off_offset
+                if line < end:
+                    summary.cut_off = parse_cut_off(block[line - start], summary.case_type)
+                else:
+                    cut_offs.append(line)
+
+        if regex is token_regex and all(fact(summary) for fact in facts):
+            regex = last_value_regex
+        start = end
+
+    if cut_offs:
+        raise IndexError('Cut-off value is missing after T0100 (CUT-OFF)')
+    return summary
+
+def check_summary(file_name:str, summary:PrgSummary) -> list[IssueType]:
+    file_name = file_name.lower()
+    return [rule.issue for rule in RULE_SETS[summary.case_type] if rule.check(file_name, summary)]
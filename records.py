@@ -0,0 +1,76 @@
+from enum import Enum, IntFlag
+from typing import NamedTuple
+
+IssueType = Enum('IssueType',[
+    'SUBPROGRAM_0_ERR',
+    'SUBPROGRAM_1_ERR',
+    'SUBPROGRAM_2_ERR',
+    'INVALID_NAME_ERR',
+    'DUPLICATE_PRG_ERR',
+    'PART_LENGTH_ERR',
+    'MISSING_UG_VALUES_ERR',
+    'INTERNAL_NAME_ERR',
+    'NAME_CONFLICT_ERR',
+    'CONTENT_COPY_ERR',
+    # The program could not be parsed, e.g. text after #100= or nothing
+    # after T0100 (CUT-OFF).
+    'UNREADABLE_PRG_ERR'])
+
+# One bit per IssueType, so a program's issues fit in a single int.
+IssueFlag = IntFlag('IssueFlag', [(issue.name, 1 << (issue.value - 1)) for issue in IssueType])
+
+# Reported, but a program with only these issues is still gathered.
+WARNING_FLAGS = IssueFlag.NAME_CONFLICT_ERR | IssueFlag.CONTENT_COPY_ERR
+
+def is_gatherable(flags:IssueFlag) -> bool:
+    return not flags & ~WARNING_FLAGS
+
+def to_flags(issue_types) -> IssueFlag:
+    flags = IssueFlag(0)
+    for issue in issue_types:
+        flags |= IssueFlag[issue.name]
+    return flags
+
+def to_issue_types(flags:IssueFlag) -> list[IssueType]:
+    return [issue for issue in IssueType if flags & (1 << (issue.value - 1))]
+
+class PrgResult(NamedTuple):
+    # What checking one program produces. case_type is None for results
+    # cached before it was recorded.
+    issues:IssueFlag
+    case_type:str|None = None
+
+class DuplicateRecord:
+    __slots__ = ('location', 'mtime', 'issues', 'case_type')
+
+    def __init__(self, location:str, mtime:float, issues:IssueFlag, case_type:str|None=None):
+        self.location = location
+        self.mtime = mtime
+        self.issues = issues
+        self.case_type = case_type
+
+    def __eq__(self, other):
+        return (isinstance(other, DuplicateRecord) and self.location == other.location and self.mtime == other.mtime
+                and self.issues == other.issues and self.case_type == other.case_type)
+
+    def __repr__(self):
+        return f'DuplicateRecord({self.location!r}, {self.mtime!r}, {self.issues!r}, {self.case_type!r})'
+
+class PrgRecord:
+    __slots__ = ('location', 'mtime', 'issues', 'duplicates', 'case_type')
+
+    def __init__(self, location:str, mtime:float, issues:IssueFlag, duplicates:dict[str, DuplicateRecord]|None=None, case_type:str|None=None):
+        self.location = location
+        self.mtime = mtime
+        self.issues = issues
+        # Keyed by location; insertion order decides which copy takes over
+        # when the primary file is removed.
+        self.duplicates = duplicates if duplicates is not None else {}
+        self.case_type = case_type
+
+    def __eq__(self, other):
+        return (isinstance(other, PrgRecord) and self.location == other.location and self.mtime == other.mtime
+                and self.issues == other.issues and self.duplicates == other.duplicates and self.case_type == other.case_type)
+
+    def __repr__(self):
+        return f'PrgRecord({self.location!r}, {self.mtime!r}, {self.issues!r}, {self.duplicates!r}, {self.case_type!r})'
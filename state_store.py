@@ -0,0 +1,227 @@
+import json
+import sqlite3
+import threading
+
+from copy_manifest import CopiedFile, CopyManifest
+from duplicate_index import DuplicateIndex
+from records import DuplicateRecord, IssueType, PrgRecord, to_flags, to_issue_types
+
+# SQLite backed state for FileManager. Each process() pass only rewrites the
+# rows of the programs that changed, and WAL mode keeps the database
+# consistent if the application is killed mid-write.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS locations (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY,
+    location_id INTEGER NOT NULL REFERENCES locations(id),
+    mtime REAL NOT NULL,
+    case_type TEXT
+);
+CREATE TABLE IF NOT EXISTS duplicates (
+    name TEXT NOT NULL,
+    location_id INTEGER NOT NULL REFERENCES locations(id),
+    position INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    case_type TEXT,
+    PRIMARY KEY (name, location_id)
+);
+CREATE TABLE IF NOT EXISTS issues (
+    name TEXT NOT NULL,
+    location_id INTEGER NOT NULL REFERENCES locations(id),
+    position INTEGER NOT NULL,
+    issue_type INTEGER NOT NULL,
+    PRIMARY KEY (name, location_id, position)
+);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    snapshot TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS programs (
+    name TEXT NOT NULL,
+    location TEXT NOT NULL,
+    day TEXT NOT NULL,
+    digest TEXT,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (name, location)
+);
+CREATE TABLE IF NOT EXISTS copies (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    source TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    digest TEXT,
+    PRIMARY KEY (kind, name)
+);
+CREATE INDEX IF NOT EXISTS programs_by_digest ON programs(digest);
+CREATE INDEX IF NOT EXISTS programs_by_day ON programs(day);
+CREATE INDEX IF NOT EXISTS files_by_location ON files(location_id);
+CREATE INDEX IF NOT EXISTS duplicates_by_location ON duplicates(location_id);
+CREATE INDEX IF NOT EXISTS issues_by_location ON issues(location_id);
+CREATE INDEX IF NOT EXISTS issues_by_type ON issues(issue_type);
+'''
+
+class SqliteStateStore:
+    def __init__(self, db_path:str):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        # Read the database through a memory map instead of copying pages in.
+        self.connection.execute('PRAGMA mmap_size=268435456')
+        self.connection.executescript(SCHEMA)
+        self._add_missing_columns()
+        self.location_ids:dict[str, int] = {}
+
+    def _add_missing_columns(self):
+        # Databases created before the case type was stored.
+        for table in ('files', 'duplicates'):
+            columns = [row[1] for row in self.connection.execute(f'PRAGMA table_info({table})')]
+            if 'case_type' not in columns:
+                self.connection.execute(f'ALTER TABLE {table} ADD COLUMN case_type TEXT')
+        self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM meta').fetchone()[0] == 0
+
+    def get_meta(self, key:str):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_meta(self, key:str, value):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, json.dumps(value)))
+
+    def _location_id(self, path:str) -> int:
+        location_id = self.location_ids.get(path)
+        if location_id is None:
+            self.connection.execute('INSERT OR IGNORE INTO locations (path) VALUES (?)', (path,))
+            location_id = self.connection.execute('SELECT id FROM locations WHERE path = ?', (path,)).fetchone()[0]
+            self.location_ids[path] = location_id
+        return location_id
+
+    def _write_issues(self, name:str, location_id:int, issues):
+        self.connection.executemany('INSERT OR REPLACE INTO issues (name, location_id, position, issue_type) VALUES (?, ?, ?, ?)',
+                                    [(name, location_id, position, issue.value) for position, issue in enumerate(to_issue_types(issues))])
+
+    def write_files(self, processed_files:dict, names):
+        # Rewrites the rows of the given program names; names that are no
+        # longer in processed_files are deleted.
+        with self.lock, self.connection:
+            for name in names:
+                self.connection.execute('DELETE FROM files WHERE name = ?', (name,))
+                self.connection.execute('DELETE FROM duplicates WHERE name = ?', (name,))
+                self.connection.execute('DELETE FROM issues WHERE name = ?', (name,))
+
+                record = processed_files.get(name)
+                if record is None:
+                    continue
+
+                location_id = self._location_id(record.location)
+                self.connection.execute('INSERT INTO files (name, location_id, mtime, case_type) VALUES (?, ?, ?, ?)', (name, location_id, record.mtime, record.case_type))
+                self._write_issues(name, location_id, record.issues)
+
+                for position, duplicate in enumerate(record.duplicates.values()):
+                    duplicate_location_id = self._location_id(duplicate.location)
+                    self.connection.execute('INSERT OR REPLACE INTO duplicates (name, location_id, position, mtime, case_type) VALUES (?, ?, ?, ?, ?)',
+                                            (name, duplicate_location_id, position, duplicate.mtime, duplicate.case_type))
+                    self._write_issues(name, duplicate_location_id, duplicate.issues)
+
+    def write_directories(self, dirs:dict, paths):
+        with self.lock, self.connection:
+            for path in paths:
+                snapshot = dirs.get(path)
+                if snapshot is None:
+                    self.connection.execute('DELETE FROM directories WHERE path = ?', (path,))
+                else:
+                    self.connection.execute('INSERT OR REPLACE INTO directories (path, snapshot) VALUES (?, ?)', (path, json.dumps(snapshot)))
+
+    def clear_files(self):
+        with self.lock, self.connection:
+            for table in ('files', 'duplicates', 'issues', 'locations', 'directories', 'copies'):
+                self.connection.execute(f'DELETE FROM {table}')
+            self.connection.execute("DELETE FROM meta WHERE key = 'copy_folders'")
+            self.location_ids = {}
+
+    def read_files(self) -> dict[str, PrgRecord]:
+        with self.lock:
+            issues:dict[tuple[str, str], list] = {}
+            for name, path, issue_type in self.connection.execute(
+                    'SELECT i.name, l.path, i.issue_type FROM issues i JOIN locations l ON l.id = i.location_id'):
+                issues.setdefault((name, path), []).append(IssueType(issue_type))
+
+            processed_files = {}
+            for name, path, mtime, case_type in self.connection.execute(
+                    'SELECT f.name, l.path, f.mtime, f.case_type FROM files f JOIN locations l ON l.id = f.location_id'):
+                processed_files[name] = PrgRecord(path, mtime, to_flags(issues.get((name, path), [])), case_type=case_type)
+
+            for name, path, mtime, case_type in self.connection.execute(
+                    'SELECT d.name, l.path, d.mtime, d.case_type FROM duplicates d JOIN locations l ON l.id = d.location_id ORDER BY d.name, d.position'):
+                if name in processed_files:
+                    processed_files[name].duplicates[path] = DuplicateRecord(path, mtime, to_flags(issues.get((name, path), [])), case_type)
+        return processed_files
+
+    def read_directories(self) -> dict:
+        with self.lock:
+            return {path:json.loads(snapshot) for path, snapshot in self.connection.execute('SELECT path, snapshot FROM directories')}
+
+    def write_copies(self, manifest:CopyManifest, kind:str, names):
+        # Rewrites the manifest rows of the given names of one gather folder.
+        with self.lock, self.connection:
+            copies = manifest.get(kind)
+            if not manifest.knows(kind):
+                self.connection.execute('DELETE FROM copies WHERE kind = ?', (kind,))
+                names = ()
+            for name in names:
+                copied = copies.get(name)
+                if copied is None:
+                    self.connection.execute('DELETE FROM copies WHERE kind = ? AND name = ?', (kind, name))
+                else:
+                    self.connection.execute('INSERT OR REPLACE INTO copies (kind, name, source, size, mtime, digest) VALUES (?, ?, ?, ?, ?, ?)',
+                                            (kind, name, *copied))
+            self.connection.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('copy_folders', json.dumps(manifest.folders)))
+
+    def read_copies(self) -> CopyManifest:
+        manifest = CopyManifest()
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'copy_folders'").fetchone()
+            manifest.folders = json.loads(row[0]) if row else {}
+            for kind, name, source, size, mtime, digest in self.connection.execute('SELECT kind, name, source, size, mtime, digest FROM copies'):
+                if kind in manifest.folders:
+                    manifest.copies.setdefault(kind, {})[name] = CopiedFile(source, size, mtime, digest)
+        return manifest
+
+    def write_programs(self, index:DuplicateIndex, keys):
+        # The programs table outlives clear_files(); it holds the previous
+        # days' programs for duplicate detection.
+        with self.lock, self.connection:
+            for name, location in keys:
+                entry = index.get(name, location)
+                if entry is None:
+                    self.connection.execute('DELETE FROM programs WHERE name = ? AND location = ?', (name, location))
+                else:
+                    self.connection.execute('INSERT OR REPLACE INTO programs (name, location, day, digest, size, mtime) VALUES (?, ?, ?, ?, ?, ?)',
+                                            (name, location, entry.day, entry.digest, entry.size, entry.mtime))
+
+    def read_programs(self, index:DuplicateIndex):
+        with self.lock:
+            rows = self.connection.execute('SELECT name, location, day, digest, size, mtime FROM programs').fetchall()
+        for name, location, day, digest, size, mtime in rows:
+            index.add(name, location, day, digest, size, mtime)
+        index.changed = set()
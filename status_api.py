@@ -0,0 +1,194 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from change_events import REMOVED_KINDS, ChangeEvent, ChangeKind
+from records import to_issue_types
+
+# Read-only HTTP/JSON view of a FileManager (or MultiRootManager) for other
+# stations, so one scanner serves any number of dashboards instead of each of
+# them scanning the share:
+#   GET /status                        counts and the current version
+#   GET /programs                      every program location and its issues
+#   GET /issues                        (file, location, issue) like the panel
+#   GET /changes?since=V&timeout=S     what changed after version V, waiting
+#                                      up to S seconds for something to change
+# /programs and /issues carry an ETag, so polling them with If-None-Match
+# costs a 304 until something changes.
+#
+# The view is kept from the manager's change events, on the thread that
+# flushes them, so the HTTP threads never touch the manager itself.
+
+log = logging.getLogger(__name__)
+
+MAX_LONG_POLL = 60.0
+
+class StatusFeed:
+    def __init__(self, fm, history:int=1000):
+        self.fm = fm
+        self.root = fm.root
+        # Changes older than the last history batches are answered with a
+        # reset, telling the client to fetch /programs again.
+        self.batches:deque = deque(maxlen=history)
+        self.condition = threading.Condition()
+        self.instance = uuid.uuid4().hex[:8]
+        self.started = time.time()
+        self.version = 0
+        self.entries:dict[tuple[str, str], dict] = {}
+        # version -> encoded body, for the current version only.
+        self.bodies:dict[str, bytes] = {}
+        self._rebuild()
+        fm.events.subscribe(self.on_changes)
+
+    def _rebuild(self):
+        entries = {}
+        for name, location, issues, duplicate in self.fm.entries():
+            entries[(name, location)] = {'name':name, 'location':location, 'duplicate':duplicate,
+                                         'issues':[issue.name for issue in to_issue_types(issues)]}
+        self.entries = entries
+
+    def on_changes(self, events:list[ChangeEvent]):
+        # Called by the manager's ChangeBatcher on the thread that owns the
+        # manager.
+        with self.condition:
+            if any(event.kind is ChangeKind.RESET for event in events):
+                self._rebuild()
+                changes = None
+            else:
+                changes = []
+                for event in events:
+                    key = (event.name, event.location)
+                    if event.kind in REMOVED_KINDS:
+                        self.entries.pop(key, None)
+                        changes.append({'change':event.kind.name, 'name':event.name, 'location':event.location})
+                    else:
+                        entry = {'name':event.name, 'location':event.location, 'duplicate':event.kind.name.startswith('DUPLICATE'),
+                                 'issues':[issue.name for issue in to_issue_types(event.issues)]}
+                        self.entries[key] = entry
+                        changes.append({'change':event.kind.name, **entry})
+            self.version += 1
+            self.root = self.fm.root
+            self.batches.append((self.version, changes))
+            self.bodies = {}
+            self.condition.notify_all()
+
+    def etag(self) -> str:
+        return f'"{self.instance}-{self.version}"'
+
+    def body(self, kind:str) -> tuple[str, bytes]:
+        # (ETag, JSON body) of /programs or /issues at the current version.
+        with self.condition:
+            etag = self.etag()
+            body = self.bodies.get(kind)
+            if body is None:
+                if kind == 'programs':
+                    data = list(self.entries.values())
+                else:
+                    data = [{'file':entry['name'], 'location':entry['location'], 'issue':issue}
+                            for entry in self.entries.values() for issue in entry['issues']]
+                body = self.bodies[kind] = json.dumps({'version':self.version, kind:data}).encode()
+            return etag, body
+
+    def status(self) -> dict:
+        with self.condition:
+            return {'version':self.version, 'root':self.root, 'programs':len(self.entries),
+                    'issues':sum(len(entry['issues']) for entry in self.entries.values()), 'uptime':round(time.time() - self.started, 1)}
+
+    def changes_since(self, since:int, timeout:float) -> dict:
+        # Waits up to timeout seconds when nothing changed after since.
+        deadline = time.monotonic() + min(timeout, MAX_LONG_POLL)
+        with self.condition:
+            if since > self.version:
+                # A version from before a restart.
+                return {'version':self.version, 'reset':True}
+            while self.version <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return {'version':self.version, 'changes':[]}
+                self.condition.wait(remaining)
+            batches = [(version, changes) for version, changes in self.batches if version > since]
+            if not batches:
+                # The history is empty (history=0); a cursor that is behind
+                # has missed changes it cannot be given.
+                return {'version':self.version, 'changes':[]} if since == self.version else {'version':self.version, 'reset':True}
+            if batches[0][0] != since + 1 or any(changes is None for version, changes in batches):
+                return {'version':self.version, 'reset':True}
+            return {'version':self.version, 'changes':[change for version, changes in batches for change in changes]}
+
+class StatusRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'TruGather'
+    feed:StatusFeed = None
+
+    def log_message(self, format, *args):
+        log.debug("%s %s", self.address_string(), format % args)
+
+    def _send(self, status:int, body:bytes=b'', etag:str|None=None):
+        self.send_response(status)
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        if status != 304:
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD' and status != 304:
+            self.wfile.write(body)
+
+    def _send_json(self, data:dict, status:int=200):
+        self._send(status, json.dumps(data).encode())
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = url.path.rstrip('/')
+        if path in ('/programs', '/issues'):
+            etag, body = self.feed.body(path[1:])
+            if etag in [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]:
+                self._send(304, etag=etag)
+            else:
+                self._send(200, body, etag)
+        elif path == '/status':
+            self._send_json(self.feed.status())
+        elif path == '/changes':
+            try:
+                since = int(query.get('since', ['0'])[0])
+                timeout = float(query.get('timeout', ['30'])[0])
+            except ValueError:
+                self._send_json({'error':'since must be an integer and timeout a number'}, 400)
+                return
+            self._send_json(self.feed.changes_since(since, timeout))
+        else:
+            self._send_json({'error':'not found'}, 404)
+
+    do_HEAD = do_GET
+
+    def _read_only(self):
+        self._send_json({'error':'read only'}, 405)
+
+    do_POST = do_PUT = do_DELETE = do_PATCH = _read_only
+
+class StatusServer:
+    def __init__(self, fm, host:str='127.0.0.1', port:int=8765):
+        # host '0.0.0.0' serves other stations; the default only this one.
+        self.feed = StatusFeed(fm)
+        handler = type('Handler', (StatusRequestHandler,), {'feed':self.feed})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='status-api', daemon=True)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self.httpd.server_address[:2]
+
+    def start(self):
+        self.thread.start()
+        log.info("Serving status on http://%s:%d", *self.address)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,28 @@
+import os
+
+from aio import AsyncIO
+from change_source import PollingChangeSource
+
+def test_poll_through_aio(tmp_path):
+    job = tmp_path / '100 (1) Job'
+    job.mkdir()
+    aio = AsyncIO(timeout=5.0)
+    source = PollingChangeSource(str(tmp_path), ignore=lambda path: os.path.basename(path) == 'ALL', aio=aio)
+    try:
+        source.start()
+        assert set(source.dir_mtimes) == {str(tmp_path), str(job)}
+        assert source.poll() == set()
+
+        (tmp_path / 'ALL').mkdir()
+        new_job = tmp_path / '101 (1) Job'
+        new_job.mkdir()
+        (new_job / 'nested').mkdir()
+        os.utime(tmp_path, (1, 1))
+        assert source.poll() == {str(tmp_path), str(new_job), str(new_job / 'nested')}
+
+        new_job.joinpath('nested').rmdir()
+        os.utime(new_job, (1, 1))
+        assert source.poll() == {str(new_job), str(new_job / 'nested')}
+        assert str(new_job / 'nested') not in source.dir_mtimes
+    finally:
+        aio.close()
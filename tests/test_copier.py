@@ -0,0 +1,101 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+import copier
+from copier import copy_atomic
+
+def write(path, text:str, mtime:float=1000.0):
+    path.write_text(text)
+    os.utime(path, (mtime, mtime))
+
+def test_copy_atomic(tmp_path):
+    src = tmp_path / '1234.prg'
+    write(src, 'program')
+    dst_folder = tmp_path / 'ALL'
+    dst_folder.mkdir()
+    copy_atomic(str(src), str(dst_folder / '1234.prg'))
+    assert (dst_folder / '1234.prg').read_text() == 'program'
+    assert os.stat(dst_folder / '1234.prg').st_mtime == 1000.0
+    assert os.listdir(dst_folder) == ['1234.prg']
+
+def test_failed_copy_leaves_nothing(tmp_path, monkeypatch):
+    src = tmp_path / '1234.prg'
+    write(src, 'program')
+    dst_folder = tmp_path / 'ALL'
+    dst_folder.mkdir()
+
+    def failing_copy(source, target):
+        with open(target, 'w') as file:
+            file.write('prog')
+        raise OSError('disk full')
+
+    monkeypatch.setattr(copier.shutil, 'copy2', failing_copy)
+    with pytest.raises(OSError):
+        copy_atomic(str(src), str(dst_folder / '1234.prg'))
+    assert os.listdir(dst_folder) == []
+
+def test_locked_copy_is_retried(tmp_path, monkeypatch):
+    src = tmp_path / '1234.prg'
+    write(src, 'program')
+    dst_folder = tmp_path / 'ALL'
+    dst_folder.mkdir()
+    attempts = []
+    original_copy = shutil.copy2
+
+    def locked_once(source, target):
+        attempts.append(target)
+        if len(attempts) == 1:
+            raise PermissionError('in use')
+        return original_copy(source, target)
+
+    monkeypatch.setattr(copier.shutil, 'copy2', locked_once)
+    copy_atomic(str(src), str(dst_folder / '1234.prg'), retry_delay=0.0)
+    assert (dst_folder / '1234.prg').read_text() == 'program'
+    assert os.listdir(dst_folder) == ['1234.prg']
+
+def test_stuck_copy_does_not_clobber_retry(tmp_path, monkeypatch):
+    # An attempt that timed out keeps writing on its thread while the retry
+    # copies; what the retry swaps in must be its own complete copy.
+    src = tmp_path / '1234.prg'
+    write(src, 'complete program')
+    dst_folder = tmp_path / 'ALL'
+    dst_folder.mkdir()
+    dst = dst_folder / '1234.prg'
+    started = threading.Event()
+    write_late = threading.Event()
+    written = threading.Event()
+    original_copy = shutil.copy2
+
+    def copy(source, target):
+        if not started.is_set():
+            started.set()
+            write_late.wait(5)
+            with open(target, 'w') as file:
+                file.write('half')
+            written.set()
+            raise TimeoutError('gave up')
+        original_copy(source, target)
+        # The stuck attempt writes after the retry copied, before it swaps.
+        write_late.set()
+        written.wait(5)
+
+    monkeypatch.setattr(copier.shutil, 'copy2', copy)
+    errors = []
+
+    def stuck_copy():
+        try:
+            copy_atomic(str(src), str(dst))
+        except TimeoutError as e:
+            errors.append(e)
+
+    first = threading.Thread(target=stuck_copy)
+    first.start()
+    started.wait(5)
+    copy_atomic(str(src), str(dst))
+    first.join()
+    assert dst.read_text() == 'complete program'
+    assert len(errors) == 1
+    assert os.listdir(dst_folder) == ['1234.prg']
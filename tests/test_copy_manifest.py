@@ -0,0 +1,83 @@
+import os
+
+from copy_manifest import CopiedFile, plan_gather, seed_copies
+from file_manager import check_prg, read_prg
+from records import IssueFlag
+from test_file_manager import make_manager, write_program
+from validation import ValidationCache, ValidationEngine
+
+def copied(name:str, digest:str|None='digest') -> CopiedFile:
+    return CopiedFile(os.path.join('/nc', name), 100, 1.0, digest)
+
+def test_plan_retracts_copies_no_longer_wanted():
+    copies = {'1234.prg':copied('1234.prg'), '1235.prg':copied('1235.prg'), '1236.prg':copied('1236.prg')}
+    plan = plan_gather({'1235.prg':copied('1235.prg')}, copies)
+    assert plan.copy == []
+    assert plan.retract == ['1234.prg', '1236.prg']
+    assert plan.up_to_date == 1
+
+def test_plan_copies_changed_and_new_programs():
+    wanted = {'1234.prg':CopiedFile('/nc/1234.prg', 120, 2.0, 'other'), '1235.prg':copied('1235.prg')}
+    plan = plan_gather(wanted, {'1234.prg':copied('1234.prg')})
+    assert plan.copy == [('/nc/1234.prg', '1234.prg'), ('/nc/1235.prg', '1235.prg')]
+    assert plan.retract == []
+    assert not plan.touched
+
+def test_plan_touched_source_with_same_digest_is_not_copied():
+    touched = CopiedFile('/nc/1234.prg', 100, 2.0, 'digest')
+    plan = plan_gather({'1234.prg':touched}, {'1234.prg':copied('1234.prg')})
+    assert plan.copy == []
+    assert plan.touched == {'1234.prg':touched}
+
+def test_plan_without_digest_copies_again():
+    touched = CopiedFile('/nc/1234.prg', 100, 2.0, None)
+    plan = plan_gather({'1234.prg':touched}, {'1234.prg':copied('1234.prg', None)})
+    assert plan.copy == [('/nc/1234.prg', '1234.prg')]
+
+def test_seed_keeps_matching_and_stale_copies_only():
+    wanted = {'1234.prg':copied('1234.prg'), '1235.prg':copied('1235.prg')}
+    listing = {'1234.prg':(100, 1.0), '1235.prg':(90, 1.0), '1236.prg':(50, 3.0), 'notes.txt':(10, 1.0)}
+    copies = seed_copies(listing, wanted, {'1234.prg', '1235.prg', '1236.prg'})
+    assert copies == {'1234.prg':wanted['1234.prg'], '1236.prg':CopiedFile('', 50, 3.0)}
+    assert plan_gather(wanted, copies).retract == ['1236.prg']
+
+def make_job(tmp_path):
+    job = tmp_path / '100 (1) Job'
+    job.mkdir()
+    for number in (1234, 1235):
+        write_program(job, number)
+    return job
+
+def test_dry_run_changes_nothing(tmp_path):
+    make_job(tmp_path)
+    fm = make_manager(tmp_path, ValidationEngine(read_prg, check_prg, cache=ValidationCache()))
+    try:
+        fm.process()
+        plan = fm.dry_run_gather()
+        assert sorted(name for source, name in plan.copy) == ['1234.prg', '1235.prg']
+        assert not (tmp_path / 'ALL').exists()
+        assert not fm.manifest.knows('all')
+        assert len(fm.manifest) == 0
+    finally:
+        fm.close()
+
+def test_gather_retracts_invalid_and_deleted_programs(tmp_path):
+    job = make_job(tmp_path)
+    write_program(job, 1236)
+    fm = make_manager(tmp_path, ValidationEngine(read_prg, check_prg, cache=ValidationCache()))
+    try:
+        fm.process()
+        assert sorted(fm.copy_all_valid_files()) == ['1234.prg', '1235.prg', '1236.prg']
+
+        (job / '1235.prg').write_text('%O1235 (DS CASE)\nM30\n')
+        os.remove(job / '1236.prg')
+        fm.process()
+        assert fm.processed_files['1235.prg'].issues & IssueFlag.SUBPROGRAM_0_ERR
+
+        plan = fm.dry_run_gather()
+        assert plan.retract == ['1235.prg', '1236.prg']
+        fm.copy_all_valid_files()
+        assert sorted(os.listdir(tmp_path / 'ALL')) == ['1234.prg']
+        assert set(fm.manifest.get('all')) == {'1234.prg'}
+    finally:
+        fm.close()
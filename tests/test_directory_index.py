@@ -0,0 +1,80 @@
+import asyncio
+import os
+
+import pytest
+
+from aio import AsyncIO
+from directory_index import DirectoryIndex
+from file_manager import is_gather_folder
+
+@pytest.fixture
+def aio():
+    aio = AsyncIO(retries=0)
+    yield aio
+    aio.close()
+
+def refresh(index:DirectoryIndex, aio:AsyncIO, **kwargs):
+    added, modified, removed = asyncio.run(index.refresh_async(aio, **kwargs))
+    return sorted(added), sorted(modified), sorted(removed)
+
+def touch(path, mtime:float):
+    os.utime(path, (mtime, mtime))
+
+def make_tree(tmp_path):
+    job = tmp_path / '100 (1) Job'
+    job.mkdir()
+    (job / '1234.prg').write_text('1234')
+    (job / '1235.prg').write_text('1235')
+    (tmp_path / 'ALL').mkdir()
+    (tmp_path / 'ALL' / '1234.prg').write_text('1234')
+    return str(job)
+
+def test_first_refresh_adds_every_file(tmp_path, aio):
+    job = make_tree(tmp_path)
+    index = DirectoryIndex(str(tmp_path), ignore=is_gather_folder)
+    added, modified, removed = refresh(index, aio)
+    assert [(location, name) for location, name, size, mtime in added] == [(job, '1234.prg'), (job, '1235.prg')]
+    assert modified == [] and removed == []
+    assert index.complete
+    assert index.contains(job, '1234.prg')
+    assert not index.contains(os.path.join(str(tmp_path), 'ALL'), '1234.prg')
+
+def test_unchanged_tree_reports_nothing(tmp_path, aio):
+    make_tree(tmp_path)
+    index = DirectoryIndex(str(tmp_path), ignore=is_gather_folder)
+    refresh(index, aio)
+    assert refresh(index, aio) == ([], [], [])
+    assert index.last_refresh['dirs_listed'] == 0
+
+def test_modified_and_removed_files(tmp_path, aio):
+    job = make_tree(tmp_path)
+    index = DirectoryIndex(str(tmp_path), ignore=is_gather_folder)
+    refresh(index, aio)
+
+    path = os.path.join(job, '1234.prg')
+    with open(path, 'w') as file:
+        file.write('12345')
+    touch(path, 2000.0)
+    os.remove(os.path.join(job, '1235.prg'))
+    (tmp_path / '100 (1) Job' / '1236.prg').write_text('1236')
+    touch(job, 3000.0)
+
+    added, modified, removed = refresh(index, aio)
+    assert [(location, name) for location, name, size, mtime in added] == [(job, '1236.prg')]
+    assert modified == [(job, '1234.prg', 5, 2000.0)]
+    assert removed == [(job, '1235.prg')]
+    assert job in index.changed_dirs
+
+def test_removed_directory_removes_its_files(tmp_path, aio):
+    job = make_tree(tmp_path)
+    index = DirectoryIndex(str(tmp_path), ignore=is_gather_folder)
+    refresh(index, aio)
+
+    for name in os.listdir(job):
+        os.remove(os.path.join(job, name))
+    os.rmdir(job)
+
+    added, modified, removed = refresh(index, aio)
+    assert added == [] and modified == []
+    assert removed == [(job, '1234.prg'), (job, '1235.prg')]
+    assert job not in index.dirs
@@ -0,0 +1,55 @@
+import errno
+import os
+
+from change_source import PollingChangeSource
+from file_manager import FileManager, check_prg, is_gather_folder, read_prg
+from validation import ValidationCache, ValidationEngine
+
+PROGRAM = '%O{number} (DS CASE)\n$0\n#100=12.5\n$1\nT0100 (CUT-OFF)\nG97 S1200 M03\nG01 12.5\n$2\nM30\n'
+
+def write_program(folder, number:int) -> str:
+    path = os.path.join(folder, f'{number}.prg')
+    with open(path, 'w') as file:
+        file.write(PROGRAM.format(number=number))
+    return path
+
+def make_manager(root, validator:ValidationEngine) -> FileManager:
+    return FileManager(str(root), change_source_factory=lambda root: PollingChangeSource(root, ignore=is_gather_folder), validator=validator)
+
+def test_read_error_is_retried_on_next_pass(tmp_path):
+    job = tmp_path / '100 (1) Job'
+    job.mkdir()
+    broken = write_program(job, 1234)
+    write_program(job, 1235)
+    failures = {broken}
+
+    def read(path):
+        if path in failures:
+            failures.discard(path)
+            raise OSError(errno.EIO, 'Input/output error', path)
+        return read_prg(path)
+
+    fm = make_manager(tmp_path, ValidationEngine(read, check_prg, cache=ValidationCache()))
+    try:
+        fm.process()
+        assert set(fm.processed_files) == {'1235.prg'}
+        fm.process()
+        assert set(fm.processed_files) == {'1234.prg', '1235.prg'}
+        assert fm.issues() == []
+    finally:
+        fm.close()
+
+def test_parse_workers_parse_in_processes(tmp_path):
+    job = tmp_path / '100 (1) Job'
+    job.mkdir()
+    for number in (1234, 1235):
+        write_program(job, number)
+    validator = ValidationEngine(read_prg, check_prg, parse_workers=2, cache=ValidationCache())
+    fm = make_manager(tmp_path, validator)
+    try:
+        fm.process()
+        assert validator.parse_pool is not None
+        assert set(fm.processed_files) == {'1234.prg', '1235.prg'}
+        assert fm.issues() == []
+    finally:
+        fm.close()
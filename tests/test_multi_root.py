@@ -0,0 +1,8 @@
+import pytest
+
+from multi_root import MultiRootManager
+
+@pytest.mark.parametrize('intervals', [{'hot_interval':0}, {'cold_interval':0}, {'cold_interval':-1.0}])
+def test_intervals_must_be_positive(tmp_path, intervals):
+    with pytest.raises(ValueError):
+        MultiRootManager(base=str(tmp_path), **intervals)
@@ -0,0 +1,127 @@
+import io
+
+import pytest
+
+from file_manager import check_file, check_prg
+import prg_parser
+from prg_parser import TOKENS, check_summary, compile_tokens, parse_prg, token_regex
+from records import IssueType, to_flags
+
+# Representative programs and what the original check_file reported for each,
+# so a change to RULES or TOKENS that changes a result shows up here. The
+# expected issues were produced by running that check_file on these files.
+
+UG = '#101=1.0\n#102=1.0\n#103=1.0\n#104=1.0\n#105=1.0\n'
+CUT = 'T0100 (CUT-OFF)\nG97 S1200 M03\nG01 {}\n'
+ATPL_CUT = 'T0100 (CUT-OFF)\nG97 S1200 M03\nG00 X1.2\nM08\nG01 X0 Z{}\n'
+
+PROGRAMS = {
+    'ds': ('1234.prg', '%O1234 (DS CASE)\n$0\n#100=12.5\n$1\n' + CUT.format(12.5) + '$2\nM30\n%\n'),
+    'ds crlf': ('1234.prg', ('%O1234 (DS CASE)\n$0\n#100=12.5\n$1\n' + CUT.format(12.5) + '$2\nM30\n%\n').replace('\n', '\r\n')),
+    'ds within tolerance': ('1234.prg', '%O1234 (DS CASE)\n$0\n#100=12.5\n$1\n' + CUT.format(12.51) + '$2\n'),
+    'ds part length off': ('1234.prg', '%O1234 (DS CASE)\n$0\n#100=12.5\n$1\n' + CUT.format(12.6) + '$2\n'),
+    'ds part length replaced': ('1234.prg', '%O1234 (DS CASE)\n$0\n#100=12.5\n$1\n' + CUT.format(12.5) + '$2\n#100=14.0\n'),
+    'ds part length corrected': ('1234.prg', '%O1234 (DS CASE)\n$0\n#100=11.0\n$1\n$2\n#100=12.5\n' + CUT.format(12.5)),
+    'ds empty part length': ('1234.prg', '%O1234 (DS CASE)\n$0\n#100=12.5\n#100=\n$1\n' + CUT.format(12.5) + '$2\n'),
+    'ds cut-off replaced': ('1234.prg', '%O1234 (DS CASE)\n$0\n#100=12.5\n$1\n$2\n' + CUT.format(12.5) + CUT.format(13.0)),
+    'ds no part length': ('1234.prg', '%O1234 (DS CASE)\n$0\n$1\n$2\n'),
+    'ds cut-off first': ('1234.prg', '%O1234 (DS CASE)\n' + CUT.format(12.5) + '$0\n$1\n$2\n#100=12.5\n'),
+    'ds empty part length later': ('1234.prg', '%O1234 (DS CASE)\n$0\n$1\n$2\n#100=12.5\n' + CUT.format(12.5) + '#100= \n'),
+    'ds header only': ('1234.prg', '%O1234 (DS CASE)'),
+    'ds missing subprograms': ('1234.prg', '%O1234 (DS CASE)\n$1\n#100=12.5\n' + CUT.format(12.5)),
+    'ds wrong internal name': ('1234.prg', '%O4321 (DS CASE)\n$0\n#100=12.5\n$1\n' + CUT.format(12.5) + '$2\n'),
+    'ds invalid name': ('p1234.prg', '%Op1234 (DS CASE)\n$0\n#100=12.5\n$1\n' + CUT.format(12.5) + '$2\n'),
+    'ds upper case name': ('1234.PRG', '%O1234 (DS CASE)\n$0\n#100=12.5\n$1\n' + CUT.format(12.5) + '$2\n'),
+    'asc': ('1234.prg', '%O1234 (ASC CASE)\n$0\n#100=20.0\n' + UG + '$1\n' + CUT.format(20.0) + '$2\n'),
+    'asc crlf': ('1234.prg', ('%O1234 (ASC CASE)\n$0\n#100=20.0\n' + UG + '$1\n' + CUT.format(20.0) + '$2\n').replace('\n', '\r\n')),
+    'asc missing ug value': ('1234.prg', '%O1234 (ASC CASE)\n$0\n#100=20.0\n' + UG.replace('#103=1.0\n', '') + '$1\n' + CUT.format(20.0) + '$2\n'),
+    'asc 4001': ('4001.prg', '%O4001 (ASC CASE)\n$0\n#100=20.0\n' + UG + '$1\n' + CUT.format(20.0) + '$2\n'),
+    'asc part length replaced after ug values': ('1234.prg', '%O1234 (ASC CASE)\n$0\n$1\n$2\n' + UG + '#100=20.0\n' + CUT.format(20.0) + '#100=21.0\n'),
+    'tloc': ('1234.prg', '%O1234 (T-L CASE)\n$0\n#100=8.25\n' + UG + '$1\n' + CUT.format(8.25) + '$2\n'),
+    'tloc cut-off replaced': ('1234.prg', '%O1234 (TLOC CASE)\n$0\n#100=8.25\n' + UG + '$1\n$2\n' + CUT.format(8.25) + CUT.format(9.0)),
+    'tlcs missing ug values': ('1234.prg', '%O1234 (TLCS CASE)\n$0\n#100=8.25\n$1\n' + CUT.format(8.25) + '$2\n'),
+    'aot': ('1234.prg', '%O1234 (AOT14 CASE)\n$0\n#100=30.0\n' + UG + '$1\n' + CUT.format(30.0) + '$2\n'),
+    'aot missing ug value': ('1234.prg', '%O1234 (AOT14 CASE)\n$0\n#100=30.0\n' + UG.replace('#101=1.0\n', '') + '$1\n' + CUT.format(30.01) + '$2\n'),
+    'atpl': ('1234.prg', '%O1234 (ATPL CASE)\n$0\n#100=5.5\n$1\n' + ATPL_CUT.format(5.5) + '$2\n'),
+    'atpl crlf': ('1234.prg', ('%O1234 (ATPL CASE)\n$0\n#100=5.5\n$1\n' + ATPL_CUT.format(5.5) + '$2\n').replace('\n', '\r\n')),
+    'atpl part length off': ('1234.prg', '%O1234 (ATPL CASE)\n$0\n#100=5.5\n$1\n' + ATPL_CUT.format(6.0) + '$2\n'),
+    'atpl cut-off replaced': ('1234.prg', '%O1234 (ATPL CASE)\n$0\n$1\n$2\n#100=5.5\n' + ATPL_CUT.format(5.5) + ATPL_CUT.format(7.5)),
+}
+
+EXPECTED = {
+    'ds': ('DS', []),
+    'ds crlf': ('DS', []),
+    'ds within tolerance': ('DS', []),
+    'ds part length off': ('DS', [IssueType.PART_LENGTH_ERR]),
+    'ds part length replaced': ('DS', [IssueType.PART_LENGTH_ERR]),
+    'ds part length corrected': ('DS', []),
+    'ds empty part length': ('DS', []),
+    'ds cut-off replaced': ('DS', [IssueType.PART_LENGTH_ERR]),
+    'ds no part length': ('DS', []),
+    'ds cut-off first': ('DS', []),
+    'ds empty part length later': ('DS', []),
+    'ds header only': ('DS', [IssueType.SUBPROGRAM_0_ERR, IssueType.SUBPROGRAM_1_ERR, IssueType.SUBPROGRAM_2_ERR]),
+    'ds missing subprograms': ('DS', [IssueType.SUBPROGRAM_0_ERR, IssueType.SUBPROGRAM_2_ERR]),
+    'ds wrong internal name': ('DS', [IssueType.INTERNAL_NAME_ERR]),
+    'ds invalid name': ('DS', [IssueType.INVALID_NAME_ERR]),
+    'ds upper case name': ('DS', []),
+    'asc': ('ASC', []),
+    'asc crlf': ('ASC', []),
+    'asc missing ug value': ('ASC', [IssueType.MISSING_UG_VALUES_ERR]),
+    'asc 4001': ('ASC', [IssueType.INVALID_NAME_ERR]),
+    'asc part length replaced after ug values': ('ASC', [IssueType.PART_LENGTH_ERR]),
+    'tloc': ('TLOC', []),
+    'tloc cut-off replaced': ('TLOC', [IssueType.PART_LENGTH_ERR]),
+    'tlcs missing ug values': ('TLOC', [IssueType.MISSING_UG_VALUES_ERR]),
+    'aot': ('AOT', []),
+    'aot missing ug value': ('AOT', [IssueType.MISSING_UG_VALUES_ERR]),
+    'atpl': ('ATPL', []),
+    'atpl crlf': ('ATPL', []),
+    'atpl part length off': ('ATPL', [IssueType.PART_LENGTH_ERR]),
+    'atpl cut-off replaced': ('ATPL', [IssueType.PART_LENGTH_ERR]),
+}
+
+@pytest.mark.parametrize('key', PROGRAMS)
+def test_check_prg(key):
+    file_name, text = PROGRAMS[key]
+    case_type, issues = EXPECTED[key]
+    result = check_prg(file_name, text.encode())
+    assert result.issues == to_flags(issues)
+    assert result.case_type == case_type
+
+@pytest.mark.parametrize('key', PROGRAMS)
+def test_check_file(key, tmp_path):
+    file_name, text = PROGRAMS[key]
+    path = tmp_path / file_name
+    path.write_bytes(text.encode())
+    assert check_file(str(path)) == EXPECTED[key][1]
+
+@pytest.mark.parametrize('block_lines', [1, 2, 3, 5])
+@pytest.mark.parametrize('key', PROGRAMS)
+def test_tokens_across_blocks(key, block_lines, monkeypatch):
+    # Cut-off values that sit in a later block than their T0100 (CUT-OFF).
+    monkeypatch.setattr(prg_parser, 'BLOCK_LINES', block_lines)
+    file_name, text = PROGRAMS[key]
+    text = text.replace('\r\n', '\n')
+    assert check_summary(file_name, parse_prg(text)) == EXPECTED[key][1]
+
+def test_last_part_length_counts():
+    file_name, text = PROGRAMS['ds part length replaced']
+    assert parse_prg(text).part_length == 14.0
+
+def test_lines_iterable():
+    file_name, text = PROGRAMS['atpl cut-off replaced']
+    assert parse_prg(io.StringIO(text)) == parse_prg(text)
+
+def test_tokens_are_found_in_order():
+    text = '$0\n#100=12.5\n#101=1\nT0100 (CUT-OFF)\n$2\n#1000=3\n'
+    assert [match.lastgroup for match in token_regex.finditer(text)] == ['subprogram', 'part_length', 'ug_value', 'cut_off', 'subprogram']
+
+def test_compile_tokens_subset():
+    regex = compile_tokens({name:TOKENS[name] for name in ('part_length', 'cut_off')})
+    text = '$0\n#100= 12.5 \n#102=1\nT0100 (CUT-OFF)\n'
+    assert [(match.lastgroup, match.group()) for match in regex.finditer(text)] == [('part_length', '#100= 12.5 '), ('cut_off', 'T0100 (CUT-OFF)')]
+
+def test_missing_cut_off_value():
+    with pytest.raises(IndexError):
+        parse_prg('%O1234 (DS CASE)\n$0\n#100=12.5\nT0100 (CUT-OFF)\nG97 S1200 M03\n')
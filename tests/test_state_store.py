@@ -0,0 +1,91 @@
+from copy_manifest import CopiedFile, CopyManifest
+from duplicate_index import DuplicateIndex
+from file_manager import check_prg, read_prg
+from records import DuplicateRecord, IssueFlag, PrgRecord
+from state_store import SqliteStateStore
+from test_file_manager import make_manager, write_program
+from validation import ValidationCache, ValidationEngine
+
+def test_files_round_trip(tmp_path):
+    record = PrgRecord('/nc/job', 1.0, IssueFlag.PART_LENGTH_ERR | IssueFlag.NAME_CONFLICT_ERR, case_type='DS')
+    record.duplicates['/nc/other'] = DuplicateRecord('/nc/other', 2.0, IssueFlag.DUPLICATE_PRG_ERR, 'ASC')
+    processed_files = {'1234.prg':record, '1235.prg':PrgRecord('/nc/job', 3.0, IssueFlag(0))}
+    store = SqliteStateStore(str(tmp_path / 'state.db'))
+    try:
+        store.write_files(processed_files, processed_files)
+        loaded = store.read_files()
+        assert set(loaded) == {'1234.prg', '1235.prg'}
+        assert (loaded['1234.prg'].location, loaded['1234.prg'].mtime, loaded['1234.prg'].issues, loaded['1234.prg'].case_type) == \
+            ('/nc/job', 1.0, IssueFlag.PART_LENGTH_ERR | IssueFlag.NAME_CONFLICT_ERR, 'DS')
+        duplicate = loaded['1234.prg'].duplicates['/nc/other']
+        assert (duplicate.mtime, duplicate.issues, duplicate.case_type) == (2.0, IssueFlag.DUPLICATE_PRG_ERR, 'ASC')
+        assert loaded['1235.prg'].issues == IssueFlag(0)
+
+        del processed_files['1235.prg']
+        store.write_files(processed_files, ['1235.prg'])
+        assert set(store.read_files()) == {'1234.prg'}
+    finally:
+        store.close()
+
+def test_meta_directories_copies_and_programs_round_trip(tmp_path):
+    store = SqliteStateStore(str(tmp_path / 'state.db'))
+    try:
+        assert store.is_empty()
+        store.set_meta('date', '2026-10-18')
+        assert store.get_meta('date') == '2026-10-18'
+        assert not store.is_empty()
+
+        snapshot = {'mtime':1.0, 'files':{'1234.prg':[100, 1.0]}, 'subdirs':[]}
+        store.write_directories({'/nc/job':snapshot}, ['/nc/job'])
+        assert store.read_directories() == {'/nc/job':snapshot}
+
+        manifest = CopyManifest()
+        manifest.seed('all', '/nc/ALL', {'1234.prg':CopiedFile('/nc/job/1234.prg', 100, 1.0, 'digest')})
+        store.write_copies(manifest, 'all', ['1234.prg'])
+        loaded = store.read_copies()
+        assert loaded.folders == {'all':'/nc/ALL'}
+        assert loaded.get('all') == manifest.get('all')
+
+        index = DuplicateIndex()
+        index.add('1234.prg', '/nc/job', '2026-10-18', 'digest', 100, 1.0)
+        store.write_programs(index, [('1234.prg', '/nc/job')])
+        loaded_index = DuplicateIndex()
+        store.read_programs(loaded_index)
+        assert loaded_index.get('1234.prg', '/nc/job') == index.get('1234.prg', '/nc/job')
+
+        store.clear_files()
+        assert store.read_directories() == {}
+        assert not store.read_copies().knows('all')
+        # Previous days' programs outlive clear_files().
+        store.read_programs(loaded_index)
+        assert loaded_index.get('1234.prg', '/nc/job') is not None
+    finally:
+        store.close()
+
+def test_reopened_store_keeps_state(tmp_path):
+    job = tmp_path / '100 (1) Job'
+    job.mkdir()
+    write_program(job, 1234)
+    (job / '1235.prg').write_text('%O1235 (DS CASE)\nM30\n')
+    db_path = str(tmp_path / 'state.db')
+
+    fm = make_manager(tmp_path, ValidationEngine(read_prg, check_prg, cache=ValidationCache()))
+    try:
+        fm.open_store(db_path)
+        fm.process()
+        fm.copy_all_valid_files()
+        issues = fm.issues()
+        copies = dict(fm.manifest.get('all'))
+        assert issues
+    finally:
+        fm.close()
+
+    fm = make_manager(tmp_path, ValidationEngine(read_prg, check_prg, cache=ValidationCache()))
+    try:
+        fm.open_store(db_path)
+        assert fm.store.connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        assert fm.issues() == issues
+        assert fm.manifest.get('all') == copies
+        assert set(fm.processed_files) == {'1234.prg', '1235.prg'}
+    finally:
+        fm.close()
@@ -0,0 +1,33 @@
+from change_events import ChangeBatcher, ChangeEvent, ChangeKind
+from records import IssueFlag
+from status_api import StatusFeed
+
+class Manager:
+    root = 'root'
+
+    def __init__(self):
+        self.events = ChangeBatcher(0.0)
+
+    def entries(self):
+        return []
+
+def changed(fm, name:str):
+    fm.events.emit(ChangeEvent(ChangeKind.FILE_ADDED, name, 'job', IssueFlag.PART_LENGTH_ERR))
+    fm.events.flush()
+
+def test_changes_since():
+    fm = Manager()
+    feed = StatusFeed(fm)
+    changed(fm, '1234.prg')
+    changed(fm, '1235.prg')
+    assert [change['name'] for change in feed.changes_since(0, 0)['changes']] == ['1234.prg', '1235.prg']
+    assert feed.changes_since(2, 0) == {'version':2, 'changes':[]}
+    assert feed.changes_since(5, 0) == {'version':2, 'reset':True}
+
+def test_changes_since_without_history():
+    fm = Manager()
+    feed = StatusFeed(fm, history=0)
+    assert feed.changes_since(0, 0) == {'version':0, 'changes':[]}
+    changed(fm, '1234.prg')
+    assert feed.changes_since(1, 0) == {'version':1, 'changes':[]}
+    assert feed.changes_since(0, 0) == {'version':1, 'reset':True}
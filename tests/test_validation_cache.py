@@ -0,0 +1,25 @@
+from file_manager import decode_cached_result, encode_cached_result
+from records import IssueFlag, PrgResult
+from validation import ValidationCache
+
+def saved_cache(rules) -> dict:
+    cache = ValidationCache()
+    cache.put('1234.prg', 100, 1.0, 'digest', PrgResult(IssueFlag.PART_LENGTH_ERR, 'DS'))
+    return cache.to_dict(encode_cached_result, rules)
+
+def test_same_rules_are_loaded():
+    cache = ValidationCache()
+    cache.from_dict(saved_cache(1), decode_cached_result, 1)
+    assert cache.lookup_stat('1234.prg', 100, 1.0) == ('digest', PrgResult(IssueFlag.PART_LENGTH_ERR, 'DS'))
+
+def test_other_rules_are_dropped():
+    cache = ValidationCache()
+    cache.from_dict(saved_cache(1), decode_cached_result, 2)
+    assert len(cache) == 0
+
+def test_unversioned_cache_is_dropped_on_deferred_load():
+    data = saved_cache(1)
+    del data['rules']
+    cache = ValidationCache()
+    cache.defer_load(lambda: data, decode_cached_result, 1)
+    assert cache.lookup_stat('1234.prg', 100, 1.0) is None
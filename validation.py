@@ -0,0 +1,229 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from metrics import DEFAULT_METRICS, Metrics
+
+# Runs PRG checks for a batch of files. Reading happens on a bounded thread pool
+# since it is network bound; parsing can optionally be handed to a process pool.
+# Requests are deduplicated per (path, mtime) so a file is read once per batch.
+# FileManager reads through its AsyncIO instead of io_pool, with io_workers as
+# the bound on reads in flight; parsing still goes to the process pool.
+
+class ValidationCache:
+    # Results are stored per (file name, content hash) because the name rules
+    # depend on the file name. (name, size, mtime) -> hash lets unchanged files
+    # skip reading entirely; the hash lookup catches copies of a program that
+    # were posted again with a different mtime.
+    #
+    # The saved form carries the version of the rules that produced the
+    # results; a saved cache of another version is dropped on load rather
+    # than served after the rules changed.
+    def __init__(self, max_entries:int=20000):
+        self.max_entries = max_entries
+        self.stat_keys:OrderedDict = OrderedDict()
+        self.results:OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        # (load, decode, rules) set by defer_load(), run on first use.
+        self.deferred = None
+        # Bumped on every change, so a saved copy can tell it is out of date.
+        self.version = 0
+
+    def _touch(self, table:OrderedDict, key, value=None):
+        if value is not None:
+            table[key] = value
+        table.move_to_end(key)
+        while len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def defer_load(self, load, decode, rules=None):
+        # load() returns what to_dict() produced, or None. It is called the
+        # first time the cache is used instead of now, which keeps a large
+        # cache off the startup path.
+        with self.lock:
+            self.deferred = (load, decode, rules)
+
+    def _load_deferred(self):
+        # Called with the lock held.
+        if self.deferred is None:
+            return
+        load, decode, rules = self.deferred
+        self.deferred = None
+        data = load()
+        if data:
+            self._from_dict(data, decode, rules)
+
+    def is_loaded(self) -> bool:
+        # False while a deferred load has not run, i.e. nothing has changed.
+        return self.deferred is None
+
+    def lookup_stat(self, name:str, size:int, mtime:float) -> tuple[str, object]|None:
+        # (content hash, result) for an unchanged file, or None.
+        with self.lock:
+            self._load_deferred()
+            digest = self.stat_keys.get((name, size, mtime))
+            if digest is None or (name, digest) not in self.results:
+                return None
+            self._touch(self.stat_keys, (name, size, mtime))
+            self._touch(self.results, (name, digest))
+            return digest, self.results[(name, digest)]
+
+    def get_by_digest(self, name:str, size:int, mtime:float, digest:str):
+        with self.lock:
+            self._load_deferred()
+            result = self.results.get((name, digest))
+            if result is not None:
+                self._touch(self.results, (name, digest))
+                self._touch(self.stat_keys, (name, size, mtime), digest)
+            return result
+
+    def put(self, name:str, size:int, mtime:float, digest:str, result):
+        with self.lock:
+            self._load_deferred()
+            self._touch(self.results, (name, digest), result)
+            self._touch(self.stat_keys, (name, size, mtime), digest)
+            self.version += 1
+
+    def __len__(self):
+        with self.lock:
+            self._load_deferred()
+            return len(self.results)
+
+    def to_dict(self, encode, rules=None) -> dict:
+        with self.lock:
+            self._load_deferred()
+            stat_keys = [[name, size, mtime, digest] for (name, size, mtime), digest in self.stat_keys.items()]
+            results = [[name, digest, encode(result)] for (name, digest), result in self.results.items()]
+        return {'rules':rules, 'stat_keys':stat_keys, 'results':results}
+
+    def from_dict(self, data:dict, decode, rules=None):
+        with self.lock:
+            self.deferred = None
+            self._from_dict(data, decode, rules)
+            self.version += 1
+
+    def _from_dict(self, data:dict, decode, rules=None):
+        if data.get('rules') != rules:
+            self.stat_keys = OrderedDict()
+            self.results = OrderedDict()
+            return
+        self.stat_keys = OrderedDict(((name, size, mtime), digest) for name, size, mtime, digest in data.get('stat_keys', []))
+        self.results = OrderedDict(((name, digest), decode(result)) for name, digest, result in data.get('results', []))
+
+class ValidationEngine:
+    def __init__(self, read, parse, io_workers:int=8, parse_workers:int=0, cache:ValidationCache|None=None, metrics:Metrics|None=None):
+        # read(path) returns the raw file contents and parse(name, data) turns
+        # them into a result. parse must be a module level function when
+        # parse_workers > 0 so it can be sent to the process pool.
+        self.read = read
+        self.parse = parse
+        self.io_workers = io_workers
+        self.parse_workers = parse_workers
+        self.cache = cache
+        self.metrics = metrics if metrics else DEFAULT_METRICS
+
+        self.io_pool = None
+        self.parse_pool = None
+        self.pools_lock = threading.Lock()
+
+    def _pools(self):
+        with self.pools_lock:
+            if self.io_pool is None:
+                self.io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix='prg-io')
+        return self.io_pool, self._parse_pool()
+
+    def _parse_pool(self) -> ProcessPoolExecutor|None:
+        # Started on first use, from whichever thread reads first.
+        with self.pools_lock:
+            if self.parse_workers and self.parse_pool is None:
+                self.parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers)
+            return self.parse_pool
+
+    def _validate_file(self, path:str, size:int, mtime:float):
+        name = os.path.basename(path)
+        start = time.perf_counter()
+        data = self.read(path)
+        read_done = time.perf_counter()
+        self.metrics.add_time('read', read_done - start)
+        self.metrics.count('files_read')
+        self.metrics.count('bytes_read', len(data))
+
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        if self.cache is not None:
+            result = self.cache.get_by_digest(name, size, mtime, digest)
+            if result is not None:
+                self.metrics.count('cache_hits_digest')
+                self.metrics.file_time(path, time.perf_counter() - start)
+                return result, digest
+
+        parse_pool = self._parse_pool()
+        if parse_pool:
+            result = parse_pool.submit(self.parse, name, data).result()
+        else:
+            result = self.parse(name, data)
+        self.metrics.add_time('parse', time.perf_counter() - read_done)
+        self.metrics.count('files_parsed')
+        self.metrics.file_time(path, time.perf_counter() - start)
+
+        if self.cache is not None:
+            self.cache.put(name, size, mtime, digest, result)
+        return result, digest
+
+    def check(self, request) -> tuple:
+        # Checks one (path, size, mtime) request without the stat cache and
+        # returns (result or exception, content hash or None). This is the
+        # blocking step the asyncio side runs on its own executor.
+        try:
+            return self._validate_file(*request)
+        except Exception as e:
+            return e, None
+
+    def split_cached(self, requests) -> tuple[dict, dict, list]:
+        # (results, digests, pending): the results and hashes of requests the
+        # stat cache already answers, and the requests that need reading.
+        results = {}
+        digests = {}
+        pending = []
+        for request in dict.fromkeys(requests):
+            path, size, mtime = request
+            found = self.cache.lookup_stat(os.path.basename(path), size, mtime) if self.cache is not None else None
+            if found is not None:
+                digests[request], results[request] = found
+                self.metrics.count('cache_hits_stat')
+            else:
+                pending.append(request)
+        return results, digests, pending
+
+    def validate(self, requests) -> dict:
+        # requests is an iterable of (path, size, mtime). Returns a dict keyed by
+        # the same tuples holding the result, or the exception raised while
+        # checking that file.
+        return self.validate_with_digests(requests)[0]
+
+    def validate_with_digests(self, requests) -> tuple[dict, dict]:
+        # Like validate(), plus a dict of the content hash of every file that
+        # could be read.
+        results, digests, pending = self.split_cached(requests)
+        if len(pending) <= 1 or self.io_workers <= 1:
+            outcomes = {request:self.check(request) for request in pending}
+        else:
+            io_pool, parse_pool = self._pools()
+            futures = {request:io_pool.submit(self.check, request) for request in pending}
+            outcomes = {request:future.result() for request, future in futures.items()}
+
+        for request, (result, digest) in outcomes.items():
+            results[request] = result
+            if digest is not None:
+                digests[request] = digest
+        return results, digests
+
+    def close(self):
+        if self.io_pool:
+            self.io_pool.shutdown(wait=False, cancel_futures=True)
+            self.io_pool = None
+        if self.parse_pool:
+            self.parse_pool.shutdown(wait=False, cancel_futures=True)
+            self.parse_pool = None
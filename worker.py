@@ -0,0 +1,115 @@
+import logging
+import queue
+import threading
+
+from aio import ShareUnavailable
+from change_events import ChangeKind
+
+# Runs everything that touches the share on one background thread: the scan
+# loop, auto-gather and gathers requested from the UI. The UI never calls into
+# FileManager while the worker is running; it reads results from self.results,
+# which holds tuples of:
+#   ('issues', [(file name, location, IssueType), ...])   a full snapshot
+#   ('changes', [ChangeEvent, ...])                       what changed since
+#   ('progress', kind, done, total)
+#   ('gather_done', kind, copied count, cancelled)
+#   ('error', message)
+
+log = logging.getLogger(__name__)
+
+GATHER_ALL = 'all'
+GATHER_ASC = 'asc'
+
+class BackgroundWorker:
+    def __init__(self, fm, poll_timeout:float=0.25):
+        self.fm = fm
+        self.poll_timeout = poll_timeout
+        self.results = queue.Queue()
+        self.jobs = queue.Queue()
+        self.stop_event = threading.Event()
+        self.auto_gather_event = threading.Event()
+        self.cancel_event = threading.Event()
+        self.auto_gather_pending = False
+        self.thread = threading.Thread(target=self.run, name='file-manager-worker', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout:float|None=None):
+        self.stop_event.set()
+        self.cancel_event.set()
+        self.fm.change_source.stop()
+        self.thread.join(timeout)
+
+    def set_auto_gather(self, enabled:bool):
+        if enabled:
+            self.auto_gather_pending = True
+            self.auto_gather_event.set()
+        else:
+            self.auto_gather_event.clear()
+
+    def request_gather(self, kind:str):
+        self.jobs.put(kind)
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def _gather(self, kind:str):
+        self.cancel_event.clear()
+        progress = lambda done, total: self.results.put(('progress', kind, done, total))
+        copied = []
+        # The UI waits for gather_done to enable its buttons again, so it is
+        # sent even when the gather fails.
+        try:
+            if kind == GATHER_ASC:
+                copied = self.fm.copy_asc_files(progress, self.cancel_event)
+            else:
+                copied = self.fm.copy_all_valid_files(progress, self.cancel_event)
+        finally:
+            self.results.put(('gather_done', kind, len(copied), self.cancel_event.is_set()))
+
+    def run(self):
+        first_pass = True
+        while not self.stop_event.is_set():
+            try:
+                try:
+                    kind = self.jobs.get_nowait()
+                except queue.Empty:
+                    kind = None
+                if kind:
+                    self._gather(kind)
+                    continue
+
+                if self.fm.update(self.poll_timeout) or first_pass:
+                    self.auto_gather_pending = True
+                # The first pass and a reset send everything; after that only
+                # the coalesced changes go to the UI.
+                if first_pass:
+                    self.fm.events.flush()
+                    self.results.put(('issues', self.fm.issues()))
+                else:
+                    changes = self.fm.events.flush_due()
+                    if any(event.kind is ChangeKind.RESET for event in changes):
+                        self.results.put(('issues', self.fm.issues()))
+                    elif changes:
+                        self.results.put(('changes', changes))
+                first_pass = False
+
+                # Only gather again after something changed on the share.
+                if self.auto_gather_event.is_set() and self.auto_gather_pending:
+                    self.auto_gather_pending = False
+                    self.fm.copy_all_valid_files(cancel_event=self.stop_event)
+            except ShareUnavailable as e:
+                # Wait for the breaker instead of running straight back into
+                # the share.
+                self.results.put(('error', str(e)))
+                self.stop_event.wait(max(self.poll_timeout, self.fm.aio.breaker(self.fm.root).retry_after()))
+            except (FileNotFoundError, UnicodeDecodeError, PermissionError, OSError) as e:
+                self.results.put(('error', f'{type(e).__name__}: {e}'))
+                self.stop_event.wait(self.poll_timeout)
+            except Exception as e:
+                # Anything else is a bug, but the worker keeps the scan loop
+                # going rather than leaving the UI on a dead thread.
+                log.exception("Worker pass failed")
+                self.results.put(('error', f'{type(e).__name__}: {e}'))
+                self.stop_event.wait(self.poll_timeout)